@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from storage_backends import StorageBackend, get_storage_backend
+
+logger = logging.getLogger(__name__)
+
+# votes and feedbacks are appended to the buffer and written in batches
+# (puts with BatchWriteItem, updates one by one, several items of one key are merged into one write).
+# Adding never writes, the buffer is flushed after the replies: at the end of an invocation, or by
+# flush_if_due when it has ANALYTICS_BUFFER_SIZE items or its oldest item is older than ANALYTICS_BUFFER_SECONDS
+ANALYTICS_BUFFER_SIZE = int(os.getenv('ANALYTICS_BUFFER_SIZE', '25'))
+ANALYTICS_BUFFER_SECONDS = float(os.getenv('ANALYTICS_BUFFER_SECONDS', '5'))
+
+
+class AnalyticsBuffer:
+    def __init__(
+            self,
+            backend: Optional[StorageBackend] = None,
+            max_size: int = ANALYTICS_BUFFER_SIZE,
+            max_age_seconds: float = ANALYTICS_BUFFER_SECONDS
+    ):
+        self.backend = backend
+        self.max_size = max_size
+        self.max_age_seconds = max_age_seconds
+        # (table name, key, attributes, is update)
+        self.items: list[tuple[str, dict, dict, bool]] = []
+        self.oldest_item_time: Optional[float] = None
+        self.lock = threading.Lock()
+        # only one flush writes at a time, so the items of one key are written in order
+        self.flush_lock = threading.Lock()
+
+    def get_backend(self) -> StorageBackend:
+        if self.backend is None:
+            self.backend = get_storage_backend()
+        return self.backend
+
+    def add(self, table_name: str, key: dict, attributes: dict):
+        self.__append(table_name, key, attributes, False)
+
+    def add_update(self, table_name: str, key: dict, values: dict):
+        # other attributes of the item are kept, like with update_item
+        self.__append(table_name, key, values, True)
+
+    def __append(self, table_name: str, key: dict, attributes: dict, is_update: bool):
+        with self.lock:
+            self.items.append((table_name, key, attributes, is_update))
+            if self.oldest_item_time is None:
+                self.oldest_item_time = time.monotonic()
+
+    def is_due(self) -> bool:
+        with self.lock:
+            if len(self.items) == 0:
+                return False
+            return len(self.items) >= self.max_size \
+                or time.monotonic() - self.oldest_item_time >= self.max_age_seconds
+
+    def flush_if_due(self):
+        if self.is_due():
+            self.flush()
+
+    def size(self) -> int:
+        with self.lock:
+            return len(self.items)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                items = self.items
+                self.items = []
+                self.oldest_item_time = None
+            if len(items) == 0:
+                return
+
+            for table_name, (puts, updates) in merge_items(items).items():
+                try:
+                    if len(puts) > 0:
+                        self.get_backend().batch_put_items(table_name, puts)
+                    for key, values in updates:
+                        self.get_backend().update_item(table_name, key, values)
+                except Exception as err:
+                    # the reply is already sent, analytics are not worth failing the update and its redelivery.
+                    # Not only StorageError: botocore connection errors and timeouts are raised as they are
+                    logger.error(
+                        "Couldn't write %s items to table %s. Items: %s "
+                        "Here's why: %s",
+                        len(puts) + len(updates), table_name, puts + updates,
+                        err,
+                        exc_info=True
+                    )
+
+
+def merge_items(items: list[tuple[str, dict, dict, bool]]) -> dict[str, tuple[list, list]]:
+    # an update after a put of the same key is added to the put, the last put replaces everything before it
+    merged_by_table: dict[str, dict[tuple, list]] = dict()
+    for table_name, key, attributes, is_update in items:
+        merged = merged_by_table.setdefault(table_name, dict())
+        key_tuple = tuple(sorted(key.items()))
+        item = merged.get(key_tuple)
+        if item is None or not is_update:
+            merged[key_tuple] = [key, dict(attributes), is_update]
+        else:
+            item[1].update(attributes)
+
+    result = dict()
+    for table_name, merged in merged_by_table.items():
+        puts = [(key, attributes) for key, attributes, is_update in merged.values() if not is_update]
+        updates = [(key, attributes) for key, attributes, is_update in merged.values() if is_update]
+        result[table_name] = (puts, updates)
+    return result
+
+
+ANALYTICS_BUFFER = AnalyticsBuffer()
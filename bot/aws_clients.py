@@ -0,0 +1,54 @@
+import logging
+import os
+import threading
+
+import boto3
+from botocore.client import BaseClient
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '20'))
+AWS_CONNECT_TIMEOUT = float(os.getenv('AWS_CONNECT_TIMEOUT', '2'))
+AWS_READ_TIMEOUT = float(os.getenv('AWS_READ_TIMEOUT', '5'))
+AWS_MAX_ATTEMPTS = int(os.getenv('AWS_MAX_ATTEMPTS', '3'))
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+    connect_timeout=AWS_CONNECT_TIMEOUT,
+    read_timeout=AWS_READ_TIMEOUT,
+    retries={'mode': 'adaptive', 'max_attempts': AWS_MAX_ATTEMPTS},
+    tcp_keepalive=True,
+)
+
+aws_session = None
+aws_clients: dict[tuple[str, str], BaseClient] = dict()
+aws_clients_lock = threading.Lock()
+
+
+def get_session() -> boto3.session.Session:
+    global aws_session
+
+    with aws_clients_lock:
+        if aws_session is None:
+            try:
+                aws_session = boto3.session.Session()
+            except Exception as error:
+                logger.error('Error: cannot create service session: %s', error)
+                raise error
+        return aws_session
+
+
+def get_client(service_name: str, region_name: str) -> BaseClient:
+    # boto3 clients are thread safe, so one client per service and region is shared by everyone
+    session = get_session()
+    with aws_clients_lock:
+        client = aws_clients.get((service_name, region_name))
+        if client is None:
+            try:
+                client = session.client(service_name, region_name=region_name, config=CLIENT_CONFIG)
+            except Exception as error:
+                logger.error('Cannot connect to %s in %s:%s', service_name, region_name, error)
+                raise error
+            aws_clients[(service_name, region_name)] = client
+        return client
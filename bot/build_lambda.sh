@@ -1,12 +1,22 @@
 test -f model.zip && rm model.zip
+test -d topic_model && rm -r topic_model
 test -f kommunes.json && rm kommunes.json
+test -f kommunes.index && rm kommunes.index
+test -f schema_verified.json && rm schema_verified.json
 test -f se_migrant_help_bot.zip && rm se_migrant_help_bot.zip
 
-cp ../nlp/model.zip ./
+# the numpy artifact is exported from ../nlp/model.zip with topic_model_artifact.py
+cp -r ../nlp/topic_model ./
 cp ../postnummer-kommune-collection/kommunes.json ./
 
+python3 build_pipelines.py || exit 1
+python3 build_postnummer_index.py || exit 1
+# needs AWS credentials, the lambda doesn't check tables on a cold start with the marker
+python3 table_bootstrap.py provision || exit 1
+test -f schema_verified.json || exit 1
+
 pip3 install --upgrade --platform manylinux2014_x86_64 --python 3.9 --only-binary=:all: requests "urllib3<2" -t ./
-pip3 install --upgrade --platform manylinux2014_x86_64 --python 3.9 --only-binary=:all: scikit-learn -t ./
+pip3 install --upgrade --platform manylinux2014_x86_64 --python 3.9 --only-binary=:all: "numpy<2" -t ./
 pip3 install --upgrade --platform manylinux2014_x86_64 --python 3.9 --only-binary=:all: pyyaml -t ./
 find ./ -type f -name "*.so" | xargs -r strip
 find ./ -type f -name "*.pyc" | xargs -r rm
@@ -14,7 +24,10 @@ find ./ -type d -name "__pycache__" | xargs -r rm -r
 find ./ -type d -name "*.dist-info" | xargs -r rm -r
 find ./ -type d -name "tests" | xargs -r rmx -r
 
-zip -r se_migrant_help_bot.zip ./ -x "README.md" -x "*.iml" -x "se_migrant_*.zip" -x "*.sh" -x "*_test.py"
+zip -r se_migrant_help_bot.zip ./ -x "README.md" -x "model.zip" -x "kommunes.json" -x "*.iml" -x "se_migrant_*.zip" -x "*.sh" -x "*_test.py" -x "*_benchmark.py" -x "startup_profile.py" -x "relabel_posts.py" -x "update_replay.py"
 
+test -d topic_model && rm -r topic_model
 test -f model.zip && rm model.zip
 test -f kommunes.json && rm kommunes.json
+test -f kommunes.index && rm kommunes.index
+test -f schema_verified.json && rm schema_verified.json
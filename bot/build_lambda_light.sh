@@ -1,9 +1,17 @@
 test -f model.zip && rm model.zip
 test -f kommunes.json && rm kommunes.json
+test -f kommunes.index && rm kommunes.index
+test -f schema_verified.json && rm schema_verified.json
 test -f se_migrant_help_bot.zip && rm se_migrant_help_bot.zip
 
 cp ../postnummer-kommune-collection/kommunes.json ./
 
+python3 build_pipelines.py || exit 1
+python3 build_postnummer_index.py || exit 1
+# needs AWS credentials, the lambda doesn't check tables on a cold start with the marker
+python3 table_bootstrap.py provision || exit 1
+test -f schema_verified.json || exit 1
+
 pip3 install --upgrade --platform manylinux2014_x86_64 --python 3.9 --only-binary=:all: requests "urllib3<2" -t ./
 pip3 install --upgrade --platform manylinux2014_x86_64 --python 3.9 --only-binary=:all: pyyaml -t ./
 find ./ -type f -name "*.so" | xargs -r strip
@@ -15,9 +23,11 @@ find ./ -type d -name "tests" | xargs -r rmx -r
 mv topics_modelling.py topics_modelling_heavy.py
 mv topics_modelling_light.py topics_modelling.py
 
-zip -r se_migrant_help_bot.zip ./ -x "README.md" -x ".idea/**" -x "*.iml" -x "se_migrant_*.zip" -x "*.sh" -x "*_test.py"
+zip -r se_migrant_help_bot.zip ./ -x "README.md" -x "kommunes.json" -x ".idea/**" -x "*.iml" -x "se_migrant_*.zip" -x "*.sh" -x "*_test.py" -x "*_benchmark.py" -x "startup_profile.py" -x "relabel_posts.py" -x "update_replay.py"
 
 mv topics_modelling.py topics_modelling_light.py
 mv topics_modelling_heavy.py topics_modelling.py
 
 test -f kommunes.json && rm kommunes.json
+test -f kommunes.index && rm kommunes.index
+test -f schema_verified.json && rm schema_verified.json
@@ -1,8 +1,14 @@
 test -f model.zip && rm model.zip
+test -d topic_model && rm -r topic_model
 test -f kommunes.json && rm kommunes.json
+test -f kommunes.index && rm kommunes.index
 cp ../nlp/model.zip ./
+cp -r ../nlp/topic_model ./
 cp ../postnummer-kommune-collection/kommunes.json ./
 
+python3 build_pipelines.py || exit 1
+python3 build_postnummer_index.py || exit 1
+
 pip3 install --upgrade boto3 -t ./
 pip3 install --upgrade requests "urllib3<2" -t ./
 pip3 install --upgrade scikit-learn -t ./
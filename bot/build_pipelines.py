@@ -0,0 +1,87 @@
+import pickle
+import sys
+
+import chat_states as states
+
+# nodes where a new session can start
+ENTRY_STATE_IDS = ['static_topic', 'make_topic_prediction']
+SPECIAL_STATE_IDS = {states.HOME_STATE_ID, states.REPEAT_STATE_ID}
+
+
+def get_dangling_errors(all_states: dict[str, states.AbstractChatNode]) -> list[str]:
+    errors = []
+    for node_id, node in all_states.items():
+        for next_node_id in node.get_next_node_ids():
+            if next_node_id not in all_states and next_node_id not in SPECIAL_STATE_IDS:
+                errors.append(f'Node {node_id} refers to undefined node {next_node_id}')
+    return errors
+
+
+def find_reachable(start_ids: list[str], edges: dict[str, list[str]]) -> set[str]:
+    reachable = set()
+    stack = list(start_ids)
+    while len(stack) > 0:
+        node_id = stack.pop()
+        if node_id in reachable:
+            continue
+        reachable.add(node_id)
+        stack.extend(edges.get(node_id, []))
+    return reachable
+
+
+def validate_states(all_states: dict[str, states.AbstractChatNode]) -> list[str]:
+    errors = get_dangling_errors(all_states)
+
+    edges = {node_id: node.get_next_node_ids() for node_id, node in all_states.items()}
+    reachable = find_reachable([i for i in ENTRY_STATE_IDS if i in all_states], edges)
+    for node_id in all_states.keys():
+        if node_id not in reachable:
+            errors.append(f'Node {node_id} is unreachable from {ENTRY_STATE_IDS}')
+
+    # a session must always be able to end, otherwise the user is locked in a loop
+    reverse_edges: dict[str, list[str]] = dict()
+    for node_id, next_node_ids in edges.items():
+        for next_node_id in next_node_ids:
+            reverse_edges.setdefault(next_node_id, []).append(node_id)
+    can_exit = find_reachable([states.HOME_STATE_ID], reverse_edges)
+    for node_id in sorted(reachable):
+        if node_id in all_states and node_id not in can_exit:
+            errors.append(f'Node {node_id} has no way to {states.HOME_STATE_ID}')
+
+    return errors
+
+
+def compile_pipelines(
+        file_names: list[str] = states.PIPELINE_FILES,
+        compiled_file: str = states.COMPILED_PIPELINES_FILE
+) -> list[str]:
+    pipelines = {file_name: states.read_pipeline(file_name) for file_name in file_names}
+
+    all_states = states.create_base_states()
+    for file_name, data in pipelines.items():
+        for node_id in data.keys():
+            if node_id in all_states:
+                raise Exception(f'Node {node_id} from {file_name} is already defined')
+        all_states.update(states.create_pipeline_states(data))
+
+    errors = validate_states(all_states)
+    if len(errors) > 0:
+        return errors
+
+    compiled = {
+        'version': states.COMPILED_PIPELINES_VERSION,
+        'sources': {file_name: states.get_file_hash(file_name) for file_name in file_names},
+        'pipelines': pipelines,
+    }
+    with open(compiled_file, 'wb') as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return []
+
+
+if __name__ == '__main__':
+    validation_errors = compile_pipelines()
+    for error in validation_errors:
+        print(error)
+    if len(validation_errors) > 0:
+        sys.exit(1)
+    print(f'Pipelines are compiled to {states.COMPILED_PIPELINES_FILE}')
@@ -0,0 +1,27 @@
+import build_pipelines
+import chat_states as states
+
+# unreachable nodes and loops without a way to the end of a session
+errors = build_pipelines.validate_states(states.ALL_STATES)
+assert len(errors) == 0, errors
+
+broken_states = states.create_base_states()
+broken_states.update(states.create_pipeline_states({
+    'head_topic_bank': {'node_type': 'SimpleOptionNode', 'content': 'Bank', 'exit_node_id': 'feedback'},
+    'head_topic_swedish': {'node_type': 'SimpleOptionNode', 'content': 'Swedish', 'exit_node_id': 'feedback'},
+    'head_topic_pn': {'node_type': 'SimpleOptionNode', 'content': 'PN', 'exit_node_id': 'feedback'},
+    'head_topic_culture': {'node_type': 'SimpleOptionNode', 'content': 'Culture', 'exit_node_id': 'feedback'},
+    'head_topic_apartment': {
+        'node_type': 'SimpleOptionNode', 'content': 'Apartment',
+        'options': [[{'content': 'Loop', 'next_node_id': 'loop_1'}, {'content': 'Lost', 'next_node_id': 'lost'}]]
+    },
+    'loop_1': {'node_type': 'SimpleOptionNode', 'content': '1', 'options': [[{'content': '2', 'next_node_id': 'loop_2'}]]},
+    'loop_2': {'node_type': 'SimpleOptionNode', 'content': '2', 'options': [[{'content': '1', 'next_node_id': 'loop_1'}]]},
+    'unreachable': {'node_type': 'SimpleOptionNode', 'content': '?', 'exit_node_id': 'feedback'},
+}))
+errors = build_pipelines.validate_states(broken_states)
+assert 'Node head_topic_apartment refers to undefined node lost' in errors, errors
+assert 'Node unreachable is unreachable from [\'static_topic\', \'make_topic_prediction\']' in errors, errors
+assert 'Node loop_1 has no way to HOME' in errors, errors
+assert 'Node loop_2 has no way to HOME' in errors, errors
+assert 'Node head_topic_apartment has no way to HOME' in errors, errors
@@ -0,0 +1,52 @@
+import json
+import sys
+from array import array
+
+import postnummer_komun_provider as provider
+
+
+def build_index(
+        kommuners_file: str = provider.KOMMUNERS_FILE,
+        index_file: str = provider.KOMMUNES_INDEX_FILE
+) -> list[str]:
+    with open(kommuners_file, 'r') as f:
+        kommunes = [provider.KommuneInfo.from_json(k) for k in json.load(f)]
+    if len(kommunes) >= provider.NO_KOMMUN:
+        raise Exception(f'Too many kommunes for the index: {len(kommunes)}')
+
+    warnings = []
+    kommun_by_slot = array('H', [provider.NO_KOMMUN]) * provider.POSTNUMMER_SLOTS
+    for kommun_number, kommun in enumerate(kommunes):
+        for postnum in kommun.postnummers:
+            slot = provider.to_postnummer_slot(postnum)
+            if slot is None:
+                warnings.append(f'Kommun {kommun.name} has invalid postnummer {postnum}')
+                continue
+            if kommun_by_slot[slot] != provider.NO_KOMMUN:
+                # like the dict in PostnummerKomunProvider, the last kommun wins
+                warnings.append(f'Postnummer {postnum} of {kommunes[kommun_by_slot[slot]].name} is moved to {kommun.name}')
+            kommun_by_slot[slot] = kommun_number
+    known_slots = array('I', [slot for slot, k in enumerate(kommun_by_slot) if k != provider.NO_KOMMUN])
+    if known_slots.itemsize != 4:
+        raise Exception(f'Unsupported array item size {known_slots.itemsize}')
+    if sys.byteorder != 'little':
+        kommun_by_slot.byteswap()
+        known_slots.byteswap()
+
+    kommunes_json = json.dumps([k.to_json() for k in kommunes], ensure_ascii=False).encode('utf8')
+    with open(index_file, 'wb') as f:
+        f.write(provider.INDEX_HEADER.pack(
+            provider.INDEX_MAGIC, provider.INDEX_VERSION, provider.POSTNUMMER_SLOTS, len(known_slots), len(kommunes_json)
+        ))
+        f.write(kommun_by_slot.tobytes())
+        f.write(known_slots.tobytes())
+        f.write(kommunes_json)
+    return warnings
+
+
+if __name__ == '__main__':
+    source_file = sys.argv[1] if len(sys.argv) > 1 else provider.KOMMUNERS_FILE
+    target_file = sys.argv[2] if len(sys.argv) > 2 else provider.KOMMUNES_INDEX_FILE
+    for warning in build_index(source_file, target_file):
+        print(warning)
+    print(f'Postnummer index is built to {target_file}')
@@ -1,10 +1,15 @@
+import hashlib
 import logging
+import os
+import pickle
 import re
 from typing import Optional
 
+import event_log
 import telegram_utils as t_utils
+import topic_keywords
 import topics_modelling as model
-import yaml
+import turn_metrics
 from postnummer_komun_provider import POSTNUMMER_KOMUN_PROVIDER
 from user_feedback_storage import USER_FEEDBACK_STORAGE
 from user_requests_storage import USER_REQUESTS_STORAGE
@@ -14,13 +19,38 @@ logger = logging.getLogger(__name__)
 
 REPEAT_STATE_ID = 'REPEAT'
 HOME_STATE_ID = 'HOME'
+TOPIC_MIN_CONFIDENCE = float(os.getenv('TOPIC_MIN_CONFIDENCE', '0.1'))
+PLACEHOLDER_PATTERN = re.compile(r'<(\w+)>')
 
 
-def apply_session_params(string: str, session: UserSession):
-    if session.session_attributes is not None:
-        for k, v in session.session_attributes.items():
-            string = string.replace(f'<{k}>', v)
-    return string
+class ContentTemplate:
+    # content is split once into literals and placeholders: [literal, key, literal, ..., literal]
+    def __init__(self, content: str, node_id: str = ''):
+        self.content = content
+        self.node_id = node_id
+        self.parts = PLACEHOLDER_PATTERN.split(content)
+        self.keys = self.parts[1::2]
+
+    def is_static(self) -> bool:
+        return len(self.keys) == 0
+
+    def get_missing_keys(self, session: UserSession) -> list[str]:
+        attributes = session.session_attributes or dict()
+        return [k for k in self.keys if k not in attributes]
+
+    def render(self, session: UserSession) -> str:
+        if self.is_static():
+            return self.content
+        attributes = session.session_attributes or dict()
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            value = attributes.get(parts[i])
+            if value is None:
+                logger.warning('Node %s: session %s has no value for <%s>', self.node_id, session.session_id, parts[i])
+                parts[i] = f'<{parts[i]}>'
+            else:
+                parts[i] = value
+        return ''.join(parts)
 
 
 class AbstractChatNode:
@@ -96,6 +126,9 @@ class AbstractChatNode:
     ) -> str:
         raise NotImplementedError("Please Implement this method")
 
+    def get_next_node_ids(self) -> list[str]:
+        raise NotImplementedError("Please Implement this method")
+
 
 class StaticTopicNode(AbstractChatNode):
     def __init__(self, node_id: str = 'static_topic'):
@@ -129,6 +162,9 @@ class StaticTopicNode(AbstractChatNode):
             'Hi! I can provide you with information about the following topics'
         return 'select_topic'
 
+    def get_next_node_ids(self) -> list[str]:
+        return ['select_topic']
+
 
 class MakeTopicPredictionNode(AbstractChatNode):
     def __init__(self, node_id: str = 'make_topic_prediction'):
@@ -158,10 +194,22 @@ class MakeTopicPredictionNode(AbstractChatNode):
             message: t_utils.MessageAction,
             action_text: str
     ) -> str:
-        topic = model.get_topic_for_message(message.new_text)
+        topic = topic_keywords.get_keyword_topic(message.new_text)
+        if topic is None:
+            with turn_metrics.span(turn_metrics.PREDICTION):
+                prediction = model.predict_batch([message.new_text])[0]
+            if prediction.confidence < TOPIC_MIN_CONFIDENCE:
+                # the message is between topics, a guess would most likely be voted down
+                user_session.session_attributes['wellcome_text'] = \
+                    'I am not sure I understood you. Choose the option you want to talk about'
+                return 'select_topic'
+            topic = prediction.topic
         user_session.session_attributes['topic'] = topic
         return 'check_topic_prediction'
 
+    def get_next_node_ids(self) -> list[str]:
+        return ['check_topic_prediction', 'select_topic']
+
 
 class SelectTopicNode(AbstractChatNode):
     EXPECTED_ACTIONS = {'swedish', 'bank', 'pn', 'apartment', 'culture'}
@@ -219,6 +267,9 @@ class SelectTopicNode(AbstractChatNode):
         user_session.session_attributes['topic'] = action_text
         return f'head_topic_{action_text}'
 
+    def get_next_node_ids(self) -> list[str]:
+        return sorted(f'head_topic_{topic}' for topic in SelectTopicNode.EXPECTED_ACTIONS)
+
 
 class CheckTopicPredictionNode(AbstractChatNode):
     EXPECTED_ACTIONS = {'good_answer', 'bad_answer'}
@@ -289,6 +340,13 @@ class CheckTopicPredictionNode(AbstractChatNode):
             response_message_id=user_session.current_message_id,
             vote=action_text
         )
+        event_log.log_event(
+            event_log.VOTE_EVENT,
+            session_id=user_session.session_id,
+            topic=user_session.session_attributes.get('topic'),
+            node=self.node_id,
+            vote=action_text
+        )
 
     def _get_next_state(
             self,
@@ -301,6 +359,9 @@ class CheckTopicPredictionNode(AbstractChatNode):
         else:
             return 'select_topic'
 
+    def get_next_node_ids(self) -> list[str]:
+        return sorted(f'head_topic_{topic}' for topic in SelectTopicNode.EXPECTED_ACTIONS) + ['select_topic']
+
 
 class FeedbackNode(AbstractChatNode):
     EXPECTED_ACTIONS = {'bad_conversation', 'normal_conversation', 'good_conversation'}
@@ -386,6 +447,12 @@ class FeedbackNode(AbstractChatNode):
                 topic_id=topic,
                 vote=action_text
             )
+            event_log.log_event(
+                event_log.FEEDBACK_EVENT,
+                session_id=user_session.session_id,
+                topic=topic,
+                vote=action_text
+            )
 
     def _get_next_state(
             self,
@@ -395,6 +462,9 @@ class FeedbackNode(AbstractChatNode):
     ) -> str:
         return HOME_STATE_ID
 
+    def get_next_node_ids(self) -> list[str]:
+        return [HOME_STATE_ID]
+
 
 class SimpleOptionNode(AbstractChatNode):
 
@@ -419,24 +489,30 @@ class SimpleOptionNode(AbstractChatNode):
         if self.exit_node_id is not None:
             self.options_by_node['exit'] = self.exit_node_id
 
-    def _normalize_action(self, action_text: str) -> str:
-        next_node = self.options_by_node.get(action_text.lower())
-        if next_node is not None:
-            return next_node
-        else:
-            return super()._normalize_action(action_text)
+        # the markup doesn't depend on a session, so it is built and serialized once
+        self.option_content_by_node = dict()
+        for row in self.options:
+            for o in row:
+                self.option_content_by_node.setdefault(o['next_node_id'], o['content'])
 
-    def _is_expected_action(self, action_text: str) -> bool:
-        if len(self.options_by_node) == 0:
-            return False
-        return action_text in self.options_by_node.values()
+        links = self.__build_links()
+        self.lock_message_fields = t_utils.StaticMessageFields({
+            'reply_markup': {
+                'inline_keyboard': links if len(links) > 0 else [[]]
+            }
+        })
 
-    def get_message_data(
-            self,
-            user_session: UserSession,
-            message: t_utils.MessageAction,
-            prefix: str = ""
-    ) -> Optional[dict]:
+        message_values = {
+            'reply_markup': {
+                'inline_keyboard': self.__build_inline_keyboard(links)
+            }
+        }
+        self.template = ContentTemplate(self.content, node_id)
+        if self.template.is_static():
+            message_values['text'] = self.content.encode('utf8')
+        self.message_fields = t_utils.StaticMessageFields(message_values)
+
+    def __build_links(self) -> list[list[dict]]:
         links = []
         for row in self.links:
             links_row = []
@@ -446,7 +522,9 @@ class SimpleOptionNode(AbstractChatNode):
                 )
             if len(links_row) > 0:
                 links.append(links_row)
+        return links
 
+    def __build_inline_keyboard(self, links: list[list[dict]]) -> list[list[dict]]:
         keyboards = []
         for row in self.options:
             keyboard = []
@@ -466,52 +544,51 @@ class SimpleOptionNode(AbstractChatNode):
             inline_keyboard.extend(keyboards)
         if len(inline_keyboard) == 0:
             inline_keyboard.append([])
+        return inline_keyboard
 
-        return {
-            'text': apply_session_params(self.content, user_session).encode('utf8'),
-            'chat_id': message.chat_id,
-            'reply_markup': {
-                'inline_keyboard': inline_keyboard
-            }
-        }
+    def _normalize_action(self, action_text: str) -> str:
+        next_node = self.options_by_node.get(action_text.lower())
+        if next_node is not None:
+            return next_node
+        else:
+            return super()._normalize_action(action_text)
+
+    def _is_expected_action(self, action_text: str) -> bool:
+        if len(self.options_by_node) == 0:
+            return False
+        return action_text in self.options_by_node.values()
+
+    def get_message_data(
+            self,
+            user_session: UserSession,
+            message: t_utils.MessageAction,
+            prefix: str = ""
+    ) -> Optional[dict]:
+        if self.template.is_static():
+            return t_utils.PreparedMessage(self.message_fields, chat_id=message.chat_id)
+        return t_utils.PreparedMessage(
+            self.message_fields,
+            text=self.template.render(user_session).encode('utf8'),
+            chat_id=message.chat_id,
+        )
 
     def _get_message_data_for_lock_message(
             self,
             user_session: UserSession,
             action_text: str
     ) -> Optional[dict]:
-        links = []
-        for row in self.links:
-            links_row = []
-            for l in row:
-                links_row.append(
-                    {'text': l['content'], 'url': l['url']}
-                )
-            if len(links_row) > 0:
-                links.append(links_row)
-        if len(links) == 0:
-            links.append([])
-
         response_text = user_session.current_text
-        break_out_flag = False
         if self.exit_node_id is not None and action_text != self.exit_node_id:
-            for row in self.options:
-                for o in row:
-                    if action_text == o['next_node_id']:
-                        response_text += f'\n\nYour answer: {o["content"]}'
-                        break_out_flag = True
-                        break
-                if break_out_flag:
-                    break
+            option_content = self.option_content_by_node.get(action_text)
+            if option_content is not None:
+                response_text += f'\n\nYour answer: {option_content}'
 
-        return {
-            'text': response_text.encode('utf8'),
-            'chat_id': user_session.chat_id,
-            'message_id': user_session.current_message_id,
-            'reply_markup': {
-                'inline_keyboard': links
-            }
-        }
+        return t_utils.PreparedMessage(
+            self.lock_message_fields,
+            text=response_text.encode('utf8'),
+            chat_id=user_session.chat_id,
+            message_id=user_session.current_message_id,
+        )
 
     def _get_next_state(
             self,
@@ -521,15 +598,20 @@ class SimpleOptionNode(AbstractChatNode):
     ) -> str:
         return action_text
 
+    def get_next_node_ids(self) -> list[str]:
+        return list(self.options_by_node.values())
+
 
 class PostnumberKomvuxSearcherNode(AbstractChatNode):
 
     def __init__(self, node_id: str, node_dict: dict):
         AbstractChatNode.__init__(self, node_id)
         self.content = node_dict['content']
+        self.template = ContentTemplate(self.content, node_id)
         self.unknown_postnumer_node_id = node_dict['unknown_postnumer_node_id']
         self.komvux_exists_node_id = node_dict['komvux_exists_node_id']
         self.komvux_doesnt_exists_node_id = node_dict['komvux_doesnt_exists_node_id']
+        self.nearest_postnumer_node_id = node_dict.get('nearest_postnumer_node_id')
         self.exit_node_id = node_dict.get('exit_node_id')
         self.exit_node_content = node_dict.get('exit_node_content')
 
@@ -568,7 +650,7 @@ class PostnumberKomvuxSearcherNode(AbstractChatNode):
             keyboard.append({'text': self.exit_node_content, 'callback_data': self.exit_node_id})
 
         return {
-            'text': apply_session_params(self.content, user_session).encode('utf8'),
+            'text': self.template.render(user_session).encode('utf8'),
             'chat_id': message.chat_id,
             'reply_markup': {
                 'inline_keyboard': [keyboard]
@@ -586,6 +668,16 @@ class PostnumberKomvuxSearcherNode(AbstractChatNode):
 
         user_session.session_attributes["postnumer"] = action_text
         kommun = POSTNUMMER_KOMUN_PROVIDER.get_kommun_info_by_number(action_text)
+        if kommun is None and self.nearest_postnumer_node_id is not None:
+            # our postnummers are not complete, the closest known one is most likely in the same kommun
+            nearest = POSTNUMMER_KOMUN_PROVIDER.get_nearest_kommun_info(action_text)
+            if nearest is not None:
+                user_session.session_attributes["nearest_postnumer"] = nearest.postnummer
+                user_session.session_attributes["kommun_name"] = nearest.kommun.name
+                user_session.session_attributes["kommun_link"] = nearest.kommun.kommun_link
+                user_session.session_attributes["kommun_contact_link"] = \
+                    nearest.kommun.vuxenutbildningar_link or nearest.kommun.kommun_link
+                return self.nearest_postnumer_node_id
         if kommun is None:
             return self.unknown_postnumer_node_id
         elif kommun.vuxenutbildningar_link is None:
@@ -598,30 +690,103 @@ class PostnumberKomvuxSearcherNode(AbstractChatNode):
             user_session.session_attributes["komvux_link"] = kommun.vuxenutbildningar_link
             return self.komvux_exists_node_id
 
+    def get_next_node_ids(self) -> list[str]:
+        return [
+            node_id for node_id in [
+                self.unknown_postnumer_node_id,
+                self.komvux_exists_node_id,
+                self.komvux_doesnt_exists_node_id,
+                self.nearest_postnumer_node_id,
+                self.exit_node_id
+            ] if node_id is not None
+        ]
+
 
 ALL_STATES = {}
+PIPELINE_FILES = [
+    'bot_appartment_pipeline.yml',
+    'bot_bank_pipeline.yml',
+    'bot_culture_pipeline.yml',
+    'bot_pn_pipeline.yml',
+    'bot_swedish_pipeline.yml',
+]
+# built by build_pipelines.py, parsing yaml is much slower than unpickling it
+COMPILED_PIPELINES_FILE = 'bot_pipelines.pickle'
+COMPILED_PIPELINES_VERSION = 3
+
+
+def create_base_states() -> dict[str, AbstractChatNode]:
+    return {
+        'make_topic_prediction': MakeTopicPredictionNode(),
+        'check_topic_prediction': CheckTopicPredictionNode(),
+        'static_topic': StaticTopicNode(),
+        'select_topic': SelectTopicNode(),
+        'feedback': FeedbackNode(),
+    }
 
 
 def load_base_states():
     global ALL_STATES
-    ALL_STATES['make_topic_prediction'] = MakeTopicPredictionNode()
-    ALL_STATES['check_topic_prediction'] = CheckTopicPredictionNode()
-    ALL_STATES['static_topic'] = StaticTopicNode()
-    ALL_STATES['select_topic'] = SelectTopicNode()
-    ALL_STATES['feedback'] = FeedbackNode()
+    ALL_STATES.update(create_base_states())
 
 
-def load_pipeline(file_name: str):
-    global ALL_STATES
+def read_pipeline(file_name: str) -> dict:
+    import yaml
+
     with open(file_name, "r") as f:
-        data = yaml.safe_load(f)
-        for k, v in data.items():
-            if v['node_type'] == 'SimpleOptionNode':
-                ALL_STATES[k] = SimpleOptionNode(node_id=k, node_dict=v)
-            elif v['node_type'] == 'PostnumberKomvuxSearcherNode':
-                ALL_STATES[k] = PostnumberKomvuxSearcherNode(node_id=k, node_dict=v)
-            else:
-                raise Exception(f'Undefined node_type: {v["node_type"]}')
+        return yaml.safe_load(f)
+
+
+def create_pipeline_states(data: dict) -> dict[str, AbstractChatNode]:
+    states = dict()
+    for k, v in data.items():
+        if v['node_type'] == 'SimpleOptionNode':
+            states[k] = SimpleOptionNode(node_id=k, node_dict=v)
+        elif v['node_type'] == 'PostnumberKomvuxSearcherNode':
+            states[k] = PostnumberKomvuxSearcherNode(node_id=k, node_dict=v)
+        else:
+            raise Exception(f'Undefined node_type: {v["node_type"]}')
+    return states
+
+
+def add_pipeline(data: dict):
+    global ALL_STATES
+    ALL_STATES.update(create_pipeline_states(data))
+
+
+def load_pipeline(file_name: str):
+    add_pipeline(read_pipeline(file_name))
+
+
+def get_file_hash(file_name: str) -> str:
+    with open(file_name, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_compiled_pipelines(compiled_file: str = COMPILED_PIPELINES_FILE) -> Optional[dict]:
+    if not os.path.isfile(compiled_file):
+        return None
+    with open(compiled_file, 'rb') as f:
+        compiled = pickle.load(f)
+    if compiled.get('version') != COMPILED_PIPELINES_VERSION:
+        logger.warning('Compiled pipelines %s have an old version, yaml files are used', compiled_file)
+        return None
+    for file_name, file_hash in compiled['sources'].items():
+        # the yaml files may be left out of the package, then the compiled file is trusted
+        if os.path.isfile(file_name) and get_file_hash(file_name) != file_hash:
+            logger.warning('Compiled pipelines %s are outdated, yaml files are used', compiled_file)
+            return None
+    return compiled['pipelines']
+
+
+def load_pipelines(file_names: list[str] = PIPELINE_FILES):
+    pipelines = read_compiled_pipelines()
+    if pipelines is None or set(pipelines.keys()) != set(file_names):
+        for file_name in file_names:
+            load_pipeline(file_name)
+    else:
+        for file_name in file_names:
+            add_pipeline(pipelines[file_name])
 
 
 def get_state(state_id: str) -> AbstractChatNode:
@@ -629,8 +794,4 @@ def get_state(state_id: str) -> AbstractChatNode:
 
 
 load_base_states()
-load_pipeline('bot_appartment_pipeline.yml')
-load_pipeline('bot_bank_pipeline.yml')
-load_pipeline('bot_culture_pipeline.yml')
-load_pipeline('bot_pn_pipeline.yml')
-load_pipeline('bot_swedish_pipeline.yml')
+load_pipelines()
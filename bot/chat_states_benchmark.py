@@ -0,0 +1,93 @@
+import json
+import os
+import time
+
+import chat_states as states
+import telegram_utils as t_utils
+from user_session_storage import UserSession
+
+TURNS = int(os.getenv('BENCHMARK_TURNS', '20000'))
+SWEDISH_PIPELINE_FILE = 'bot_swedish_pipeline.yml'
+SESSION_ATTRIBUTES = {
+    'postnumer': '11122',
+    'kommun_name': 'Stockholm',
+    'kommun_link': 'https://start.stockholm',
+    'komvux_link': 'https://start.stockholm/utbildning/vuxenutbildning',
+    'topic': 'swedish',
+}
+
+
+def apply_session_params(string: str, session: UserSession):
+    # the old rendering, one pass over the content per session attribute
+    if session.session_attributes is not None:
+        for k, v in session.session_attributes.items():
+            string = string.replace(f'<{k}>', v)
+    return string
+
+
+def get_legacy_message_data(node: states.SimpleOptionNode, user_session: UserSession, chat_id: int) -> dict:
+    # the reply as it was built before the markup was prepared on load
+    links = []
+    for row in node.links:
+        links_row = [{'text': l['content'], 'url': l['url']} for l in row]
+        if len(links_row) > 0:
+            links.append(links_row)
+    keyboards = []
+    for row in node.options:
+        keyboard = [{'text': o['content'], 'callback_data': o['next_node_id']} for o in row]
+        if len(keyboard) > 0:
+            keyboards.append(keyboard)
+    if node.exit_node_id is not None:
+        keyboards.append([{'text': node.exit_node_content, 'callback_data': node.exit_node_id}])
+    inline_keyboard = links + keyboards
+    if len(inline_keyboard) == 0:
+        inline_keyboard.append([])
+    return {
+        'text': apply_session_params(node.content, user_session).encode('utf8'),
+        'chat_id': chat_id,
+        'reply_markup': {'inline_keyboard': inline_keyboard}
+    }
+
+
+def run_benchmark(name: str, render):
+    nodes = [v for v in states.ALL_STATES.values() if isinstance(v, states.SimpleOptionNode)]
+    user_session = UserSession(
+        chat_id='1', state_id='select_topic', current_message_id=1, current_text='',
+        session_attributes=dict(SESSION_ATTRIBUTES)
+    )
+    message = t_utils.MessageAction(action_type='callback', chat_id=1, first_name='Tester', new_text='')
+    start = time.perf_counter()
+    for i in range(TURNS):
+        render(nodes[i % len(nodes)], user_session, message)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>10}: {elapsed / TURNS * 1e6:8.1f} us per turn, {len(nodes)} nodes')
+
+
+def run_template_benchmark(name: str, render):
+    node_ids = states.read_pipeline(SWEDISH_PIPELINE_FILE).keys()
+    nodes = [states.ALL_STATES[node_id] for node_id in node_ids if hasattr(states.ALL_STATES[node_id], 'template')]
+    user_session = UserSession(
+        chat_id='1', state_id='select_topic', current_message_id=1, current_text='',
+        session_attributes=dict(SESSION_ATTRIBUTES)
+    )
+    start = time.perf_counter()
+    for i in range(TURNS):
+        render(nodes[i % len(nodes)], user_session)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>10}: {elapsed / TURNS * 1e6:8.1f} us per render, {len(nodes)} nodes of {SWEDISH_PIPELINE_FILE}')
+
+
+if __name__ == '__main__':
+    run_template_benchmark('replace', lambda node, user_session: apply_session_params(node.content, user_session))
+    run_template_benchmark('template', lambda node, user_session: node.template.render(user_session))
+
+    run_benchmark(
+        'legacy',
+        lambda node, user_session, message: json.dumps(
+            get_legacy_message_data(node, user_session, message.chat_id), default=t_utils.encode_json_value
+        ).encode('utf8')
+    )
+    run_benchmark(
+        'prepared',
+        lambda node, user_session, message: t_utils.encode_body(node.get_message_data(user_session, message))
+    )
@@ -1,4 +1,8 @@
+import json
+
 import chat_states as states
+import telegram_utils as t_utils
+from user_session_storage import UserSession
 
 for k, v in states.ALL_STATES.items():
     if isinstance(v, states.MakeTopicPredictionNode):
@@ -31,5 +35,53 @@ for k, v in states.ALL_STATES.items():
         assert v.unknown_postnumer_node_id in states.ALL_STATES.keys()
         assert v.komvux_exists_node_id in states.ALL_STATES.keys()
         assert v.komvux_doesnt_exists_node_id in states.ALL_STATES.keys()
+        if v.nearest_postnumer_node_id is not None:
+            assert v.nearest_postnumer_node_id in states.ALL_STATES.keys()
     else:
         raise Exception(f'Unknown node type {k}: {v.__class__.__name__}')
+
+# prepared messages are serialized to the same json as plain dicts
+session = UserSession(
+    chat_id='1', state_id='select_topic', current_message_id=2, current_text='Previous text',
+    session_attributes={'kommun_link': 'https://kommun.se', 'komvux_link': 'https://komvux.se'}
+)
+message = t_utils.MessageAction(action_type='callback', chat_id=1, first_name='Tester', new_text='')
+for k, v in states.ALL_STATES.items():
+    if isinstance(v, states.SimpleOptionNode):
+        data = v.get_message_data(session, message)
+        assert json.loads(t_utils.encode_body(data)) == json.loads(json.dumps(dict(data), default=t_utils.encode_json_value)), k
+        assert '<kommun_link>' not in json.loads(t_utils.encode_body(data))['text'], k
+        for action in v.options_by_node.values():
+            action_message = t_utils.MessageAction(action_type='callback', chat_id=1, first_name='Tester', new_text=action)
+            lock_data = v.get_message_data_for_lock_message(session, action_message)
+            assert json.loads(t_utils.encode_body(lock_data)) == json.loads(json.dumps(dict(lock_data), default=t_utils.encode_json_value)), k
+
+# templates substitute only referenced keys and keep unknown placeholders as they are
+template = states.ContentTemplate('Your kommun: <kommun_link>, komvux: <komvux_link>, <unknown>', 'test')
+assert template.keys == ['kommun_link', 'komvux_link', 'unknown']
+assert template.get_missing_keys(session) == ['unknown']
+assert template.render(session) == 'Your kommun: https://kommun.se, komvux: https://komvux.se, <unknown>'
+assert states.ContentTemplate('No placeholders, a < b > c').is_static()
+
+# obvious messages are routed by keywords, unclear ones go to the topic selection
+prediction_node = states.get_state('make_topic_prediction')
+prediction_session = UserSession(chat_id='1', state_id='make_topic_prediction', current_message_id=None, current_text='')
+sfi_message = t_utils.MessageAction(action_type='message', chat_id=1, first_name='Tester', new_text='Where is SFI?')
+assert prediction_node.get_next_state(prediction_session, sfi_message) == 'check_topic_prediction'
+assert prediction_session.session_attributes['topic'] == 'swedish'
+
+min_confidence = states.TOPIC_MIN_CONFIDENCE
+states.TOPIC_MIN_CONFIDENCE = 1.0
+try:
+    unclear_message = t_utils.MessageAction(action_type='message', chat_id=1, first_name='Tester', new_text='Hello')
+    assert prediction_node.get_next_state(prediction_session, unclear_message) == 'select_topic'
+finally:
+    states.TOPIC_MIN_CONFIDENCE = min_confidence
+
+# an unknown postnummer goes to the kommun of the nearest known one
+postnumber_node = states.get_state('sfi_howto')
+postnumber_session = UserSession(chat_id='1', state_id='sfi_howto', current_message_id=1, current_text='')
+postnumber_message = t_utils.MessageAction(action_type='message', chat_id=1, first_name='Tester', new_text='293 43')
+assert postnumber_node.get_next_state(postnumber_session, postnumber_message) == 'sfi_howto_nearest_postnumer'
+nearest_data = states.get_state('sfi_howto_nearest_postnumer').get_message_data(postnumber_session, postnumber_message)
+assert 'post number 29343, the nearest one we know (29342) is in Olofström' in nearest_data['text'].decode('utf8')
@@ -1,26 +1,196 @@
 import logging
 import os
+import time
+from typing import Optional
 
-import boto3
 from botocore.client import BaseClient
+from botocore.exceptions import ClientError
+
+import aws_clients
+from storage_backends import ConditionFailedError, StorageBackend, StorageError
 
 logger = logging.getLogger(__name__)
 DYNAMODB_REGION_NAME = os.getenv('DYNAMODB_REGION_NAME', 'eu-north-1')
+# BatchWriteItem takes at most 25 items, unprocessed items are retried with an exponential backoff
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_MAX_ATTEMPTS = int(os.getenv('BATCH_WRITE_MAX_ATTEMPTS', '5'))
+BATCH_WRITE_BACKOFF_SECONDS = float(os.getenv('BATCH_WRITE_BACKOFF_SECONDS', '0.05'))
 
 
 class DynamoDb:
     def __init__(self):
+        self.client = aws_clients.get_client('dynamodb', DYNAMODB_REGION_NAME)
+
+    def get_client(self) -> BaseClient:
+        return self.client
+
+
+def to_ddb_value(value) -> dict:
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float)):
+        return {'N': str(value)}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, dict):
+        return {'M': to_ddb_map(value)}
+    if isinstance(value, list):
+        return {'L': [to_ddb_value(v) for v in value]}
+    raise Exception(f'Unsupported DynamoDB value type: {value.__class__.__name__}')
+
+
+def to_ddb_map(values: dict) -> dict:
+    return {k: to_ddb_value(v) for k, v in values.items()}
+
+
+def from_ddb_value(ddb_value: dict):
+    value_type, value = next(iter(ddb_value.items()))
+    if value_type == 'NULL':
+        return None
+    if value_type == 'N':
+        return float(value) if '.' in value or 'e' in value.lower() else int(value)
+    if value_type == 'M':
+        return from_ddb_map(value)
+    if value_type == 'L':
+        return [from_ddb_value(v) for v in value]
+    return value
+
+
+def from_ddb_map(ddb_values: dict) -> dict:
+    return {k: from_ddb_value(v) for k, v in ddb_values.items()}
+
+
+def to_storage_error(err: ClientError) -> StorageError:
+    code = err.response['Error']['Code']
+    message = err.response['Error']['Message']
+    if code == 'ConditionalCheckFailedException':
+        return ConditionFailedError(message)
+    return StorageError(code, message)
+
+
+def get_condition_expression(key: dict, expected: Optional[dict], names: dict, values: dict) -> Optional[str]:
+    if expected is None or len(expected) == 0:
+        return None
+    # a conditional write of a missing item fails, an update mustn't recreate a deleted item
+    names['#k'] = next(iter(key))
+    conditions = ['attribute_exists(#k)']
+    for i, (k, v) in enumerate(expected.items()):
+        names[f'#e{i}'] = k
+        values[f':e{i}'] = to_ddb_value(v)
+        conditions.append(f'(attribute_not_exists(#e{i}) OR #e{i} = :e{i})')
+    return ' AND '.join(conditions)
+
+
+class DynamoDbBackend(StorageBackend):
+    name = 'dynamodb'
+
+    def __init__(self):
+        self.dynamo_db = DynamoDb()
+
+    def get_client(self) -> BaseClient:
+        return self.dynamo_db.get_client()
+
+    def create_table_if_not_exists(self, table_name: str, hash_key: str, range_key: Optional[str] = None):
+        key_schema = [{'AttributeName': hash_key, 'KeyType': 'HASH'}]
+        attribute_definitions = [{'AttributeName': hash_key, 'AttributeType': 'S'}]
+        if range_key is not None:
+            key_schema.append({'AttributeName': range_key, 'KeyType': 'RANGE'})
+            attribute_definitions.append({'AttributeName': range_key, 'AttributeType': 'S'})
         try:
-            session = boto3.session.Session()
-        except Exception as error:
-            logging.error('Error: cannot create service session: %s', error)
-            raise error
+            dynamodb_client = self.get_client()
+            try:
+                dynamodb_client.describe_table(TableName=table_name)
+                return
+            except dynamodb_client.exceptions.ResourceNotFoundException:
+                pass
+            dynamodb_client.create_table(
+                TableName=table_name,
+                KeySchema=key_schema,
+                AttributeDefinitions=attribute_definitions,
+                ProvisionedThroughput={'ReadCapacityUnits': 10, 'WriteCapacityUnits': 10})
+            dynamodb_client.get_waiter('table_exists').wait(TableName=table_name)
+        except ClientError as err:
+            raise to_storage_error(err) from err
 
+    def get_item(self, table_name: str, key: dict) -> Optional[dict]:
         try:
-            self.client = session.client('dynamodb', region_name=DYNAMODB_REGION_NAME)
-        except Exception as error:
-            logging.error('Cannot connect to %s in %s:%s', 'dynamodb', DYNAMODB_REGION_NAME, error)
-            raise error
+            response = self.get_client().get_item(TableName=table_name, Key=to_ddb_map(key))
+        except ClientError as err:
+            raise to_storage_error(err) from err
+        item = response.get('Item')
+        return None if item is None else from_ddb_map(item)
 
-    def get_client(self) -> BaseClient:
-        return self.client
+    def put_item(self, table_name: str, key: dict, attributes: dict):
+        item = dict(attributes)
+        item.update(key)
+        try:
+            self.get_client().put_item(TableName=table_name, Item=to_ddb_map(item))
+        except ClientError as err:
+            raise to_storage_error(err) from err
+
+    def batch_put_items(self, table_name: str, items: list[tuple[dict, dict]]):
+        # a batch can't have two requests for the same key, the last put wins like with put_item
+        requests_by_key = dict()
+        for key, attributes in items:
+            item = dict(attributes)
+            item.update(key)
+            requests_by_key[tuple(sorted(key.items()))] = {'PutRequest': {'Item': to_ddb_map(item)}}
+        requests = list(requests_by_key.values())
+        for start in range(0, len(requests), BATCH_WRITE_SIZE):
+            self.__batch_write(table_name, requests[start:start + BATCH_WRITE_SIZE])
+
+    def __batch_write(self, table_name: str, requests: list[dict]):
+        for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+            if attempt > 0:
+                time.sleep(BATCH_WRITE_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            try:
+                response = self.get_client().batch_write_item(RequestItems={table_name: requests})
+            except ClientError as err:
+                raise to_storage_error(err) from err
+            requests = response.get('UnprocessedItems', dict()).get(table_name, [])
+            if len(requests) == 0:
+                return
+        raise StorageError(
+            'UnprocessedItems', f'{len(requests)} items are not written to {table_name} '
+                                f'after {BATCH_WRITE_MAX_ATTEMPTS} attempts'
+        )
+
+    def update_item(self, table_name: str, key: dict, values: dict, expected: Optional[dict] = None):
+        names = dict()
+        ddb_values = dict()
+        updates = []
+        for i, (k, v) in enumerate(values.items()):
+            names[f'#u{i}'] = k
+            ddb_values[f':u{i}'] = to_ddb_value(v)
+            updates.append(f'#u{i} = :u{i}')
+        kwargs = {}
+        condition = get_condition_expression(key, expected, names, ddb_values)
+        if condition is not None:
+            kwargs['ConditionExpression'] = condition
+        try:
+            self.get_client().update_item(
+                TableName=table_name,
+                Key=to_ddb_map(key),
+                UpdateExpression='SET ' + ', '.join(updates),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=ddb_values,
+                **kwargs
+            )
+        except ClientError as err:
+            raise to_storage_error(err) from err
+
+    def delete_item(self, table_name: str, key: dict, expected: Optional[dict] = None):
+        names = dict()
+        ddb_values = dict()
+        kwargs = {}
+        condition = get_condition_expression(key, expected, names, ddb_values)
+        if condition is not None:
+            kwargs['ConditionExpression'] = condition
+            kwargs['ExpressionAttributeNames'] = names
+            kwargs['ExpressionAttributeValues'] = ddb_values
+        try:
+            self.get_client().delete_item(TableName=table_name, Key=to_ddb_map(key), **kwargs)
+        except ClientError as err:
+            raise to_storage_error(err) from err
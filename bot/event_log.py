@@ -0,0 +1,173 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# transitions, votes and feedbacks are appended as json lines to EVENT_LOG_DIR, empty disables the log.
+# A file bigger than EVENT_LOG_MAX_BYTES is rotated and compressed
+EVENT_LOG_DIR = os.getenv('EVENT_LOG_DIR', '')
+EVENT_LOG_MAX_BYTES = int(os.getenv('EVENT_LOG_MAX_BYTES', str(8 * 1024 * 1024)))
+
+CURRENT_FILE_PATTERN = 'events-current-{pid}.ndjson'
+# rotated files are compressed to <name>.gz
+ROTATED_FILE_PATTERN = 'events-{time}-{pid}-{number:06d}.ndjson'
+
+TRANSITION_EVENT = 'transition'
+REPEAT_EVENT = 'repeat'
+VOTE_EVENT = 'vote'
+FEEDBACK_EVENT = 'feedback'
+NO_TOPIC = 'none'
+
+
+class EventLog:
+    def __init__(self, log_dir: str, max_bytes: int = EVENT_LOG_MAX_BYTES):
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        # every process has its own file, lines of different processes are never mixed
+        self.current_file = os.path.join(log_dir, CURRENT_FILE_PATTERN.format(pid=os.getpid()))
+        self.file = None
+        self.size = 0
+        self.rotated_count = 0
+        self.lock = threading.Lock()
+
+    def __open(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.file = open(self.current_file, 'a', encoding='utf8')
+        self.size = self.file.tell()
+
+    def log(self, event_type: str, **fields):
+        event = {'ts': round(time.time(), 3), 'type': event_type}
+        event.update(fields)
+        line = json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n'
+        rotated_file = None
+        with self.lock:
+            if self.file is None:
+                self.__open()
+            self.file.write(line)
+            self.size += len(line.encode('utf8'))
+            if self.size >= self.max_bytes:
+                rotated_file = self.__rotate()
+        # compressed without the lock, other threads keep writing to the new file
+        if rotated_file is not None:
+            compress_file(rotated_file)
+
+    def __rotate(self) -> Optional[str]:
+        if self.file is None:
+            return None
+        self.file.close()
+        self.file = None
+        if self.size == 0:
+            return None
+        self.rotated_count += 1
+        rotated_file = os.path.join(self.log_dir, ROTATED_FILE_PATTERN.format(
+            time=time.strftime('%Y%m%dT%H%M%S', time.gmtime()), pid=os.getpid(), number=self.rotated_count
+        ))
+        os.replace(self.current_file, rotated_file)
+        return rotated_file
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            rotated_file = self.__rotate()
+        if rotated_file is not None:
+            compress_file(rotated_file)
+
+
+def compress_file(file_name: str):
+    try:
+        with open(file_name, 'rb') as source, gzip.open(file_name + '.gz', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(file_name)
+    except OSError as error:
+        # the uncompressed file is still read by read_events
+        logger.error("Couldn't compress event log %s. Error: %s", file_name, error, exc_info=True)
+
+
+EVENT_LOG: Optional[EventLog] = EventLog(EVENT_LOG_DIR) if EVENT_LOG_DIR else None
+
+
+def log_event(event_type: str, **fields):
+    if EVENT_LOG is None:
+        return
+    try:
+        EVENT_LOG.log(event_type, **fields)
+    except OSError as error:
+        logger.error("Couldn't write event %s %s. Error: %s", event_type, fields, error, exc_info=True)
+
+
+def flush_events():
+    if EVENT_LOG is not None:
+        EVENT_LOG.flush()
+
+
+def close_event_log():
+    if EVENT_LOG is not None:
+        EVENT_LOG.close()
+
+
+def get_event_files(log_dir: str) -> list[str]:
+    # rotated files are named by time, the current files of running processes go last
+    return sorted(
+        glob.glob(os.path.join(log_dir, 'events-*.ndjson.gz')) + glob.glob(os.path.join(log_dir, 'events-*.ndjson'))
+    )
+
+
+def read_events(log_dir: str) -> Iterator[dict]:
+    for file_name in get_event_files(log_dir):
+        opener = gzip.open if file_name.endswith('.gz') else open
+        with opener(file_name, 'rt', encoding='utf8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line of a file that is being written can be incomplete
+                    logger.warning('Broken event in %s: %s', file_name, line)
+
+
+def aggregate_funnels(events: Iterable[dict]) -> dict:
+    # counts per topic and node, memory depends on the number of nodes, not on the number of events
+    funnels = dict()
+
+    def get_funnel(topic: Optional[str]) -> dict:
+        return funnels.setdefault(topic or NO_TOPIC, {'nodes': dict(), 'feedback': dict()})
+
+    def get_node(topic: Optional[str], node_id: str) -> dict:
+        return get_funnel(topic)['nodes'].setdefault(node_id, {'entered': 0, 'left': 0, 'repeats': 0, 'votes': dict()})
+
+    for event in events:
+        event_type = event.get('type')
+        topic = event.get('topic')
+        if event_type == TRANSITION_EVENT:
+            # a node is left under the topic it was entered with, older events have one topic
+            if event.get('from_node') is not None:
+                get_node(event.get('from_topic', topic), event['from_node'])['left'] += 1
+            get_node(event.get('to_topic', topic), event['to_node'])['entered'] += 1
+        elif event_type == REPEAT_EVENT:
+            get_node(topic, event['node'])['repeats'] += 1
+        elif event_type == VOTE_EVENT:
+            votes = get_node(topic, event['node'])['votes']
+            votes[event['vote']] = votes.get(event['vote'], 0) + 1
+        elif event_type == FEEDBACK_EVENT:
+            feedback = get_funnel(topic)['feedback']
+            feedback[event['vote']] = feedback.get(event['vote'], 0) + 1
+    return funnels
+
+
+if __name__ == '__main__':
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else EVENT_LOG_DIR
+    if not source_dir:
+        print('Usage: python3 event_log.py <event log dir>')
+        sys.exit(1)
+    print(json.dumps(aggregate_funnels(read_events(source_dir)), indent=2, ensure_ascii=False))
@@ -0,0 +1,54 @@
+import os
+import tempfile
+
+import event_log
+from event_log import EventLog, aggregate_funnels, get_event_files, read_events
+
+temp_dir = tempfile.TemporaryDirectory()
+
+log = EventLog(temp_dir.name, max_bytes=1024)
+for i in range(40):
+    log.log(event_log.TRANSITION_EVENT, session_id=f's{i}', from_topic=None, to_topic=None, from_node='static_topic', to_node='select_topic')
+    log.log(event_log.TRANSITION_EVENT, session_id=f's{i}', from_topic=None, to_topic='swedish', from_node='select_topic', to_node='head_topic_swedish')
+    if i % 4 == 0:
+        log.log(event_log.REPEAT_EVENT, session_id=f's{i}', topic='swedish', node='head_topic_swedish')
+    if i % 2 == 0:
+        log.log(event_log.TRANSITION_EVENT, session_id=f's{i}', from_topic='swedish', to_topic='swedish', from_node='head_topic_swedish', to_node='sfi_howto')
+log.log(event_log.VOTE_EVENT, session_id='s0', topic='bank', node='check_topic_prediction', vote='good_answer')
+log.log(event_log.FEEDBACK_EVENT, session_id='s0', topic='swedish', vote='good_conversation')
+log.flush()
+
+# full files are rotated and compressed, the current one is still readable
+files = get_event_files(temp_dir.name)
+assert len([f for f in files if f.endswith('.ndjson.gz')]) > 1
+assert files[-1].endswith(f'events-current-{os.getpid()}.ndjson')
+events = list(read_events(temp_dir.name))
+assert len(events) == 40 * 2 + 10 + 20 + 2
+assert [e['session_id'] for e in events[:3]] == ['s0', 's0', 's0']
+
+log.close()
+files = get_event_files(temp_dir.name)
+assert all(f.endswith('.ndjson.gz') for f in files)
+assert list(read_events(temp_dir.name)) == events
+
+funnels = aggregate_funnels(read_events(temp_dir.name))
+assert funnels['none']['nodes']['static_topic'] == {'entered': 0, 'left': 40, 'repeats': 0, 'votes': {}}
+# the topic is chosen in select_topic, so it is left under the topic it was entered with
+assert funnels['none']['nodes']['select_topic'] == {'entered': 40, 'left': 40, 'repeats': 0, 'votes': {}}
+assert 'select_topic' not in funnels['swedish']['nodes']
+assert funnels['swedish']['nodes']['head_topic_swedish'] == {'entered': 40, 'left': 20, 'repeats': 10, 'votes': {}}
+assert funnels['swedish']['nodes']['sfi_howto']['entered'] == 20
+assert funnels['swedish']['feedback'] == {'good_conversation': 1}
+assert funnels['bank']['nodes']['check_topic_prediction']['votes'] == {'good_answer': 1}
+
+# older events have one topic for both nodes
+old_funnels = aggregate_funnels([{'type': 'transition', 'topic': 'bank', 'from_node': 'head_topic_bank', 'to_node': 'bank_howto'}])
+assert old_funnels['bank']['nodes']['head_topic_bank']['left'] == 1
+assert old_funnels['bank']['nodes']['bank_howto']['entered'] == 1
+
+# an incomplete last line of a running process is skipped
+with open(os.path.join(temp_dir.name, 'events-current-1.ndjson'), 'w') as f:
+    f.write('{"ts":1,"type":"repeat","session_id":"s1","topic":"bank","node":"head_topic_bank"}\n{"ts":2,"ty')
+assert len(list(read_events(temp_dir.name))) == len(events) + 1
+
+temp_dir.cleanup()
@@ -0,0 +1,180 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+FAKE_TOKEN = 'fake-token'
+
+URL_PATTERN = re.compile(r'^/bot(?P<token>[^/]+)/(?P<method>\w+)$')
+
+
+class FakeTelegramServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, record_requests: bool = True):
+        self.lock = threading.Condition()
+        self.pending_updates: list[dict] = list()
+        # long load tests keep only the last sent message of every chat
+        self.record_requests = record_requests
+        self.requests: list[tuple[str, dict]] = list()
+        self.last_messages: dict[int, dict] = dict()
+        self.failures: list[tuple[str, int, Optional[int]]] = list()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def push_update(self, update: dict) -> dict:
+        with self.lock:
+            update = dict(update, update_id=self.next_update_id)
+            self.next_update_id += 1
+            self.pending_updates.append(update)
+            self.lock.notify_all()
+        return update
+
+    def push_message(self, chat_id: int, text: str, first_name: str = 'Tester') -> dict:
+        return self.push_update({
+            'message': {
+                'message_id': self._new_message_id(),
+                'text': text,
+                'chat': {'id': chat_id, 'first_name': first_name},
+            }
+        })
+
+    def push_callback(self, chat_id: int, data: str, first_name: str = 'Tester') -> dict:
+        return self.push_update({
+            'callback_query': {
+                'data': data,
+                'message': {
+                    'message_id': self._new_message_id(),
+                    'chat': {'id': chat_id, 'first_name': first_name},
+                },
+            }
+        })
+
+    def fail_next(self, method: str, status_code: int, retry_after: Optional[int] = None):
+        with self.lock:
+            self.failures.append((method, status_code, retry_after))
+
+    def get_requests(self, method: Optional[str] = None, start: int = 0) -> list[tuple[str, dict]]:
+        with self.lock:
+            return [r for r in self.requests[start:] if method is None or r[0] == method]
+
+    def get_request_count(self) -> int:
+        with self.lock:
+            return len(self.requests)
+
+    def reset(self):
+        # message ids start from 1 again, so replays of the same updates get the same ids
+        with self.lock:
+            self.pending_updates.clear()
+            self.requests.clear()
+            self.failures.clear()
+            self.last_messages.clear()
+            self.next_update_id = 1
+            self.next_message_id = 1
+
+    def get_last_message(self, chat_id: int) -> Optional[dict]:
+        with self.lock:
+            return self.last_messages.get(chat_id)
+
+    def _new_message_id(self) -> int:
+        with self.lock:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        return message_id
+
+    def _get_updates(self, data: dict) -> list[dict]:
+        offset = data.get('offset')
+        timeout = data.get('timeout', 0)
+        with self.lock:
+            if offset is not None:
+                # like telegram: everything below offset is confirmed and forgotten
+                self.pending_updates = [u for u in self.pending_updates if u['update_id'] >= offset]
+            if len(self.pending_updates) == 0 and timeout > 0:
+                self.lock.wait(timeout)
+            return list(self.pending_updates)
+
+    def _pop_failure(self, method: str) -> Optional[tuple[int, dict]]:
+        with self.lock:
+            for i, (failed_method, status_code, retry_after) in enumerate(self.failures):
+                if failed_method == method:
+                    del self.failures[i]
+                    content = {'ok': False, 'error_code': status_code, 'description': 'Fake failure'}
+                    if retry_after is not None:
+                        content['parameters'] = {'retry_after': retry_after}
+                    return status_code, content
+        return None
+
+    def _handle(self, method: str, data: dict) -> tuple[int, dict]:
+        failure = self._pop_failure(method)
+        if failure is not None:
+            return failure
+
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': self._get_updates(data)}
+
+        with self.lock:
+            if self.record_requests:
+                self.requests.append((method, data))
+            if method == 'sendMessage':
+                self.last_messages[data.get('chat_id')] = data
+        if method == 'sendMessage':
+            return 200, {
+                'ok': True,
+                'result': {
+                    'message_id': self._new_message_id(),
+                    'chat': {'id': data.get('chat_id')},
+                    'text': data.get('text'),
+                }
+            }
+        if method == 'editMessageText':
+            return 200, {
+                'ok': True,
+                'result': {
+                    'message_id': data.get('message_id'),
+                    'chat': {'id': data.get('chat_id')},
+                    'text': data.get('text'),
+                }
+            }
+        return 200, {'ok': True, 'result': True}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                match = URL_PATTERN.match(self.path)
+                if match is None:
+                    self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+                    return
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length > 0 else b'{}'
+                self._reply(*fake._handle(match.group('method'), json.loads(body)))
+
+            def _reply(self, status: int, content: dict):
+                body = json.dumps(content).encode('utf8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                return
+
+        return Handler
@@ -1,39 +1,160 @@
+import contextvars
 import json
 import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Optional
 
 import chat_states
+import event_log
+import table_bootstrap
 import telegram_utils as t_utils
-from user_feedback_storage import USER_FEEDBACK_STORAGE
-from user_requests_storage import USER_REQUESTS_STORAGE
-from user_session_storage import USER_SESSION_STORAGE, UserSession
+import turn_metrics
+import update_capture
+from analytics_buffer import ANALYTICS_BUFFER
+from user_session_storage import USER_SESSION_STORAGE, StaleSessionError, UserSession
 
 logger = logging.getLogger(__name__)
 
 SYSTEM_MESSAGES = {'/reset'}
 # INIT_STATE_ID = 'make_topic_prediction'
 INIT_STATE_ID = 'static_topic'
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '8'))
+IO_MAX_WORKERS = int(os.getenv('IO_MAX_WORKERS', str(BATCH_MAX_WORKERS)))
+# write the session of a chat once per batch instead of once per update
+COALESCE_SESSION_WRITES = os.getenv('COALESCE_SESSION_WRITES', 'false').lower() == 'true'
 
 
 def lambda_handler(event, context):
     try:
-        if 'message' in event:
-            tg_message = process_message(event)
-        elif 'callback_query' in event:
-            tg_message = process_callback(event)
-        else:
-            raise Exception(f'Undefined request type. event: {json.dumps(event)}')
-
-        update_user_state(tg_message)
+        process_update(event)
     except Exception as error:
         logger.error('Something goes wrong. Event: %s, Error: %s', {json.dumps(event)}, error, exc_info=True)
         return {
             'statusCode': 500,
             'body': json.dumps('Something goes wrong')
         }
+    finally:
+        # the answer is already sent, buffered analytics are written before the invocation ends
+        ANALYTICS_BUFFER.flush()
+        event_log.flush_events()
 
     return {'statusCode': 200}
 
 
+def batch_lambda_handler(event, context):
+    updates, failed_item_ids = extract_updates(event)
+    failed_item_ids += process_updates(updates, BATCH_EXECUTOR)
+    ANALYTICS_BUFFER.flush()
+    event_log.flush_events()
+    return {
+        'batchItemFailures': [{'itemIdentifier': item_id} for item_id in failed_item_ids]
+    }
+
+
+def extract_updates(event) -> tuple[list[tuple[str, dict]], list[str]]:
+    # updates and ids of malformed items, they are reported as failed one by one instead of failing the batch
+    updates = []
+    failed_item_ids = []
+    # SQS batch
+    if isinstance(event, dict) and 'Records' in event:
+        for record in event['Records']:
+            try:
+                update = json.loads(record['body'])
+                if not isinstance(update, dict):
+                    raise ValueError(f'Update is not an object: {record["body"]}')
+                updates.append((record['messageId'], update))
+            except (KeyError, TypeError, ValueError) as error:
+                logger.error('Malformed record. Record: %s, Error: %s', record, error)
+                failed_item_ids.append(record['messageId'])
+        return updates, failed_item_ids
+    # getUpdates page
+    if isinstance(event, dict) and 'result' in event:
+        event = event['result']
+    if isinstance(event, list):
+        for i, update in enumerate(event):
+            if isinstance(update, dict):
+                updates.append((str(update.get('update_id', i)), update))
+            else:
+                logger.error('Malformed update. Update: %s', update)
+                failed_item_ids.append(str(i))
+        return updates, failed_item_ids
+    raise Exception(f'Undefined batch type. event: {json.dumps(event)}')
+
+
+def get_update_chat_id(update: dict) -> Optional[int]:
+    if 'message' in update:
+        return update['message']['chat']['id']
+    elif 'callback_query' in update:
+        return update['callback_query']['message']['chat']['id']
+    return None
+
+
+def process_updates(updates: list[tuple[str, dict]], executor: ThreadPoolExecutor) -> list[str]:
+    updates_by_chat: OrderedDict = OrderedDict()
+    failed_item_ids = set()
+    for i, (item_id, update) in enumerate(updates):
+        try:
+            chat_id = get_update_chat_id(update)
+        except (KeyError, TypeError) as error:
+            # e.g. a callback of an inline message has no message, only this update fails
+            logger.error('Update without a chat. Update: %s, Error: %s', json.dumps(update), error)
+            failed_item_ids.add(item_id)
+            continue
+        # updates without a chat can't be ordered against anything, so each one is its own group
+        group_key = chat_id if chat_id is not None else f'no_chat_{i}'
+        updates_by_chat.setdefault(group_key, []).append((item_id, update))
+
+    if len(updates_by_chat) == 0:
+        return [item_id for item_id, _ in updates if item_id in failed_item_ids]
+
+    chat_failures = list(executor.map(process_chat_updates, updates_by_chat.values()))
+
+    for failures in chat_failures:
+        failed_item_ids.update(failures)
+    return [item_id for item_id, _ in updates if item_id in failed_item_ids]
+
+
+def process_chat_updates(chat_updates: list[tuple[str, dict]]) -> list[str]:
+    chat_id = get_update_chat_id(chat_updates[0][1])
+    if not COALESCE_SESSION_WRITES or chat_id is None:
+        return process_ordered_updates(chat_updates)
+    failed_item_ids = []
+    try:
+        with USER_SESSION_STORAGE.coalesced_writes(str(chat_id)):
+            failed_item_ids = process_ordered_updates(chat_updates)
+    except StaleSessionError as error:
+        # the session is written after the replies are sent, see write_session
+        logger.warning('Session is changed by another update, the write is skipped. Error: %s', error)
+    return failed_item_ids
+
+
+def process_ordered_updates(chat_updates: list[tuple[str, dict]]) -> list[str]:
+    for i, (item_id, update) in enumerate(chat_updates):
+        try:
+            process_update(update)
+        except Exception as error:
+            logger.error('Something goes wrong. Update: %s, Error: %s', json.dumps(update), error, exc_info=True)
+            # the rest of the chat is reported as failed too, so a retry keeps the original order
+            return [failed_id for failed_id, _ in chat_updates[i:]]
+    return []
+
+
+def process_update(update: dict):
+    update_capture.capture_update(update)
+    with turn_metrics.turn():
+        if 'message' in update:
+            tg_message = process_message(update)
+        elif 'callback_query' in update:
+            tg_message = process_callback(update)
+        else:
+            raise Exception(f'Undefined request type. event: {json.dumps(update)}')
+
+        turn_metrics.set_property('action_type', tg_message.action_type)
+        update_user_state(tg_message)
+
+
 def process_message(event) -> t_utils.MessageAction:
     message = event['message']
     text = message['text']
@@ -66,7 +187,8 @@ def process_callback(event):
 
 
 def update_user_state(tg_message: t_utils.MessageAction):
-    user_session = USER_SESSION_STORAGE.get_session(str(tg_message.chat_id))
+    with turn_metrics.span(turn_metrics.SESSION_READ):
+        user_session = USER_SESSION_STORAGE.get_session(str(tg_message.chat_id))
     if user_session is None:
         if tg_message.new_text in SYSTEM_MESSAGES:
             process_system_message(tg_message)
@@ -93,35 +215,45 @@ def start_new_session(tg_message: t_utils.MessageAction):
         current_text=tg_message.new_text
     )
 
-    topic_node_id = make_topic_prediction_node.get_next_state(user_session=new_user_session, message=tg_message)
+    turn_metrics.set_property('node_id', INIT_STATE_ID)
+    with turn_metrics.span(turn_metrics.NEXT_STATE):
+        topic_node_id = make_topic_prediction_node.get_next_state(user_session=new_user_session, message=tg_message)
     topic_node = chat_states.get_state(topic_node_id)
-    data = topic_node.get_message_data(user_session=new_user_session, message=tg_message)
+    with turn_metrics.span(turn_metrics.RENDER):
+        data = topic_node.get_message_data(user_session=new_user_session, message=tg_message)
     if data is None:
         raise Exception(f'Empty data for topic node {topic_node_id}')
 
-    response = t_utils.send_new_message(data)
+    with turn_metrics.span(turn_metrics.SEND_MESSAGE):
+        response = t_utils.send_new_message(data)
 
     if response.status_code >= 300:
-        print(f'Response status code: {response.status_code}')
-        print(f'Response content: {response.content}')
+        log_failed_response(response)
     else:
         response_content = json.loads(response.content)
         new_user_session.state_id = topic_node_id
         new_user_session.current_message_id = response_content['result']['message_id']
         new_user_session.current_text = response_content['result']['text']
-        USER_SESSION_STORAGE.save_new_session(new_user_session)
+        with turn_metrics.span(turn_metrics.SESSION_WRITE):
+            USER_SESSION_STORAGE.save_new_session(new_user_session)
+        # a new session has no topic before its first node
+        log_transition(new_user_session, INIT_STATE_ID, topic_node_id, from_topic=None)
 
 
 def do_for_session(tg_message: t_utils.MessageAction, user_session: UserSession):
     current_node = chat_states.get_state(user_session.state_id)
-    next_state_id = current_node.get_next_state(user_session, tg_message)
+    turn_metrics.set_property('node_id', user_session.state_id)
+    # the next state can choose the topic, the node is left under the topic it was entered with
+    from_topic = user_session.session_attributes.get('topic')
+    with turn_metrics.span(turn_metrics.NEXT_STATE):
+        next_state_id = current_node.get_next_state(user_session, tg_message)
 
     if chat_states.REPEAT_STATE_ID == next_state_id:
         repeat(tg_message, user_session, current_node)
     elif chat_states.HOME_STATE_ID == next_state_id:
-        go_home(tg_message, user_session, current_node)
+        go_home(tg_message, user_session, current_node, from_topic)
     else:
-        update_session(tg_message, user_session, current_node, next_state_id)
+        update_session(tg_message, user_session, current_node, next_state_id, from_topic)
 
 
 def repeat(
@@ -130,18 +262,19 @@ def repeat(
         current_node: chat_states.AbstractChatNode
 ):
     repeat_text = f'Sorry, I don\'t recognized your answer. could you repeat?\n\n'
-    data = current_node.get_message_data(
-        user_session=user_session,
-        message=tg_message,
-        prefix=repeat_text
-    )
-    response = t_utils.send_new_message(data)
+    with turn_metrics.span(turn_metrics.RENDER):
+        data = current_node.get_message_data(
+            user_session=user_session,
+            message=tg_message,
+            prefix=repeat_text
+        )
+    with turn_metrics.span(turn_metrics.SEND_MESSAGE):
+        response = t_utils.send_new_message(data)
 
     if response.status_code >= 300:
-        print(f'Response status code: {response.status_code}')
-        print(f'Response content: {response.content}')
+        log_failed_response(response)
     else:
-        data = {
+        lock_data = {
             'text': user_session.current_text.encode('utf8'),
             'chat_id': user_session.chat_id,
             'message_id': user_session.current_message_id,
@@ -149,55 +282,127 @@ def repeat(
                 'inline_keyboard': [[]]
             }
         }
-        t_utils.update_message(data)
 
         response_content = json.loads(response.content)
         user_session.current_message_id = response_content['result']['message_id']
         user_session.current_text = response_content['result']['text']
-        USER_SESSION_STORAGE.update_user_session(user_session)
+        run_concurrently(
+            lambda: write_session(USER_SESSION_STORAGE.update_user_session, user_session),
+            *lock_message_calls(lock_data),
+        )
+        event_log.log_event(
+            event_log.REPEAT_EVENT,
+            session_id=user_session.session_id,
+            topic=user_session.session_attributes.get('topic'),
+            node=user_session.state_id
+        )
 
 
 def update_session(
         tg_message: t_utils.MessageAction,
         user_session: UserSession,
         current_node: chat_states.AbstractChatNode,
-        next_state_id: str
+        next_state_id: str,
+        from_topic: Optional[str]
 ):
     next_node = chat_states.get_state(next_state_id)
-    data = next_node.get_message_data(
-        user_session=user_session,
-        message=tg_message,
-    )
-    response = t_utils.send_new_message(data)
+    with turn_metrics.span(turn_metrics.RENDER):
+        data = next_node.get_message_data(
+            user_session=user_session,
+            message=tg_message,
+        )
+    with turn_metrics.span(turn_metrics.SEND_MESSAGE):
+        response = t_utils.send_new_message(data)
 
     if response.status_code >= 300:
-        print(f'Response status code: {response.status_code}')
-        print(f'Response content: {response.content}')
+        log_failed_response(response)
     else:
         current_node.close_node(user_session, tg_message)
-        data = current_node.get_message_data_for_lock_message(user_session, tg_message)
-        if data is not None:
-            t_utils.update_message(data)
+        # built before the session moves on, it locks the current message
+        lock_data = current_node.get_message_data_for_lock_message(user_session, tg_message)
 
         response_content = json.loads(response.content)
+        previous_state_id = user_session.state_id
         user_session.state_id = next_state_id
         user_session.current_message_id = response_content['result']['message_id']
         user_session.current_text = response_content['result']['text']
-        USER_SESSION_STORAGE.update_user_session(user_session)
+        run_concurrently(
+            lambda: write_session(USER_SESSION_STORAGE.update_user_session, user_session),
+            *lock_message_calls(lock_data),
+        )
+        log_transition(user_session, previous_state_id, next_state_id, from_topic)
 
 
 def go_home(
         tg_message: t_utils.MessageAction,
         user_session: UserSession,
-        current_node: chat_states.AbstractChatNode
+        current_node: chat_states.AbstractChatNode,
+        from_topic: Optional[str]
 ):
     current_node.close_node(user_session, tg_message)
-    data = current_node.get_message_data_for_lock_message(user_session, tg_message)
-    if data is not None:
-        t_utils.update_message(data)
-    USER_SESSION_STORAGE.delete_session(user_session)
+    lock_data = current_node.get_message_data_for_lock_message(user_session, tg_message)
+    run_concurrently(
+        lambda: write_session(USER_SESSION_STORAGE.delete_session, user_session),
+        *lock_message_calls(lock_data),
+    )
+    log_transition(user_session, user_session.state_id, chat_states.HOME_STATE_ID, from_topic)
+
+
+def log_transition(user_session: UserSession, from_node_id: str, to_node_id: str, from_topic: Optional[str]):
+    # events have state ids, node_id of SelectTopicNode is check_topic_prediction
+    event_log.log_event(
+        event_log.TRANSITION_EVENT,
+        session_id=user_session.session_id,
+        from_topic=from_topic,
+        to_topic=user_session.session_attributes.get('topic'),
+        from_node=from_node_id,
+        to_node=to_node_id
+    )
+
+
+def log_failed_response(response):
+    logger.error('Telegram call failed. Status code: %s, content: %s', response.status_code, response.content)
+
+
+def write_session(write: Callable[[UserSession], None], user_session: UserSession):
+    with turn_metrics.span(turn_metrics.SESSION_WRITE):
+        try:
+            write(user_session)
+        except StaleSessionError as error:
+            # the reply is sent already, a failed update would be retried and send it twice.
+            # The cached session is dropped, so the next update reads the one of the other write
+            logger.warning('Session is changed by another update, the write is skipped. Error: %s', error)
+
+
+def lock_message(lock_data: dict):
+    with turn_metrics.span(turn_metrics.LOCK_MESSAGE):
+        response = t_utils.update_message(lock_data)
+    if response.status_code >= 300:
+        log_failed_response(response)
+
+
+def lock_message_calls(lock_data: Optional[dict]) -> list[Callable]:
+    if lock_data is None:
+        return []
+    return [lambda: lock_message(lock_data)]
+
+
+def run_concurrently(main_call: Callable, *background_calls: Callable):
+    # the session write and the edit of the previous message don't depend on each other.
+    # Background calls run in a copy of the context, so their spans are added to the current turn
+    futures = [IO_EXECUTOR.submit(contextvars.copy_context().run, call) for call in background_calls]
+    try:
+        main_call()
+    finally:
+        wait(futures)
+        for future in futures:
+            error = future.exception()
+            # the reply is sent already, a failed update would be retried and send it twice
+            if error is not None:
+                logger.error('Background call failed. Error: %s', error, exc_info=error)
+
 
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS)
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=IO_MAX_WORKERS)
 
-USER_SESSION_STORAGE.create_table_if_not_exists()
-USER_FEEDBACK_STORAGE.create_table_if_not_exists()
-USER_REQUESTS_STORAGE.create_table_if_not_exists()
+table_bootstrap.ensure_tables()
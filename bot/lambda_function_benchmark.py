@@ -0,0 +1,130 @@
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_telegram import FAKE_TOKEN, FakeTelegramServer
+
+# synthetic conversations go through lambda_handler like real updates,
+# telegram is a local fake server and dynamodb is the in-memory backend
+CONVERSATIONS = int(os.getenv('BENCHMARK_CONVERSATIONS', '200'))
+CONCURRENCY = int(os.getenv('BENCHMARK_CONCURRENCY', '8'))
+MAX_STEPS = int(os.getenv('BENCHMARK_MAX_STEPS', '15'))
+# share of steps where a user types a text instead of pressing a button
+TEXT_PROBABILITY = float(os.getenv('BENCHMARK_TEXT_PROBABILITY', '0.1'))
+SEED = int(os.getenv('BENCHMARK_SEED', '1'))
+
+FIRST_MESSAGES = ['hi', 'Hello!', 'How can I learn Swedish?', 'I need a bank account', 'help']
+TEXTS = ['yes', 'no', 'exit', 'what?', '11122', '41319', '98765', '123 45']
+
+fake_telegram = FakeTelegramServer(record_requests=False).start()
+os.environ['TELEGRAM_API_URL'] = fake_telegram.url
+os.environ['TELEGRAM_BOT_TOKEN'] = FAKE_TOKEN
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ['UPDATE_CAPTURE_FILE'] = ''
+os.environ['TURN_METRICS_ENABLED'] = 'true'
+
+import lambda_function
+import turn_metrics
+
+turn_lines: list[dict] = []
+turn_lines_lock = threading.Lock()
+
+
+def collect_turn(current: turn_metrics.Turn):
+    line = current.to_emf()
+    with turn_lines_lock:
+        turn_lines.append(line)
+
+
+# stage timings are collected instead of printed
+turn_metrics.emit = collect_turn
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def message_update(chat_id: int, text: str) -> dict:
+    return {'message': {'message_id': 0, 'text': text, 'chat': {'id': chat_id, 'first_name': 'Tester'}}}
+
+
+def callback_update(chat_id: int, data: str) -> dict:
+    return {'callback_query': {'data': data, 'message': {'message_id': 0, 'chat': {'id': chat_id, 'first_name': 'Tester'}}}}
+
+
+def get_buttons(message: dict) -> list[str]:
+    keyboard = message.get('reply_markup', {}).get('inline_keyboard', [])
+    return [button['callback_data'] for row in keyboard for button in row if 'callback_data' in button]
+
+
+def run_conversation(number: int) -> list[float]:
+    # the path of a conversation depends only on its number, not on the order of threads
+    rng = random.Random(SEED * 1000003 + number)
+    chat_id = 1000000 + number
+    latencies = []
+    update = message_update(chat_id, rng.choice(FIRST_MESSAGES))
+    for _ in range(MAX_STEPS):
+        start = time.perf_counter()
+        result = lambda_function.lambda_handler(update, None)
+        latencies.append(time.perf_counter() - start)
+        if result['statusCode'] != 200:
+            raise Exception(f'Update failed: {update}')
+
+        message = fake_telegram.get_last_message(chat_id)
+        buttons = get_buttons(message) if message is not None else []
+        session = lambda_function.USER_SESSION_STORAGE.get_session(str(chat_id))
+        if session is None:
+            # feedback is given, the conversation is over
+            break
+        if len(buttons) == 0 or rng.random() < TEXT_PROBABILITY:
+            update = message_update(chat_id, rng.choice(TEXTS))
+        else:
+            update = callback_update(chat_id, rng.choice(buttons))
+    return latencies
+
+
+def print_timings(name: str, values_ms: list[float]):
+    print(
+        f'{name:>16}: count {len(values_ms):7d}, '
+        f'p50 {percentile(values_ms, 0.5):8.2f} ms, '
+        f'p90 {percentile(values_ms, 0.9):8.2f} ms, '
+        f'p99 {percentile(values_ms, 0.99):8.2f} ms, '
+        f'max {max(values_ms):8.2f} ms'
+    )
+
+
+def run_benchmark():
+    start_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        latencies = [s for steps in executor.map(run_conversation, range(CONVERSATIONS)) for s in steps]
+    elapsed = time.perf_counter() - start
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(
+        f'{CONVERSATIONS} conversations, {len(latencies)} updates, concurrency {CONCURRENCY}: '
+        f'{len(latencies) / elapsed:.1f} updates/s'
+    )
+    print_timings('update', [s * 1000 for s in latencies])
+    stages = dict()
+    for line in turn_lines:
+        for name, value in line.items():
+            if name.endswith('_ms'):
+                stages.setdefault(name[:-len('_ms')], []).append(value)
+    for stage, values in stages.items():
+        print_timings(stage, values)
+    print(f'Peak RSS {peak_rss_kb / 1024:.1f} MB, {start_rss_kb / 1024:.1f} MB before the conversations')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        CONVERSATIONS = int(sys.argv[1])
+    try:
+        run_benchmark()
+    finally:
+        fake_telegram.stop()
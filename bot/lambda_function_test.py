@@ -0,0 +1,80 @@
+import json
+import os
+
+from fake_telegram import FAKE_TOKEN, FakeTelegramServer
+
+fake_telegram = FakeTelegramServer().start()
+os.environ['TELEGRAM_API_URL'] = fake_telegram.url
+os.environ['TELEGRAM_BOT_TOKEN'] = FAKE_TOKEN
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ['UPDATE_CAPTURE_FILE'] = ''
+os.environ['TURN_METRICS_ENABLED'] = 'false'
+
+import lambda_function
+
+
+def record(message_id: str, body: str) -> dict:
+    return {'messageId': message_id, 'body': body}
+
+
+def message_body(chat_id: int, text: str) -> str:
+    return json.dumps({'message': {'message_id': 0, 'text': text, 'chat': {'id': chat_id, 'first_name': 'Tester'}}})
+
+
+# malformed items are reported one by one, the rest of the batch is processed
+response = lambda_function.batch_lambda_handler({'Records': [
+    record('1', message_body(1, 'hi')),
+    record('2', 'not json'),
+    record('3', '[1, 2]'),
+    # a callback of an inline message has no message and no chat
+    record('4', json.dumps({'callback_query': {'data': 'bank', 'inline_message_id': 'abc'}})),
+    record('5', message_body(2, 'hi')),
+]}, None)
+assert response == {'batchItemFailures': [{'itemIdentifier': item_id} for item_id in ['2', '3', '4']]}
+assert fake_telegram.get_last_message(1) is not None
+assert fake_telegram.get_last_message(2) is not None
+
+# the same for a getUpdates page
+response = lambda_function.batch_lambda_handler({'result': [
+    'not an update',
+    {'update_id': 7, 'callback_query': {'data': 'bank', 'inline_message_id': 'abc'}},
+]}, None)
+assert response == {'batchItemFailures': [{'itemIdentifier': item_id} for item_id in ['0', '7']]}
+
+# a session changed by another update after the reply is sent doesn't fail the update
+assert lambda_function.lambda_handler(json.loads(message_body(3, 'hi')), None) == {'statusCode': 200}
+backend = lambda_function.USER_SESSION_STORAGE.backend
+update_item = backend.update_item
+
+
+def update_changed_item(table_name: str, key: dict, values: dict, expected: dict = None):
+    update_item(table_name, key, {'version': expected['version'] + 1})
+    update_item(table_name, key, values, expected)
+
+
+backend.update_item = update_changed_item
+request_count = fake_telegram.get_request_count()
+callback = {'callback_query': {'data': 'swedish', 'message': {'message_id': 0, 'chat': {'id': 3, 'first_name': 'Tester'}}}}
+assert lambda_function.lambda_handler(callback, None) == {'statusCode': 200}
+assert [method for method, _ in fake_telegram.get_requests(start=request_count)].count('sendMessage') == 1
+backend.update_item = update_item
+# the session of the other update is kept
+assert lambda_function.USER_SESSION_STORAGE.get_session('3').state_id == 'select_topic'
+
+# a failed lock of the previous message doesn't fail the update, the reply is sent already
+update_message = lambda_function.t_utils.update_message
+
+
+def broken_update_message(data):
+    raise ConnectionError('Telegram is down')
+
+
+lambda_function.t_utils.update_message = broken_update_message
+request_count = fake_telegram.get_request_count()
+callback = {'callback_query': {'data': 'bank', 'message': {'message_id': 0, 'chat': {'id': 3, 'first_name': 'Tester'}}}}
+assert lambda_function.lambda_handler(callback, None) == {'statusCode': 200}
+lambda_function.t_utils.update_message = update_message
+assert [method for method, _ in fake_telegram.get_requests(start=request_count)] == ['sendMessage']
+assert lambda_function.USER_SESSION_STORAGE.get_session('3').state_id == 'head_topic_bank'
+
+fake_telegram.stop()
@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LruCache:
+    def __init__(self, max_size: int, ttl_seconds: Optional[float] = None):
+        if max_size <= 0:
+            raise Exception(f'Cache size must be positive, got {max_size}')
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.items: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.items[key]
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        expires_at = None if self.ttl_seconds is None else time.monotonic() + self.ttl_seconds
+        with self.lock:
+            self.items[key] = (value, expires_at)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def get_items(self) -> list[tuple[Hashable, Any]]:
+        # from the least to the most recently used, expired items included
+        with self.lock:
+            return [(key, value) for key, (value, _) in self.items.items()]
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {'size': len(self.items), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self.items)
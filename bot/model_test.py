@@ -9,6 +9,119 @@ topic = model.get_topic_for_message('I want to start SFI')
 print(topic)
 assert topic == 'swedish'
 
+predictions = model.predict_batch(['I want to start SFI', 'How to open a bank account?', 'I want to start SFI'])
+assert [p.topic for p in predictions] == ['swedish', 'bank', 'swedish']
+assert predictions[0].distance == predictions[2].distance
+assert all(p.margin >= 0 and 0 <= p.confidence <= 1 for p in predictions)
+assert model.predict_batch([]) == []
+
+# texts with the same tokens share one cached prediction
+model.PREDICTION_CACHE.clear()
+stats = model.get_prediction_cache_stats()
+topic = model.get_topic_for_message('SFI?')
+assert model.get_topic_for_message('  sfi ') == topic
+assert model.get_prediction_cache_stats()['hits'] == stats['hits'] + 1
+assert model.get_prediction_cache_stats()['misses'] == stats['misses'] + 1
+assert model.predict_uncached(['SFI?'])[0].to_dict() == model.predict_batch(['sfi'])[0].to_dict()
+# keys are built by the tokenizer of the loaded model, its stop words are dropped too
+assert model.normalize_message('What is SFI?') == model.normalize_message('sfi') == 'sfi'
+
 print(f'Spent memory: {tracemalloc.get_traced_memory()}')
 
 tracemalloc.stop()
+
+import os
+import tempfile
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    cache_file = os.path.join(temp_dir, 'predictions.json')
+    model.save_prediction_cache(cache_file)
+    model.PREDICTION_CACHE.clear()
+    model.load_prediction_cache(cache_file)
+    assert len(model.PREDICTION_CACHE) > 0 and model.PREDICTION_CACHE.get('sfi').topic == topic
+
+model.PREDICTION_CACHE.clear()
+model.warm_up_prediction_cache('../data/generated_questions.csv', 10)
+assert len(model.PREDICTION_CACHE) == 10
+
+# the numpy artifact predicts the same labels as the scikit-learn model it is exported from
+import csv
+import json
+import os
+import topic_model_artifact
+
+if os.path.isdir(model.MODEL_DIR) and os.path.isfile(model.MODEL_FILE):
+    with open(topic_model_artifact.QUESTIONS_FILE, 'r') as f:
+        messages = [row['question'] for row in csv.DictReader(f)]
+    with open(topic_model_artifact.POSTS_FILE, 'r') as f:
+        messages += json.load(f)
+    messages += ['', 'xyzzy', 'SFI', 'Hur ansöker jag om personnummer?']
+
+    kmeans, vectorizer = model.load_sklearn_model()
+    artifact = topic_model_artifact.TopicModelArtifact(model.MODEL_DIR)
+    assert topic_model_artifact.verify_artifact(kmeans, vectorizer, artifact, messages) == []
+    assert abs(artifact.get_distances(messages) - kmeans.transform(vectorizer.transform(messages))).max() < 1e-9
+
+# memory of worker processes that hold the model at the same time
+import subprocess
+import sys
+
+MODEL_TEST_WORKERS = int(os.getenv('MODEL_TEST_WORKERS', '3'))
+WORKER_CODE = '''
+import json
+import sys
+import topics_modelling as model
+
+model.get_topic_for_message('I want to start SFI')
+print('ready', flush=True)
+sys.stdin.readline()
+
+memory = dict()
+for file_name, keys in [('/proc/self/status', ['VmRSS', 'RssAnon', 'RssFile']), ('/proc/self/smaps_rollup', ['Pss'])]:
+    with open(file_name, 'r') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in keys:
+                memory[key] = int(value.split()[0])
+print(json.dumps(memory), flush=True)
+sys.stdin.readline()
+'''
+
+
+def get_workers_memory(model_dir: str) -> list[dict]:
+    env = dict(os.environ, TOPIC_MODEL_DIR=model_dir)
+    workers = [
+        subprocess.Popen([sys.executable, '-c', WORKER_CODE], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, env=env)
+        for _ in range(MODEL_TEST_WORKERS)
+    ]
+    try:
+        for worker in workers:
+            assert worker.stdout.readline().strip() == 'ready'
+        # all workers have the model loaded before the memory is measured, so shared pages are split between them
+        for worker in workers:
+            worker.stdin.write('report\n')
+            worker.stdin.flush()
+        return [json.loads(worker.stdout.readline()) for worker in workers]
+    finally:
+        for worker in workers:
+            worker.stdin.close()
+            worker.wait()
+
+
+def print_workers_memory(name: str, workers_memory: list[dict]):
+    print(f'{name}: {len(workers_memory)} workers')
+    for i, memory in enumerate(workers_memory):
+        print(
+            f'  worker {i}: RSS {memory["VmRSS"] / 1024:.1f} MB '
+            f'(anonymous {memory["RssAnon"] / 1024:.1f} MB, file {memory["RssFile"] / 1024:.1f} MB), '
+            f'PSS {memory["Pss"] / 1024:.1f} MB'
+        )
+
+
+if os.path.isfile('/proc/self/smaps_rollup'):
+    artifact_memory = get_workers_memory(model.MODEL_DIR)
+    print_workers_memory(f'Model {model.MODEL_DIR}', artifact_memory)
+    if os.path.isfile(model.MODEL_FILE):
+        sklearn_memory = get_workers_memory('no_topic_model')
+        print_workers_memory(f'Model {model.MODEL_FILE}', sklearn_memory)
+        assert max(m['VmRSS'] for m in artifact_memory) < min(m['VmRSS'] for m in sklearn_memory)
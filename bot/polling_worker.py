@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import telegram_utils as t_utils
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT_SECONDS = int(os.getenv('POLL_TIMEOUT_SECONDS', '30'))
+WORKER_MAX_WORKERS = int(os.getenv('WORKER_MAX_WORKERS', '8'))
+ERROR_BACKOFF_SECONDS = float(os.getenv('ERROR_BACKOFF_SECONDS', '5'))
+
+
+class PollingWorker:
+    def __init__(
+            self,
+            handler: Callable[[list[tuple[str, dict]]], list[str]],
+            poll_timeout: int = POLL_TIMEOUT_SECONDS,
+    ):
+        self.handler = handler
+        self.poll_timeout = poll_timeout
+        self.offset: Optional[int] = None
+        self.stopped = threading.Event()
+
+    def poll_once(self) -> int:
+        response = t_utils.get_updates(self.offset, self.poll_timeout)
+        if response.status_code >= 300:
+            raise Exception(f'getUpdates failed. status: {response.status_code}, content: {response.content}')
+
+        updates = json.loads(response.content)['result']
+        if len(updates) == 0:
+            return 0
+
+        failed_item_ids = self.handler([(str(u['update_id']), u) for u in updates])
+        if len(failed_item_ids) > 0:
+            # telegram doesn't redeliver confirmed updates, so failures can only be logged
+            logger.error('Failed updates: %s', failed_item_ids)
+
+        self.offset = max(u['update_id'] for u in updates) + 1
+        return len(updates)
+
+    def run(self):
+        logger.info('Polling worker started')
+        while not self.stopped.is_set():
+            try:
+                self.poll_once()
+            except Exception as error:
+                logger.error('Polling failed. Error: %s', error, exc_info=True)
+                self.stopped.wait(ERROR_BACKOFF_SECONDS)
+        logger.info('Polling worker stopped')
+
+    def stop(self):
+        self.stopped.set()
+
+
+def create_update_handler(executor: ThreadPoolExecutor) -> Callable[[list[tuple[str, dict]]], list[str]]:
+    # the heavy part (models, pipelines, storages) is loaded once and stays warm
+    import event_log
+    import lambda_function
+    from analytics_buffer import ANALYTICS_BUFFER
+
+    def handle_updates(updates: list[tuple[str, dict]]) -> list[str]:
+        failed_item_ids = lambda_function.process_updates(updates, executor)
+        # the worker doesn't end after a batch, analytics are written by size or age
+        ANALYTICS_BUFFER.flush_if_due()
+        event_log.flush_events()
+        return failed_item_ids
+
+    return handle_updates
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    import event_log
+    import topics_modelling
+    from analytics_buffer import ANALYTICS_BUFFER
+
+    executor = ThreadPoolExecutor(max_workers=WORKER_MAX_WORKERS)
+    worker = PollingWorker(handler=create_update_handler(executor))
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+    finally:
+        executor.shutdown()
+        ANALYTICS_BUFFER.flush()
+        event_log.close_event_log()
+        # the next start begins with the predictions of this one
+        topics_modelling.save_prediction_cache()
+        logger.info('Prediction cache: %s', topics_modelling.get_prediction_cache_stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_telegram import FAKE_TOKEN, FakeTelegramServer
+
+fake_telegram = FakeTelegramServer().start()
+os.environ['TELEGRAM_API_URL'] = fake_telegram.url
+os.environ['TELEGRAM_BOT_TOKEN'] = FAKE_TOKEN
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ['UPDATE_CAPTURE_FILE'] = ''
+os.environ['TURN_METRICS_ENABLED'] = 'false'
+
+import polling_worker
+
+handled = []
+
+
+def handler(updates):
+    handled.extend(updates)
+    return []
+
+
+worker = polling_worker.PollingWorker(handler=handler, poll_timeout=1)
+
+# nothing to do
+assert worker.poll_once() == 0
+assert worker.offset is None
+
+first = fake_telegram.push_message(chat_id=1, text='hi')
+second = fake_telegram.push_callback(chat_id=2, data='bank')
+third = fake_telegram.push_message(chat_id=1, text='/reset')
+
+assert worker.poll_once() == 3
+assert [item_id for item_id, _ in handled] == [str(u['update_id']) for u in [first, second, third]]
+assert handled[0][1]['message']['text'] == 'hi'
+assert handled[1][1]['callback_query']['data'] == 'bank'
+assert worker.offset == third['update_id'] + 1
+
+# confirmed updates are not delivered again
+assert worker.poll_once() == 0
+assert len(handled) == 3
+
+# polled updates are processed by the bot and answered
+executor = ThreadPoolExecutor(max_workers=2)
+worker = polling_worker.PollingWorker(handler=polling_worker.create_update_handler(executor), poll_timeout=1)
+worker.offset = third['update_id'] + 1
+request_count = fake_telegram.get_request_count()
+fake_telegram.push_message(chat_id=3, text='hi')
+assert worker.poll_once() == 1
+replies = [data for method, data in fake_telegram.get_requests('sendMessage', start=request_count)]
+assert [reply['chat_id'] for reply in replies] == [3]
+assert fake_telegram.get_last_message(3) is not None
+executor.shutdown()
+
+fake_telegram.stop()
@@ -1,7 +1,27 @@
+import bisect
 import json
+import mmap
+import os
+import struct
+import sys
+import threading
 from typing import Optional
 
 KOMMUNERS_FILE = 'kommunes.json'
+KOMMUNES_INDEX_FILE = 'kommunes.index'
+
+# index file: header, POSTNUMMER_SLOTS little-endian uint16 kommun numbers,
+# sorted uint32 known postnummers, kommunes json without postnummers
+INDEX_MAGIC = b'PNIX'
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct('<4sHIII')
+POSTNUMMER_SLOTS = 100000
+NO_KOMMUN = 0xffff
+
+# postnummers are grouped by area, a nearest postnummer is looked for only in the same area
+POSTNUMMER_AREA_DIGITS = int(os.getenv('POSTNUMMER_AREA_DIGITS', '3'))
+POSTNUMMER_MAX_DISTANCE = int(os.getenv('POSTNUMMER_MAX_DISTANCE', '50'))
+
 
 class KommuneInfo:
     def __init__(
@@ -9,7 +29,7 @@ class KommuneInfo:
             name: str,
             kommun_link: str,
             vuxenutbildningar_link: Optional[str],
-            postnummers: list[str]
+            postnummers: Optional[list[str]] = None
     ):
         if name is None:
             raise Exception('Kommun name is none')
@@ -18,6 +38,7 @@ class KommuneInfo:
         self.name = name
         self.kommun_link = kommun_link
         self.vuxenutbildningar_link = vuxenutbildningar_link
+        # only kommunes read from kommunes.json have postnummers, the index keeps them in its table
         self.postnummers = postnummers
 
     @staticmethod
@@ -26,24 +47,125 @@ class KommuneInfo:
             name=json_dict['name'],
             kommun_link=json_dict['kommun_link'],
             vuxenutbildningar_link=json_dict['vuxenutbildningar_link'],
-            postnummers=json_dict['postnummers'],
+            postnummers=json_dict.get('postnummers'),
         )
 
+    def to_json(self) -> dict:
+        return {
+            'name': self.name,
+            'kommun_link': self.kommun_link,
+            'vuxenutbildningar_link': self.vuxenutbildningar_link,
+        }
+
+
+class NearestKommun:
+    def __init__(self, kommun: KommuneInfo, postnummer: str, distance: int):
+        self.kommun = kommun
+        self.postnummer = postnummer
+        self.distance = distance
+
+
+def to_postnummer_slot(postnum: str) -> Optional[int]:
+    if len(postnum) != 5 or not postnum.isdigit():
+        return None
+    return int(postnum)
+
+
 class PostnummerKomunProvider:
-    def __init__(self):
+    def __init__(self, kommuners_file: str = KOMMUNERS_FILE, index_file: str = KOMMUNES_INDEX_FILE):
+        self.kommuners_file = kommuners_file
+        self.index_file = index_file
         self.kommunes_ny_name: dict[str, KommuneInfo] = dict()
+        self.kommunes: list[KommuneInfo] = list()
         self.ponstnum_by_kommun: dict[str, KommuneInfo] = dict()
+        self.kommun_by_slot: Optional[memoryview] = None
+        self.known_slots = list()
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        # the file is read on the first lookup, most of updates never need it.
+        # The index built by build_postnummer_index.py is preferred, kommunes.json is the fallback
+        with self.lock:
+            if self.loaded:
+                return
+            if os.path.isfile(self.index_file) and sys.byteorder == 'little':
+                self.__load_index()
+            else:
+                self.__load_json()
+            self.loaded = True
 
-        with open(KOMMUNERS_FILE, 'r') as f:
+    def __load_index(self):
+        with open(self.index_file, 'rb') as f:
+            index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, slots, known_count, kommunes_size = INDEX_HEADER.unpack_from(index, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or slots != POSTNUMMER_SLOTS:
+            raise Exception(f'Unsupported postnummer index {self.index_file}: {magic} version {version}')
+
+        table_end = INDEX_HEADER.size + slots * 2
+        known_end = table_end + known_count * 4
+        kommunes_json = json.loads(bytes(index[known_end:known_end + kommunes_size]).decode('utf8'))
+        self.kommunes = [KommuneInfo.from_json(k) for k in kommunes_json]
+        self.kommunes_ny_name = {k.name: k for k in self.kommunes}
+        # the tables stay in the page cache, shared by all processes
+        self.kommun_by_slot = memoryview(index)[INDEX_HEADER.size:table_end].cast('H')
+        self.known_slots = memoryview(index)[table_end:known_end].cast('I')
+
+    def __load_json(self):
+        with open(self.kommuners_file, 'r') as f:
             postnummer_kommunes_json: list = json.load(f)
 
         for komun_json in postnummer_kommunes_json:
             komun = KommuneInfo.from_json(komun_json)
+            self.kommunes.append(komun)
             self.kommunes_ny_name[komun.name] = komun
             for pn in komun.postnummers:
                 self.ponstnum_by_kommun[pn] = komun
+        self.known_slots = sorted(
+            slot for slot in map(to_postnummer_slot, self.ponstnum_by_kommun.keys()) if slot is not None
+        )
 
     def get_kommun_info_by_number(self, postnum: str) -> Optional[KommuneInfo]:
-        return self.ponstnum_by_kommun.get(postnum)
+        if not self.loaded:
+            self.load()
+        if self.kommun_by_slot is None:
+            return self.ponstnum_by_kommun.get(postnum)
+
+        slot = to_postnummer_slot(postnum)
+        if slot is None:
+            return None
+        kommun_number = self.kommun_by_slot[slot]
+        return None if kommun_number == NO_KOMMUN else self.kommunes[kommun_number]
+
+    def get_nearest_kommun_info(self, postnum: str) -> Optional[NearestKommun]:
+        # the closest known postnummer of the same area, a binary search in the sorted known postnummers
+        if not self.loaded:
+            self.load()
+        slot = to_postnummer_slot(postnum)
+        if slot is None:
+            return None
+
+        area_size = 10 ** (5 - POSTNUMMER_AREA_DIGITS)
+        area_start = slot - slot % area_size
+        position = bisect.bisect_left(self.known_slots, slot)
+        candidates = []
+        if position > 0:
+            candidates.append(self.known_slots[position - 1])
+        if position < len(self.known_slots):
+            candidates.append(self.known_slots[position])
+        candidates = [
+            c for c in candidates
+            if area_start <= c < area_start + area_size and abs(c - slot) <= POSTNUMMER_MAX_DISTANCE
+        ]
+        if len(candidates) == 0:
+            return None
+
+        # on a tie the lower postnummer wins
+        nearest_slot = min(candidates, key=lambda c: (abs(c - slot), c))
+        nearest_postnum = f'{nearest_slot:05d}'
+        return NearestKommun(
+            self.get_kommun_info_by_number(nearest_postnum), nearest_postnum, abs(nearest_slot - slot)
+        )
+
 
-POSTNUMMER_KOMUN_PROVIDER = PostnummerKomunProvider()
\ No newline at end of file
+POSTNUMMER_KOMUN_PROVIDER = PostnummerKomunProvider()
@@ -0,0 +1,38 @@
+import os
+import tempfile
+
+import build_postnummer_index
+from postnummer_komun_provider import PostnummerKomunProvider
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    index_file = os.path.join(temp_dir, 'kommunes.index')
+    build_postnummer_index.build_index('kommunes.json', index_file)
+
+    json_provider = PostnummerKomunProvider('kommunes.json', os.path.join(temp_dir, 'missing.index'))
+    json_provider.load()
+    index_provider = PostnummerKomunProvider('kommunes.json', index_file)
+    index_provider.load()
+    assert index_provider.kommun_by_slot is not None
+
+    # the index finds the same kommun for every postnummer of kommunes.json
+    for postnum, kommun in json_provider.ponstnum_by_kommun.items():
+        assert index_provider.get_kommun_info_by_number(postnum).to_json() == kommun.to_json(), postnum
+
+    for postnum in ['00000', '99999', '1234', '123456', 'abcde', '']:
+        assert index_provider.get_kommun_info_by_number(postnum) is None, postnum
+        assert json_provider.get_kommun_info_by_number(postnum) is None, postnum
+
+    # the nearest known postnummer of the same area, found the same way in the index and in json
+    for postnum in ['29343', '11199', '10000', '99999', '98765', '1234']:
+        index_nearest = index_provider.get_nearest_kommun_info(postnum)
+        json_nearest = json_provider.get_nearest_kommun_info(postnum)
+        if index_nearest is None:
+            assert json_nearest is None, postnum
+            continue
+        assert index_nearest.postnummer[:3] == postnum[:3], postnum
+        assert index_nearest.distance == abs(int(index_nearest.postnummer) - int(postnum)), postnum
+        assert (index_nearest.postnummer, index_nearest.kommun.name) == (json_nearest.postnummer, json_nearest.kommun.name)
+
+    nearest = index_provider.get_nearest_kommun_info('29343')
+    assert (nearest.postnummer, nearest.distance, nearest.kommun.name) == ('29342', 1, 'Olofström')
+    assert index_provider.get_nearest_kommun_info('29342').distance == 0
@@ -0,0 +1,34 @@
+import collections
+import json
+import os
+import sys
+
+import topics_modelling as model
+
+POSTS_FILE = os.getenv('POSTS_FILE', '../data/all_posts_TillSverige.json')
+LABELED_POSTS_FILE = os.getenv('LABELED_POSTS_FILE', 'labeled_posts.json')
+RELABEL_BATCH_SIZE = int(os.getenv('RELABEL_BATCH_SIZE', '256'))
+
+
+def relabel(posts: list[str], batch_size: int = RELABEL_BATCH_SIZE) -> list[dict]:
+    labeled = []
+    for i in range(0, len(posts), batch_size):
+        batch = posts[i:i + batch_size]
+        for post, prediction in zip(batch, model.predict_batch(batch)):
+            labeled.append(dict(prediction.to_dict(), post=post))
+    return labeled
+
+
+if __name__ == '__main__':
+    posts_file = sys.argv[1] if len(sys.argv) > 1 else POSTS_FILE
+    labeled_file = sys.argv[2] if len(sys.argv) > 2 else LABELED_POSTS_FILE
+
+    with open(posts_file, 'r') as f:
+        labeled_posts = relabel(json.load(f))
+    with open(labeled_file, 'w') as f:
+        json.dump(labeled_posts, f, ensure_ascii=False, indent=2)
+
+    counts = collections.Counter(p['topic'] for p in labeled_posts)
+    print(f'{len(labeled_posts)} posts are labeled to {labeled_file}')
+    for topic in model.TOPICS:
+        print(f'{topic:>10}: {counts[topic]}')
@@ -0,0 +1,90 @@
+import os
+import statistics
+import subprocess
+import sys
+
+STARTUP_MODULE = os.getenv('STARTUP_MODULE', 'lambda_function')
+STARTUP_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', '1000'))
+STARTUP_RUNS = int(os.getenv('STARTUP_RUNS', '5'))
+TOP_MODULES = int(os.getenv('TOP_MODULES', '15'))
+
+# parts of the bot that are loaded on the first use instead of the import
+LAZY_LOADS = {
+    'topics model': 'import topics_modelling; topics_modelling.load_model()',
+    'postnummer index': 'import postnummer_komun_provider as p; p.POSTNUMMER_KOMUN_PROVIDER.load()',
+}
+
+TIMED_CODE = '''
+import time
+start = time.perf_counter()
+{code}
+print(f'elapsed_ms={{(time.perf_counter() - start) * 1000}}')
+'''
+
+
+def get_child_env() -> dict:
+    env = dict(os.environ)
+    # the import must not depend on AWS, the storage is not used during the import anyway
+    env.setdefault('STORAGE_BACKEND', 'memory')
+    return env
+
+
+def run_timed(code: str, import_time: bool = False) -> tuple[float, str]:
+    args = [sys.executable]
+    if import_time:
+        args += ['-X', 'importtime']
+    args += ['-c', TIMED_CODE.format(code=code)]
+    result = subprocess.run(args, capture_output=True, text=True, env=get_child_env())
+    if result.returncode != 0:
+        raise Exception(f'Profiled code failed: {result.stderr}')
+    elapsed_line = [line for line in result.stdout.splitlines() if line.startswith('elapsed_ms=')][-1]
+    return float(elapsed_line.split('=')[1]), result.stderr
+
+
+def parse_import_times(stderr: str) -> list[tuple[str, int, int]]:
+    # lines look like "import time:       self [us] |  cumulative | imported package"
+    import_times = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        import_times.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return import_times
+
+
+def print_import_report(module: str):
+    elapsed_ms, stderr = run_timed(f'import {module}', import_time=True)
+    import_times = parse_import_times(stderr)
+    top_level = [(name.strip(), self_us, cumulative_us) for name, self_us, cumulative_us in import_times
+                 if '.' not in name.strip()]
+    top_level.sort(key=lambda t: t[2], reverse=True)
+
+    print(f'Import of {module}: {elapsed_ms:.1f} ms')
+    print(f'{"module":<32}{"self ms":>10}{"cumulative ms":>16}')
+    for name, self_us, cumulative_us in top_level[:TOP_MODULES]:
+        print(f'{name:<32}{self_us / 1000:>10.1f}{cumulative_us / 1000:>16.1f}')
+
+
+def print_lazy_loads_report():
+    print('Loaded on first use:')
+    for name, code in LAZY_LOADS.items():
+        elapsed_ms, _ = run_timed(code)
+        print(f'{name:<32}{elapsed_ms:>10.1f} ms')
+
+
+def check_budget(module: str) -> bool:
+    timings = [run_timed(f'import {module}')[0] for _ in range(STARTUP_RUNS)]
+    median_ms = statistics.median(timings)
+    print(f'Cold import of {module}: median {median_ms:.1f} ms of {STARTUP_RUNS} runs, budget {STARTUP_BUDGET_MS:.0f} ms')
+    return median_ms <= STARTUP_BUDGET_MS
+
+
+if __name__ == '__main__':
+    module_name = sys.argv[1] if len(sys.argv) > 1 else STARTUP_MODULE
+    print_import_report(module_name)
+    print()
+    print_lazy_loads_report()
+    print()
+    if not check_budget(module_name):
+        print('Cold start budget is exceeded')
+        sys.exit(1)
@@ -0,0 +1,244 @@
+import copy
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'dynamodb')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'se_migrant_help_bot.sqlite')
+
+
+class StorageError(Exception):
+    def __init__(self, code: str, message: str):
+        super().__init__(f'{code}: {message}')
+        self.code = code
+        self.message = message
+
+
+class ConditionFailedError(StorageError):
+    def __init__(self, message: str):
+        super().__init__('ConditionalCheckFailedException', message)
+
+
+# Items are plain dicts with str, int, bool, None, list and dict values.
+# With `expected`, update_item/delete_item need an existing item whose `expected` attributes
+# are absent or equal to the given values, otherwise ConditionFailedError is raised.
+class StorageBackend:
+    name = 'abstract'
+
+    def create_table_if_not_exists(self, table_name: str, hash_key: str, range_key: Optional[str] = None):
+        raise NotImplementedError("Please Implement this method")
+
+    def get_item(self, table_name: str, key: dict) -> Optional[dict]:
+        raise NotImplementedError("Please Implement this method")
+
+    def put_item(self, table_name: str, key: dict, attributes: dict):
+        raise NotImplementedError("Please Implement this method")
+
+    def update_item(self, table_name: str, key: dict, values: dict, expected: Optional[dict] = None):
+        raise NotImplementedError("Please Implement this method")
+
+    def delete_item(self, table_name: str, key: dict, expected: Optional[dict] = None):
+        raise NotImplementedError("Please Implement this method")
+
+    def batch_put_items(self, table_name: str, items: list[tuple[dict, dict]]):
+        # items are (key, attributes) pairs, written like put_item, but not in one request for every item
+        for key, attributes in items:
+            self.put_item(table_name, key, attributes)
+
+
+def check_expected(table_name: str, key: dict, item: Optional[dict], expected: Optional[dict]):
+    if expected is None:
+        return
+    if item is None:
+        raise ConditionFailedError(f'Item {key} in table {table_name} does not exist')
+    for k, v in expected.items():
+        if k in item and item[k] != v:
+            raise ConditionFailedError(
+                f'Item {key} in table {table_name} has {k}={item[k]}, expected {v}'
+            )
+
+
+def to_key_string(key: dict) -> str:
+    return json.dumps(key, sort_keys=True)
+
+
+class InMemoryBackend(StorageBackend):
+    name = 'memory'
+
+    def __init__(self):
+        self.tables: dict[str, dict[str, dict]] = dict()
+        self.lock = threading.Lock()
+
+    def create_table_if_not_exists(self, table_name: str, hash_key: str, range_key: Optional[str] = None):
+        with self.lock:
+            self.tables.setdefault(table_name, dict())
+
+    def __table(self, table_name: str) -> dict[str, dict]:
+        return self.tables.setdefault(table_name, dict())
+
+    def get_item(self, table_name: str, key: dict) -> Optional[dict]:
+        with self.lock:
+            item = self.__table(table_name).get(to_key_string(key))
+            return copy.deepcopy(item)
+
+    def put_item(self, table_name: str, key: dict, attributes: dict):
+        item = copy.deepcopy(attributes)
+        item.update(key)
+        with self.lock:
+            self.__table(table_name)[to_key_string(key)] = item
+
+    def batch_put_items(self, table_name: str, items: list[tuple[dict, dict]]):
+        with self.lock:
+            table = self.__table(table_name)
+            for key, attributes in items:
+                item = copy.deepcopy(attributes)
+                item.update(key)
+                table[to_key_string(key)] = item
+
+    def update_item(self, table_name: str, key: dict, values: dict, expected: Optional[dict] = None):
+        with self.lock:
+            table = self.__table(table_name)
+            item = table.get(to_key_string(key))
+            check_expected(table_name, key, item, expected)
+            if item is None:
+                item = dict(key)
+                table[to_key_string(key)] = item
+            item.update(copy.deepcopy(values))
+
+    def delete_item(self, table_name: str, key: dict, expected: Optional[dict] = None):
+        with self.lock:
+            table = self.__table(table_name)
+            check_expected(table_name, key, table.get(to_key_string(key)), expected)
+            table.pop(to_key_string(key), None)
+
+
+class SqliteBackend(StorageBackend):
+    name = 'sqlite'
+    TABLE_NAME_PATTERN = re.compile(r'^\w+$')
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.known_tables: set[str] = set()
+        self.lock = threading.Lock()
+
+    def __connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # autocommit mode, transactions are opened explicitly
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def __table(self, table_name: str) -> sqlite3.Connection:
+        connection = self.__connection()
+        if table_name not in self.known_tables:
+            if not SqliteBackend.TABLE_NAME_PATTERN.match(table_name):
+                raise StorageError('ValidationException', f'Invalid table name {table_name}')
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {table_name} (item_key TEXT PRIMARY KEY, item TEXT NOT NULL)'
+            )
+            with self.lock:
+                self.known_tables.add(table_name)
+        return connection
+
+    @staticmethod
+    def __select(connection: sqlite3.Connection, table_name: str, key_string: str) -> Optional[dict]:
+        row = connection.execute(
+            f'SELECT item FROM {table_name} WHERE item_key = ?', (key_string,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def create_table_if_not_exists(self, table_name: str, hash_key: str, range_key: Optional[str] = None):
+        self.__table(table_name)
+
+    def get_item(self, table_name: str, key: dict) -> Optional[dict]:
+        connection = self.__table(table_name)
+        return self.__select(connection, table_name, to_key_string(key))
+
+    def put_item(self, table_name: str, key: dict, attributes: dict):
+        item = dict(attributes)
+        item.update(key)
+        connection = self.__table(table_name)
+        connection.execute(
+            f'INSERT OR REPLACE INTO {table_name} (item_key, item) VALUES (?, ?)',
+            (to_key_string(key), json.dumps(item))
+        )
+
+    def batch_put_items(self, table_name: str, items: list[tuple[dict, dict]]):
+        connection = self.__table(table_name)
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                f'INSERT OR REPLACE INTO {table_name} (item_key, item) VALUES (?, ?)',
+                [(to_key_string(key), json.dumps({**attributes, **key})) for key, attributes in items]
+            )
+            connection.execute('COMMIT')
+        except Exception as error:
+            connection.execute('ROLLBACK')
+            raise error
+
+    def update_item(self, table_name: str, key: dict, values: dict, expected: Optional[dict] = None):
+        connection = self.__table(table_name)
+        key_string = to_key_string(key)
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            item = self.__select(connection, table_name, key_string)
+            check_expected(table_name, key, item, expected)
+            if item is None:
+                item = dict(key)
+            item.update(values)
+            connection.execute(
+                f'INSERT OR REPLACE INTO {table_name} (item_key, item) VALUES (?, ?)',
+                (key_string, json.dumps(item))
+            )
+            connection.execute('COMMIT')
+        except Exception as error:
+            connection.execute('ROLLBACK')
+            raise error
+
+    def delete_item(self, table_name: str, key: dict, expected: Optional[dict] = None):
+        connection = self.__table(table_name)
+        key_string = to_key_string(key)
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            check_expected(table_name, key, self.__select(connection, table_name, key_string), expected)
+            connection.execute(f'DELETE FROM {table_name} WHERE item_key = ?', (key_string,))
+            connection.execute('COMMIT')
+        except Exception as error:
+            connection.execute('ROLLBACK')
+            raise error
+
+
+def create_storage_backend(backend_name: str = STORAGE_BACKEND) -> StorageBackend:
+    if backend_name == 'dynamodb':
+        # boto3 is imported only when it is really used
+        from dynamo_db_provider import DynamoDbBackend
+        return DynamoDbBackend()
+    elif backend_name == 'memory':
+        return InMemoryBackend()
+    elif backend_name == 'sqlite':
+        return SqliteBackend()
+    raise Exception(f'Undefined storage backend: {backend_name}')
+
+
+storage_backend: Optional[StorageBackend] = None
+storage_backend_lock = threading.Lock()
+
+
+def get_storage_backend() -> StorageBackend:
+    global storage_backend
+
+    with storage_backend_lock:
+        if storage_backend is None:
+            storage_backend = create_storage_backend()
+            logger.info('Storage backend: %s', storage_backend.name)
+        return storage_backend
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+import time
+
+from storage_backends import SqliteBackend, create_storage_backend
+from user_session_storage import UserSessionStorage
+
+SESSIONS = int(os.getenv('BENCHMARK_SESSIONS', '1000'))
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measure(timings: dict[str, list[float]], name: str, call):
+    start = time.perf_counter()
+    result = call()
+    timings.setdefault(name, []).append(time.perf_counter() - start)
+    return result
+
+
+def run_benchmark(backend_name: str, temp_dir: str):
+    if backend_name == 'sqlite':
+        backend = SqliteBackend(os.path.join(temp_dir, 'benchmark.sqlite'))
+    else:
+        backend = create_storage_backend(backend_name)
+    storage = UserSessionStorage(backend=backend, cache_size=0)
+    storage.create_table_if_not_exists()
+
+    timings: dict[str, list[float]] = dict()
+    for i in range(SESSIONS):
+        chat_id = f'benchmark_{i}'
+        new_session = storage.create_new_session(
+            chat_id=chat_id, state_id='select_topic', current_message_id=i, current_text='Choose the option'
+        )
+        new_session.session_attributes['topic'] = 'swedish'
+        measure(timings, 'save', lambda: storage.save_new_session(new_session))
+        user_session = measure(timings, 'get', lambda: storage.get_session(chat_id))
+        user_session.state_id = 'head_topic_swedish'
+        measure(timings, 'update', lambda: storage.update_user_session(user_session))
+        measure(timings, 'delete', lambda: storage.delete_session(user_session))
+
+    for name, values in timings.items():
+        print(
+            f'{backend_name:>8} {name:>6}: '
+            f'avg {sum(values) / len(values) * 1e6:9.1f} us, '
+            f'p50 {percentile(values, 0.5) * 1e6:9.1f} us, '
+            f'p99 {percentile(values, 0.99) * 1e6:9.1f} us'
+        )
+
+
+if __name__ == '__main__':
+    backend_names = sys.argv[1:] if len(sys.argv) > 1 else ['memory', 'sqlite']
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in backend_names:
+            run_benchmark(name, temp_dir)
@@ -0,0 +1,142 @@
+import os
+import tempfile
+
+from analytics_buffer import AnalyticsBuffer
+from storage_backends import ConditionFailedError, InMemoryBackend, SqliteBackend
+from user_feedback_storage import UserFeedbackStorage
+from user_requests_storage import UserRequestsStorage
+from user_session_storage import StaleSessionError, UserSessionStorage
+
+temp_dir = tempfile.TemporaryDirectory()
+
+for backend in [InMemoryBackend(), SqliteBackend(os.path.join(temp_dir.name, 'test.sqlite'))]:
+    # raw items
+    backend.put_item('items', {'id': '1'}, {'text': 'hej', 'count': 1, 'attributes': {'a': 'b'}})
+    assert backend.get_item('items', {'id': '1'}) == {'id': '1', 'text': 'hej', 'count': 1, 'attributes': {'a': 'b'}}
+    assert backend.get_item('items', {'id': '2'}) is None
+
+    backend.update_item('items', {'id': '1'}, {'count': 2}, expected={'count': 1})
+    assert backend.get_item('items', {'id': '1'})['count'] == 2
+    try:
+        backend.update_item('items', {'id': '1'}, {'count': 3}, expected={'count': 1})
+        raise AssertionError('Update with outdated value must fail')
+    except ConditionFailedError:
+        pass
+    # update creates a missing item
+    backend.update_item('items', {'id': '3'}, {'count': 1})
+    assert backend.get_item('items', {'id': '3'}) == {'id': '3', 'count': 1}
+
+    backend.delete_item('items', {'id': '1'}, expected={'text': 'hej'})
+    assert backend.get_item('items', {'id': '1'}) is None
+    # a conditional update of a deleted item fails instead of creating it again
+    try:
+        backend.update_item('items', {'id': '1'}, {'count': 3}, expected={'count': 2})
+        raise AssertionError('Conditional update of a missing item must fail')
+    except ConditionFailedError:
+        pass
+    assert backend.get_item('items', {'id': '1'}) is None
+
+    # storages
+    session_storage = UserSessionStorage(backend=backend, cache_size=10)
+    session_storage.create_table_if_not_exists()
+    new_session = session_storage.create_new_session(
+        chat_id='42', state_id='select_topic', current_message_id=1, current_text='Choose'
+    )
+    new_session.session_attributes['topic'] = 'bank'
+    session_storage.save_new_session(new_session)
+
+    user_session = session_storage.get_session('42')
+    assert user_session.session_attributes == {'topic': 'bank'}
+    user_session.state_id = 'head_topic_bank'
+    session_storage.update_user_session(user_session)
+    assert backend.get_item('user_sessions', {'chat_id': '42'})['state_id'] == 'head_topic_bank'
+
+    # another process changed the session
+    backend.update_item('user_sessions', {'chat_id': '42'}, {'version': 10})
+    outdated_session = session_storage.get_session('42')
+    try:
+        session_storage.update_user_session(outdated_session)
+        raise AssertionError('Update of outdated session must fail')
+    except StaleSessionError:
+        pass
+    # the cache is dropped, so the next read gets the fresh session
+    assert session_storage.get_session('42').version == 10
+
+    with session_storage.coalesced_writes('42'):
+        for state_id in ['bank_1', 'bank_2', 'bank_3']:
+            user_session = session_storage.get_session('42')
+            user_session.state_id = state_id
+            session_storage.update_user_session(user_session)
+        assert backend.get_item('user_sessions', {'chat_id': '42'})['state_id'] == 'head_topic_bank'
+    stored_session = backend.get_item('user_sessions', {'chat_id': '42'})
+    assert stored_session['state_id'] == 'bank_3'
+    assert stored_session['version'] == 11
+
+    session_storage.delete_session(session_storage.get_session('42'))
+    assert session_storage.get_session('42') is None
+
+    # the session is deleted by another update, writes of the outdated one are stale
+    session_storage.save_new_session(new_session)
+    outdated_session = session_storage.get_session('42')
+    backend.delete_item('user_sessions', {'chat_id': '42'})
+    for write in [session_storage.update_user_session, session_storage.delete_session]:
+        try:
+            write(outdated_session)
+            raise AssertionError('Write of a deleted session must fail')
+        except StaleSessionError:
+            pass
+    assert backend.get_item('user_sessions', {'chat_id': '42'}) is None
+
+    requests_storage = UserRequestsStorage(backend=backend)
+    requests_storage.create_table_if_not_exists()
+    requests_storage.save_vote(chat_id=42, response_message_id=7, vote='good_answer')
+    # analytics are buffered until the end of an invocation
+    assert backend.get_item('user_requests', {'chat_id': '42', 'response_message_id': '7'}) is None
+    requests_storage.buffer.flush()
+    assert backend.get_item('user_requests', {'chat_id': '42', 'response_message_id': '7'})['vote'] == 'good_answer'
+
+    # a vote keeps the question, whether it is in the same flush or was written before
+    requests_storage.save_question(chat_id=42, question_message_id=8, question='sfi?', response_message_id=9, answer='yes')
+    requests_storage.save_vote(chat_id=42, response_message_id=9, vote='good_answer')
+    requests_storage.save_question(chat_id=42, question_message_id=10, question='bank?', response_message_id=11, answer='no')
+    requests_storage.buffer.flush()
+    requests_storage.save_vote(chat_id=42, response_message_id=11, vote='bad_answer')
+    requests_storage.buffer.flush()
+    assert backend.get_item('user_requests', {'chat_id': '42', 'response_message_id': '9'}) == {
+        'chat_id': '42', 'response_message_id': '9', 'question_message_id': '8', 'question': 'sfi?', 'answer': 'yes',
+        'vote': 'good_answer'
+    }
+    stored_request = backend.get_item('user_requests', {'chat_id': '42', 'response_message_id': '11'})
+    assert stored_request['question'] == 'bank?' and stored_request['vote'] == 'bad_answer'
+
+    feedback_storage = UserFeedbackStorage(backend=backend)
+    feedback_storage.create_table_if_not_exists()
+    feedback_storage.save_feedback(chat_id=42, session_id='s1', topic_id='bank', vote='good_conversation')
+    feedback_storage.buffer.flush()
+    assert backend.get_item('user_feedbacks', {'session_id': 's1', 'chat_id': '42'})['topic_id'] == 'bank'
+
+    # adding doesn't write on the way to the reply, a full buffer is written by flush_if_due
+    # without waiting for the end of an invocation, the last put of a key wins
+    buffer = AnalyticsBuffer(backend, max_size=30, max_age_seconds=60)
+    for i in range(30):
+        buffer.add('user_requests', {'chat_id': '43', 'response_message_id': str(i % 27)}, {'vote': f'vote_{i}'})
+    assert buffer.size() == 30 and buffer.is_due()
+    assert backend.get_item('user_requests', {'chat_id': '43', 'response_message_id': '26'}) is None
+    buffer.flush_if_due()
+    assert buffer.size() == 0
+    assert backend.get_item('user_requests', {'chat_id': '43', 'response_message_id': '26'})['vote'] == 'vote_26'
+    assert backend.get_item('user_requests', {'chat_id': '43', 'response_message_id': '2'})['vote'] == 'vote_29'
+
+
+class BrokenBackend(InMemoryBackend):
+    def batch_put_items(self, table_name: str, items: list[tuple[dict, dict]]):
+        raise ConnectionError('Could not connect to the endpoint URL')
+
+
+# a failed flush is logged, it doesn't fail the update after the reply is sent
+broken_buffer = AnalyticsBuffer(BrokenBackend(), max_size=25, max_age_seconds=60)
+broken_buffer.add('user_requests', {'chat_id': '44', 'response_message_id': '1'}, {'vote': 'good_answer'})
+broken_buffer.flush()
+assert broken_buffer.size() == 0
+
+temp_dir.cleanup()
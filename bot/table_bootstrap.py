@@ -0,0 +1,85 @@
+import json
+import logging
+import os
+import sys
+import time
+from typing import Optional
+
+from user_feedback_storage import USER_FEEDBACK_STORAGE
+from user_requests_storage import USER_REQUESTS_STORAGE
+from user_session_storage import USER_SESSION_STORAGE
+
+logger = logging.getLogger(__name__)
+
+# written by `python3 table_bootstrap.py provision` and shipped with the lambda
+SCHEMA_MARKER_FILE = os.getenv('SCHEMA_MARKER_FILE', 'schema_verified.json')
+
+ALL_STORAGES = [USER_SESSION_STORAGE, USER_FEEDBACK_STORAGE, USER_REQUESTS_STORAGE]
+
+
+def get_expected_schema() -> dict:
+    backend_names = {storage.backend.name for storage in ALL_STORAGES}
+    tables = dict()
+    for storage in ALL_STORAGES:
+        table_name, hash_key, range_key = storage.get_table_schema()
+        tables[table_name] = {'hash_key': hash_key, 'range_key': range_key}
+    return {'backends': sorted(backend_names), 'tables': tables}
+
+
+def read_marker(marker_file: str = SCHEMA_MARKER_FILE) -> Optional[dict]:
+    if not os.path.isfile(marker_file):
+        return None
+    with open(marker_file, 'r') as f:
+        return json.load(f)
+
+
+def is_schema_verified(marker_file: str = SCHEMA_MARKER_FILE) -> bool:
+    return read_marker(marker_file) == get_expected_schema()
+
+
+def create_tables():
+    for storage in ALL_STORAGES:
+        storage.create_table_if_not_exists()
+
+
+def provision_tables(marker_file: str = SCHEMA_MARKER_FILE):
+    create_tables()
+    with open(marker_file, 'w') as f:
+        json.dump(get_expected_schema(), f, indent=2, sort_keys=True)
+    logger.info('Tables are provisioned, marker is saved to %s', marker_file)
+
+
+def ensure_tables(marker_file: str = SCHEMA_MARKER_FILE):
+    # with a valid marker the runtime doesn't make any control plane calls
+    if is_schema_verified(marker_file):
+        return
+    logger.warning('Schema marker %s is missing or outdated, checking tables', marker_file)
+    create_tables()
+
+
+def report(marker_file: str = SCHEMA_MARKER_FILE):
+    start = time.perf_counter()
+    create_tables()
+    check_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    verified = is_schema_verified(marker_file)
+    marker_seconds = time.perf_counter() - start
+
+    print(f'Table checks on startup: {check_seconds * 1000:.1f} ms')
+    if verified:
+        print(f'Schema marker on startup: {marker_seconds * 1000:.3f} ms')
+        print(f'Saving per cold start: {(check_seconds - marker_seconds) * 1000:.1f} ms')
+    else:
+        print(f'Schema marker {marker_file} is missing or outdated, run provision first')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'provision'
+    if command == 'provision':
+        provision_tables()
+    elif command == 'report':
+        report()
+    else:
+        raise Exception(f'Undefined command: {command}. Use "provision" or "report"')
@@ -1,11 +1,29 @@
+import json
+import logging
+import os
+import threading
+import time
 from typing import Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 from token_provider import get_telegram_token
 
-BASE_URL = 'https://api.telegram.org/bot{}'
+logger = logging.getLogger(__name__)
+
+BASE_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org') + '/bot{}'
 SEND_MESSAGE_SUB_URL = '/sendMessage'
 EDIT_MESSAGE_SUB_URL = '/editMessageText'
+GET_UPDATES_SUB_URL = '/getUpdates'
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '10'))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', '3.05'))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', '10'))
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))
+TELEGRAM_BACKOFF_SECONDS = float(os.getenv('TELEGRAM_BACKOFF_SECONDS', '0.5'))
+# a lambda must not sleep for minutes because of a flood limit
+TELEGRAM_MAX_RETRY_AFTER_SECONDS = float(os.getenv('TELEGRAM_MAX_RETRY_AFTER_SECONDS', '10'))
 
 
 class MessageAction:
@@ -24,15 +42,174 @@ class MessageAction:
         self.new_text = new_text
 
 
-def post(sub_url, data):
+class CallMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: dict[str, dict] = dict()
+
+    def add(self, sub_url: str, seconds: float, status_code: Optional[int], retries: int):
+        with self.lock:
+            call = self.calls.get(sub_url)
+            if call is None:
+                call = {'count': 0, 'errors': 0, 'retries': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+                self.calls[sub_url] = call
+            call['count'] += 1
+            call['retries'] += retries
+            call['total_seconds'] += seconds
+            call['max_seconds'] = max(call['max_seconds'], seconds)
+            if status_code is None or status_code >= 300:
+                call['errors'] += 1
+
+    def snapshot(self) -> dict[str, dict]:
+        with self.lock:
+            result = dict()
+            for sub_url, call in self.calls.items():
+                result[sub_url] = dict(call, avg_seconds=call['total_seconds'] / call['count'])
+            return result
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+
+
+def create_http_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=TELEGRAM_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+HTTP_SESSION = create_http_session()
+CALL_METRICS = CallMetrics()
+
+
+def get_call_metrics() -> dict[str, dict]:
+    return CALL_METRICS.snapshot()
+
+
+def get_retry_after(response: requests.Response) -> Optional[float]:
+    # a broken body or an HTTP-date Retry-After falls back to the exponential backoff
+    try:
+        content = json.loads(response.content)
+    except ValueError:
+        content = None
+    parameters = content.get('parameters') if isinstance(content, dict) else None
+    retry_after = parameters.get('retry_after') if isinstance(parameters, dict) else None
+    if retry_after is None:
+        retry_after = response.headers.get('Retry-After')
+    try:
+        return None if retry_after is None else max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_retry_delay(
+        response: Optional[requests.Response],
+        attempt: int,
+        retry_server_errors: bool = True
+) -> Optional[float]:
+    if response is not None and response.status_code == 429:
+        retry_after = get_retry_after(response)
+        if retry_after is not None:
+            if retry_after > TELEGRAM_MAX_RETRY_AFTER_SECONDS:
+                return None
+            return retry_after
+    elif response is not None and (response.status_code < 500 or not retry_server_errors):
+        return None
+    return TELEGRAM_BACKOFF_SECONDS * (2 ** attempt)
+
+
+def encode_json_value(value):
+    # message texts are kept as utf8 bytes by the chat nodes
+    if isinstance(value, bytes):
+        return value.decode('utf8')
+    raise TypeError(f'Object of type {value.__class__.__name__} is not JSON serializable')
+
+
+class StaticMessageFields:
+    # fields of a message that are the same for every user, serialized only once
+    def __init__(self, values: dict):
+        self.values = values
+        self.json = json.dumps(values, default=encode_json_value)[1:-1].encode('utf8')
+
+
+class PreparedMessage(dict):
+    def __init__(self, static_fields: StaticMessageFields, **fields):
+        super().__init__(static_fields.values, **fields)
+        self.static_fields = static_fields
+
+    def has_static_values(self) -> bool:
+        # the message is a usual dict, so make sure nobody replaced a static field
+        return all(self.get(k) is v for k, v in self.static_fields.values.items())
+
+
+def encode_body(data) -> bytes:
+    if isinstance(data, PreparedMessage) and data.has_static_values():
+        static_values = data.static_fields.values
+        dynamic_values = {k: v for k, v in data.items() if k not in static_values}
+        parts = []
+        if len(static_values) > 0:
+            parts.append(data.static_fields.json)
+        if len(dynamic_values) > 0:
+            parts.append(json.dumps(dynamic_values, default=encode_json_value)[1:-1].encode('utf8'))
+        return b'{' + b', '.join(parts) + b'}'
+    return json.dumps(data, default=encode_json_value).encode('utf8')
+
+
+def post(sub_url, data, timeout: Optional[float] = None, retry_server_errors: bool = True):
     token = get_telegram_token()
     url = BASE_URL.format(token) + sub_url
-    return requests.post(url, json=data)
+    body = encode_body(data)
+    read_timeout = TELEGRAM_READ_TIMEOUT if timeout is None else timeout
+
+    start = time.perf_counter()
+    attempt = 0
+    response = None
+    try:
+        while True:
+            response = None
+            try:
+                response = HTTP_SESSION.post(
+                    url, data=body, headers=JSON_HEADERS, timeout=(TELEGRAM_CONNECT_TIMEOUT, read_timeout)
+                )
+                delay = get_retry_delay(response, attempt, retry_server_errors)
+            except requests.exceptions.ConnectTimeout as error:
+                # the request wasn't sent, so it is safe to repeat it
+                if attempt >= TELEGRAM_MAX_RETRIES:
+                    raise error
+                delay = get_retry_delay(None, attempt)
+
+            if delay is None or attempt >= TELEGRAM_MAX_RETRIES:
+                return response
+            logger.warning(
+                'Telegram call %s failed with status %s, retry in %s seconds',
+                sub_url, None if response is None else response.status_code, delay
+            )
+            time.sleep(delay)
+            attempt += 1
+    finally:
+        seconds = time.perf_counter() - start
+        CALL_METRICS.add(sub_url, seconds, None if response is None else response.status_code, attempt)
+        logger.debug('Telegram call %s took %.3f seconds, retries: %s', sub_url, seconds, attempt)
 
 
 def send_new_message(data):
-    return post(SEND_MESSAGE_SUB_URL, data)
+    # a 5xx can come after the message is sent, a retry would send it twice.
+    # 429 and connect timeouts are retried, telegram hasn't got the message then
+    return post(SEND_MESSAGE_SUB_URL, data, retry_server_errors=False)
 
 
 def update_message(data):
     return post(EDIT_MESSAGE_SUB_URL, data)
+
+
+def get_updates(offset: Optional[int], timeout: int):
+    data = {
+        'timeout': timeout,
+        'allowed_updates': ['message', 'callback_query'],
+    }
+    if offset is not None:
+        data['offset'] = offset
+    # the request itself must outlive the long polling timeout
+    return post(GET_UPDATES_SUB_URL, data, timeout=timeout + 10)
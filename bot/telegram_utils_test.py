@@ -0,0 +1,73 @@
+import os
+
+import requests
+
+from fake_telegram import FAKE_TOKEN, FakeTelegramServer
+
+fake_telegram = FakeTelegramServer().start()
+os.environ['TELEGRAM_API_URL'] = fake_telegram.url
+os.environ['TELEGRAM_BOT_TOKEN'] = FAKE_TOKEN
+os.environ['TELEGRAM_BACKOFF_SECONDS'] = '0.01'
+
+import telegram_utils as t_utils
+
+data = {'chat_id': 1, 'text': 'Hej Sverige 🙂'.encode('utf8')}
+
+response = t_utils.send_new_message(data)
+assert response.status_code == 200
+assert fake_telegram.get_requests('sendMessage')[-1][1]['text'] == 'Hej Sverige 🙂'
+
+# flood limit is retried after retry_after
+fake_telegram.fail_next('sendMessage', 429, retry_after=0)
+response = t_utils.send_new_message(data)
+assert response.status_code == 200
+
+# server errors are retried with backoff
+fake_telegram.fail_next('editMessageText', 502)
+fake_telegram.fail_next('editMessageText', 503)
+response = t_utils.update_message(dict(data, message_id=1))
+assert response.status_code == 200
+
+# a new message is not retried after a server error, it could be sent already
+fake_telegram.fail_next('sendMessage', 502)
+response = t_utils.send_new_message(data)
+assert response.status_code == 502
+
+# client errors are not retried
+fake_telegram.fail_next('sendMessage', 400)
+response = t_utils.send_new_message(data)
+assert response.status_code == 400
+
+# too long flood limit is returned to the caller
+fake_telegram.fail_next('sendMessage', 429, retry_after=3600)
+response = t_utils.send_new_message(data)
+assert response.status_code == 429
+
+
+
+def flood_response(content: bytes, retry_after_header: str = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 429
+    response._content = content
+    if retry_after_header is not None:
+        response.headers['Retry-After'] = retry_after_header
+    return response
+
+
+# a broken flood limit response falls back to the backoff instead of failing the call
+backoff = t_utils.get_retry_delay(None, 1)
+assert t_utils.get_retry_delay(flood_response(b'{"parameters": {"retry_after": 2}}'), 1) == 2
+assert t_utils.get_retry_delay(flood_response(b'[1, 2]'), 1) == backoff
+assert t_utils.get_retry_delay(flood_response(b'{"parameters": "soon"}'), 1) == backoff
+assert t_utils.get_retry_delay(flood_response(b'<html>Too Many Requests</html>'), 1) == backoff
+assert t_utils.get_retry_delay(flood_response(b'', 'Wed, 21 Oct 2026 07:28:00 GMT'), 1) == backoff
+assert t_utils.get_retry_delay(flood_response(b'', '3'), 1) == 3
+
+metrics = t_utils.get_call_metrics()
+assert metrics[t_utils.SEND_MESSAGE_SUB_URL]['count'] == 5
+assert metrics[t_utils.SEND_MESSAGE_SUB_URL]['retries'] == 1
+assert metrics[t_utils.SEND_MESSAGE_SUB_URL]['errors'] == 3
+assert metrics[t_utils.EDIT_MESSAGE_SUB_URL]['retries'] == 2
+assert metrics[t_utils.EDIT_MESSAGE_SUB_URL]['max_seconds'] > 0
+
+fake_telegram.stop()
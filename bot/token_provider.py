@@ -2,13 +2,15 @@ import json
 import logging
 import os
 
-import boto3
 from botocore.exceptions import ClientError
 
+import aws_clients
+
 SECRET_REGION_NAME = os.getenv('SECRET_REGION_NAME', 'eu-north-1')
 logger = logging.getLogger(__name__)
 
-telegram_token = None
+# set it to skip Secrets Manager, e.g. for a local worker or a fake telegram server
+telegram_token = os.getenv('TELEGRAM_BOT_TOKEN')
 
 
 def get_telegram_token():
@@ -23,12 +25,8 @@ def get_telegram_token():
 def request_telegram_token():
     secret_name = 'prod/se_migrant_help_bot'
 
-    # Create a Secrets Manager client
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=SECRET_REGION_NAME
-    )
+    # Secrets Manager client
+    client = aws_clients.get_client('secretsmanager', SECRET_REGION_NAME)
 
     try:
         get_secret_value_response = client.get_secret_value(
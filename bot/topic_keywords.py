@@ -0,0 +1,45 @@
+import re
+from typing import Optional
+
+# words that name a topic without doubt, checked before the model
+TOPIC_KEYWORDS = {
+    'swedish': [
+        'sfi', 'svenska för invandrare', 'komvux', 'learn swedish', 'learning swedish', 'study swedish',
+        'swedish course', 'swedish courses', 'swedish class', 'swedish classes', 'swedish lessons',
+        'swedish language',
+    ],
+    'bank': [
+        'bankid', 'bank id', 'bank ids', 'bank account', 'bank accounts', 'bankkonto', 'swish', 'open an account',
+    ],
+    'pn': [
+        'personnummer', 'personal number', 'personal identity number', 'samordningsnummer',
+        'coordination number', 'id card', 'id-kort',
+    ],
+    'apartment': [
+        'hyresrätt', 'hyresavtal', 'lägenhet', 'andrahand', 'andrahandskontrakt', 'förstahandskontrakt',
+        'bostadskö', 'apartment', 'apartments', 'rental contract', 'second hand contract', 'first hand contract',
+    ],
+    'culture': [
+        'culture shock', 'kulturchock', 'fika', 'lagom', 'jantelagen', 'swedish culture', 'swedish traditions',
+    ],
+}
+
+
+def compile_keywords(topic_keywords: dict[str, list[str]]) -> re.Pattern:
+    # one pattern with a named group per topic, longer keywords first so "bank id" wins over "bank"
+    groups = []
+    for topic, keywords in topic_keywords.items():
+        alternatives = '|'.join(re.escape(k).replace(r'\ ', r'\s+') for k in sorted(keywords, key=len, reverse=True))
+        groups.append(f'(?P<{topic}>{alternatives})')
+    return re.compile(r'(?<!\w)(?:' + '|'.join(groups) + r')(?!\w)', re.IGNORECASE)
+
+
+KEYWORDS_PATTERN = compile_keywords(TOPIC_KEYWORDS)
+
+
+def get_keyword_topic(message: str) -> Optional[str]:
+    # a message with keywords of different topics is left to the model
+    topics = {match.lastgroup for match in KEYWORDS_PATTERN.finditer(message)}
+    if len(topics) == 1:
+        return topics.pop()
+    return None
@@ -0,0 +1,8 @@
+import topic_keywords
+
+# obvious messages have a topic, messages with keywords of several topics have none
+assert topic_keywords.get_keyword_topic('I want to start SFI') == 'swedish'
+assert topic_keywords.get_keyword_topic('How do I get BankID?') == 'bank'
+assert topic_keywords.get_keyword_topic('Hur får jag en hyresrätt?') == 'apartment'
+assert topic_keywords.get_keyword_topic('Can I get a BankID without personnummer?') is None
+assert topic_keywords.get_keyword_topic('Hello') is None
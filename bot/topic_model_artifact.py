@@ -0,0 +1,234 @@
+import functools
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+ARTIFACT_VERSION = 2
+PARAMS_FILE = 'params.json'
+BUCKETS_FILE = 'buckets.npy'
+IDF_FILE = 'idf.npy'
+PROJECTION_FILE = 'projection.npy'
+CENTROIDS_FILE = 'centroids.npy'
+TOKENS_FILE = 'tokens.npy'
+TOKEN_BUCKETS_FILE = 'token_buckets.npy'
+TOKEN_SIGNS_FILE = 'token_signs.npy'
+UNKNOWN_TOKENS_CACHE_SIZE = int(os.getenv('UNKNOWN_TOKENS_CACHE_SIZE', '10000'))
+
+QUESTIONS_FILE = '../data/generated_questions.csv'
+POSTS_FILE = '../data/all_posts_TillSverige.json'
+
+UINT32_MASK = 0xffffffff
+
+
+def rotl32(x: int, r: int) -> int:
+    return ((x << r) | (x >> (32 - r))) & UINT32_MASK
+
+
+def murmurhash3_32(data: bytes, seed: int = 0) -> int:
+    # MurmurHash3 x86_32 as signed int, the same as sklearn.utils.murmurhash3_32(data, seed)
+    c1 = 0xcc9e2d51
+    c2 = 0x1b873593
+    length = len(data)
+    h = seed & UINT32_MASK
+    rounded_end = length & ~3
+
+    for i in range(0, rounded_end, 4):
+        k = int.from_bytes(data[i:i + 4], 'little')
+        k = rotl32((k * c1) & UINT32_MASK, 15)
+        h ^= (k * c2) & UINT32_MASK
+        h = (rotl32(h, 13) * 5 + 0xe6546b64) & UINT32_MASK
+
+    k = 0
+    tail = length & 3
+    if tail == 3:
+        k ^= data[rounded_end + 2] << 16
+    if tail >= 2:
+        k ^= data[rounded_end + 1] << 8
+    if tail >= 1:
+        k ^= data[rounded_end]
+        k = rotl32((k * c1) & UINT32_MASK, 15)
+        h ^= (k * c2) & UINT32_MASK
+
+    h ^= length
+    h ^= h >> 16
+    h = (h * 0x85ebca6b) & UINT32_MASK
+    h ^= h >> 13
+    h = (h * 0xc2b2ae35) & UINT32_MASK
+    h ^= h >> 16
+    return h - (1 << 32) if h & 0x80000000 else h
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    # like sklearn.preprocessing.normalize: rows with zero norm are left as they are
+    norms = np.sqrt((matrix * matrix).sum(axis=1))
+    norms[norms == 0] = 1
+    return matrix / norms[:, None]
+
+
+class TopicModelArtifact:
+    # HashingVectorizer -> TfidfTransformer -> TruncatedSVD -> Normalizer -> KMeans without scikit-learn.
+    # Only hash buckets that the SVD projects to a nonzero vector are stored,
+    # other buckets change nothing but the tf-idf norm, where all of them have the same idf.
+    # All arrays are read-only mmaps, so worker processes on one host share their pages.
+    # Buckets of the training vocabulary are stored in a sorted token table,
+    # other tokens are hashed and cached per process.
+    def __init__(self, artifact_dir: str, mmap_mode: str = 'r'):
+        with open(os.path.join(artifact_dir, PARAMS_FILE), 'r') as f:
+            params = json.load(f)
+        if params.get('version') != ARTIFACT_VERSION:
+            raise Exception(f'Unsupported topic model artifact version {params.get("version")} in {artifact_dir}')
+
+        self.n_features = params['n_features']
+        self.lowercase = params['lowercase']
+        self.alternate_sign = params['alternate_sign']
+        self.token_pattern = re.compile(params['token_pattern'])
+        self.stop_words = frozenset(params['stop_words'])
+        self.default_idf = params['default_idf']
+
+        self.buckets = np.load(os.path.join(artifact_dir, BUCKETS_FILE), mmap_mode=mmap_mode)
+        self.idf = np.load(os.path.join(artifact_dir, IDF_FILE), mmap_mode=mmap_mode)
+        self.projection = np.load(os.path.join(artifact_dir, PROJECTION_FILE), mmap_mode=mmap_mode)
+        self.centroids = np.load(os.path.join(artifact_dir, CENTROIDS_FILE), mmap_mode=mmap_mode)
+        self.tokens = np.load(os.path.join(artifact_dir, TOKENS_FILE), mmap_mode=mmap_mode)
+        self.token_buckets = np.load(os.path.join(artifact_dir, TOKEN_BUCKETS_FILE), mmap_mode=mmap_mode)
+        self.token_signs = np.load(os.path.join(artifact_dir, TOKEN_SIGNS_FILE), mmap_mode=mmap_mode)
+        self.hash_token = functools.lru_cache(maxsize=UNKNOWN_TOKENS_CACHE_SIZE)(self.__hash_token)
+
+    def __hash_token(self, token: str) -> tuple[int, int]:
+        h = murmurhash3_32(token.encode('utf8'))
+        if h == -2147483648:
+            # abs(-2**31) doesn't fit into int32, sklearn hardcodes the bucket
+            bucket = (2147483647 - (self.n_features - 1)) % self.n_features
+        else:
+            bucket = abs(h) % self.n_features
+        sign = -1 if self.alternate_sign and h < 0 else 1
+        return bucket, sign
+
+    def get_tokens(self, message: str) -> list[str]:
+        if self.lowercase:
+            message = message.lower()
+        return [t for t in self.token_pattern.findall(message) if t not in self.stop_words]
+
+    def get_counts(self, message: str) -> dict[int, float]:
+        tokens = self.get_tokens(message)
+        if len(tokens) == 0:
+            return dict()
+        # one lookup for all tokens of the message
+        positions = np.searchsorted(self.tokens, tokens)
+        positions[positions == len(self.tokens)] = 0
+        known = self.tokens[positions] == tokens
+
+        counts = dict()
+        for token, position, is_known in zip(tokens, positions.tolist(), known.tolist()):
+            if is_known:
+                bucket, sign = int(self.token_buckets[position]), int(self.token_signs[position])
+            else:
+                bucket, sign = self.hash_token(token)
+            counts[bucket] = counts.get(bucket, 0.0) + sign
+        return {b: c for b, c in counts.items() if c != 0}
+
+    def transform(self, messages: list[str]) -> np.ndarray:
+        weights = np.zeros((len(messages), len(self.buckets)))
+        for i, message in enumerate(messages):
+            counts = self.get_counts(message)
+            if len(counts) == 0:
+                continue
+            buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+            tf /= np.sqrt((tf * tf).sum())
+
+            positions = np.searchsorted(self.buckets, buckets)
+            positions[positions == len(self.buckets)] = 0
+            known = self.buckets[positions] == buckets
+            tfidf = tf * np.where(known, self.idf[positions], self.default_idf)
+            tfidf /= np.sqrt((tfidf * tfidf).sum())
+            weights[i, positions[known]] = tfidf[known]
+        return normalize_rows(weights @ self.projection)
+
+    def get_distances(self, messages: list[str]) -> np.ndarray:
+        vectors = self.transform(messages)
+        differences = vectors[:, None, :] - self.centroids[None, :, :]
+        return np.sqrt((differences * differences).sum(axis=2))
+
+
+def export_artifact(kmeans, vectorizer, artifact_dir: str, vocabulary_messages: list[str]):
+    # takes the fitted pipeline from model.zip, scikit-learn is needed only to unpickle it.
+    # vocabulary_messages are the training messages, their tokens are stored with precomputed buckets
+    hashing = vectorizer.named_steps['hashingvectorizer']
+    tfidf = vectorizer.named_steps['tfidftransformer']
+    svd = vectorizer.named_steps['truncatedsvd']
+    if [name for name, _ in vectorizer.steps] != ['hashingvectorizer', 'tfidftransformer', 'truncatedsvd', 'normalizer']:
+        raise Exception(f'Unsupported vectorizer pipeline: {vectorizer.steps}')
+    if hashing.analyzer != 'word' or hashing.ngram_range != (1, 1) or hashing.norm != 'l2' \
+            or hashing.binary or hashing.preprocessor is not None or hashing.tokenizer is not None \
+            or hashing.strip_accents is not None:
+        raise Exception(f'Unsupported hashing vectorizer: {hashing}')
+    if tfidf.norm != 'l2' or tfidf.sublinear_tf or not tfidf.use_idf:
+        raise Exception(f'Unsupported tfidf transformer: {tfidf}')
+
+    idf = tfidf.idf_
+    # buckets that never appeared in the training data share the same idf
+    idf_values, idf_counts = np.unique(idf, return_counts=True)
+    default_idf = float(idf_values[idf_counts.argmax()])
+    buckets = np.flatnonzero((svd.components_ != 0).any(axis=0) | (idf != default_idf)).astype(np.int32)
+
+    os.makedirs(artifact_dir, exist_ok=True)
+    np.save(os.path.join(artifact_dir, BUCKETS_FILE), buckets)
+    np.save(os.path.join(artifact_dir, IDF_FILE), idf[buckets].astype(np.float64))
+    np.save(os.path.join(artifact_dir, PROJECTION_FILE), np.ascontiguousarray(svd.components_[:, buckets].T))
+    np.save(os.path.join(artifact_dir, CENTROIDS_FILE), np.ascontiguousarray(kmeans.cluster_centers_))
+
+    analyzer = hashing.build_analyzer()
+    tokens = sorted(set(t for m in vocabulary_messages for t in analyzer(m)))
+    hashes = [murmurhash3_32(t.encode('utf8')) for t in tokens]
+    if -2147483648 in hashes:
+        raise Exception('Token with hash -2**31 is not supported in the vocabulary')
+    np.save(os.path.join(artifact_dir, TOKENS_FILE), np.array(tokens, dtype=str))
+    np.save(os.path.join(artifact_dir, TOKEN_BUCKETS_FILE), np.array([abs(h) % hashing.n_features for h in hashes], dtype=np.int32))
+    np.save(
+        os.path.join(artifact_dir, TOKEN_SIGNS_FILE),
+        np.array([-1 if hashing.alternate_sign and h < 0 else 1 for h in hashes], dtype=np.int8)
+    )
+    with open(os.path.join(artifact_dir, PARAMS_FILE), 'w') as f:
+        json.dump({
+            'version': ARTIFACT_VERSION,
+            'n_features': hashing.n_features,
+            'lowercase': hashing.lowercase,
+            'alternate_sign': hashing.alternate_sign,
+            'token_pattern': hashing.token_pattern,
+            'stop_words': sorted(hashing.get_stop_words() or []),
+            'default_idf': default_idf,
+        }, f, indent=2)
+
+
+def verify_artifact(kmeans, vectorizer, artifact: TopicModelArtifact, messages: list[str]) -> list[str]:
+    expected = kmeans.predict(vectorizer.transform(messages))
+    labels = artifact.get_distances(messages).argmin(axis=1)
+    return [m for m, e, l in zip(messages, expected, labels) if e != l]
+
+
+if __name__ == '__main__':
+    import csv
+    import topics_modelling
+
+    model_file = sys.argv[1] if len(sys.argv) > 1 else topics_modelling.MODEL_FILE
+    target_dir = sys.argv[2] if len(sys.argv) > 2 else topics_modelling.MODEL_DIR
+
+    with open(QUESTIONS_FILE, 'r') as questions_file:
+        questions = [row['question'] for row in csv.DictReader(questions_file)]
+    with open(POSTS_FILE, 'r') as posts_file:
+        posts = json.load(posts_file)
+
+    sklearn_kmeans, sklearn_vectorizer = topics_modelling.load_sklearn_model(model_file)
+    # the model is trained on the questions
+    export_artifact(sklearn_kmeans, sklearn_vectorizer, target_dir, questions)
+    exported = TopicModelArtifact(target_dir)
+    print(f'Topic model is exported to {target_dir}: {len(exported.buckets)} buckets, {len(exported.tokens)} tokens')
+    mismatches = verify_artifact(sklearn_kmeans, sklearn_vectorizer, exported, questions + posts)
+    if len(mismatches) > 0:
+        print(f'Labels differ from scikit-learn for {len(mismatches)} messages: {mismatches[:5]}')
+        sys.exit(1)
+    print(f'Labels are the same as scikit-learn for {len(questions) + len(posts)} messages')
@@ -1,27 +1,185 @@
+import collections
+import csv
+import json
+import logging
+import os
 import pickle
+import threading
 import zipfile
+from typing import Optional
 
-with zipfile.ZipFile('model.zip') as zip_model:
-    KMEANS = pickle.loads(zip_model.read('model_kmeans'))
-    VECTORIZER = pickle.loads(zip_model.read('model_vectorizer'))
+from lru_cache import LruCache
 
-if KMEANS is None or VECTORIZER is None:
-    raise Exception("Can't load the model")
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = 'model.zip'
+MODEL_DIR = os.getenv('TOPIC_MODEL_DIR', 'topic_model')
+# topics in the order of kmeans categories
+TOPICS = ('swedish', 'bank', 'pn', 'apartment', 'culture')
+
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '1024'))
+# predictions saved by save_prediction_cache() and loaded on the first prediction
+PREDICTION_CACHE_FILE = os.getenv('PREDICTION_CACHE_FILE')
+# csv with a "question" column, its most frequent questions are predicted on the first prediction
+PREDICTION_CACHE_WARMUP_FILE = os.getenv('PREDICTION_CACHE_WARMUP_FILE')
+PREDICTION_CACHE_WARMUP_SIZE = int(os.getenv('PREDICTION_CACHE_WARMUP_SIZE', '256'))
+
+MODEL = None
+model_lock = threading.Lock()
+PREDICTION_CACHE = LruCache(PREDICTION_CACHE_SIZE) if PREDICTION_CACHE_SIZE > 0 else None
+prediction_cache_prepared = False
+prediction_cache_lock = threading.Lock()
+
+
+class SklearnTopicModel:
+    def __init__(self, kmeans, vectorizer):
+        self.kmeans = kmeans
+        self.vectorizer = vectorizer
+        self.analyzer = vectorizer.named_steps['hashingvectorizer'].build_analyzer()
+
+    def get_tokens(self, message: str) -> list[str]:
+        return self.analyzer(message)
+
+    def get_distances(self, messages: list[str]):
+        # distances to all centroids, kmeans.predict is the argmin of them
+        return self.kmeans.transform(self.vectorizer.transform(messages))
+
+
+def load_sklearn_model(model_file: str = MODEL_FILE):
+    with zipfile.ZipFile(model_file) as zip_model:
+        kmeans = pickle.loads(zip_model.read('model_kmeans'))
+        vectorizer = pickle.loads(zip_model.read('model_vectorizer'))
+
+    if kmeans is None or vectorizer is None:
+        raise Exception("Can't load the model")
+    return kmeans, vectorizer
+
+
+def load_model():
+    # the model is loaded on the first prediction, not on import.
+    # The numpy artifact exported by topic_model_artifact.py is preferred, model.zip needs scikit-learn
+    global MODEL
+
+    with model_lock:
+        if MODEL is None:
+            if os.path.isdir(MODEL_DIR):
+                from topic_model_artifact import TopicModelArtifact
+                MODEL = TopicModelArtifact(MODEL_DIR)
+            else:
+                MODEL = SklearnTopicModel(*load_sklearn_model())
+    return MODEL
+
+
+class TopicPrediction:
+    def __init__(self, topic: str, distance: float, margin: float, confidence: float):
+        self.topic = topic
+        # distance to the nearest centroid
+        self.distance = distance
+        # how much farther the second nearest centroid is
+        self.margin = margin
+        # margin relative to the second distance, 0 means the message is in the middle of two topics
+        self.confidence = confidence
+
+    @staticmethod
+    def from_dict(item: dict):
+        return TopicPrediction(item['topic'], item['distance'], item['margin'], item['confidence'])
+
+    def to_dict(self) -> dict:
+        return {
+            'topic': self.topic,
+            'distance': self.distance,
+            'margin': self.margin,
+            'confidence': self.confidence,
+        }
+
+
+def get_topic(category: int) -> str:
+    if 0 <= category < len(TOPICS):
+        return TOPICS[category]
+    raise Exception(f'Undefined category "{category}"')
+
+
+def predict_uncached(messages: list[str]) -> list[TopicPrediction]:
+    if len(messages) == 0:
+        return []
+    distances = load_model().get_distances(messages)
+    order = distances.argsort(axis=1)
+
+    predictions = []
+    for row, (nearest, second) in zip(distances, order[:, :2]):
+        distance = float(row[nearest])
+        second_distance = float(row[second])
+        margin = second_distance - distance
+        confidence = margin / second_distance if second_distance > 0 else 0.0
+        predictions.append(TopicPrediction(get_topic(int(nearest)), distance, margin, confidence))
+    return predictions
+
+
+def normalize_message(message: str) -> str:
+    # the model sees only the tokens of its own tokenizer, texts with the same tokens have the same topic
+    return ' '.join(load_model().get_tokens(message))
+
+
+def load_prediction_cache(cache_file: str):
+    with open(cache_file, 'r') as f:
+        items = json.load(f)
+    for key, item in items:
+        PREDICTION_CACHE.put(key, TopicPrediction.from_dict(item))
+    logger.info('%d predictions are loaded from %s', len(items), cache_file)
+
+
+def save_prediction_cache(cache_file: Optional[str] = PREDICTION_CACHE_FILE):
+    if PREDICTION_CACHE is None or cache_file is None:
+        return
+    items = [[key, prediction.to_dict()] for key, prediction in PREDICTION_CACHE.get_items()]
+    with open(cache_file, 'w') as f:
+        json.dump(items, f)
+
+
+def warm_up_prediction_cache(questions_file: str, warmup_size: int = PREDICTION_CACHE_WARMUP_SIZE):
+    with open(questions_file, 'r') as f:
+        counts = collections.Counter(normalize_message(row['question']) for row in csv.DictReader(f))
+    keys = [key for key, _ in counts.most_common(warmup_size)]
+    for key, prediction in zip(keys, predict_uncached(keys)):
+        PREDICTION_CACHE.put(key, prediction)
+    logger.info('Prediction cache is warmed up with %d questions from %s', len(keys), questions_file)
+
+
+def prepare_prediction_cache():
+    global prediction_cache_prepared
+
+    with prediction_cache_lock:
+        if prediction_cache_prepared:
+            return
+        prediction_cache_prepared = True
+        try:
+            if PREDICTION_CACHE_FILE is not None and os.path.isfile(PREDICTION_CACHE_FILE):
+                load_prediction_cache(PREDICTION_CACHE_FILE)
+            elif PREDICTION_CACHE_WARMUP_FILE is not None:
+                warm_up_prediction_cache(PREDICTION_CACHE_WARMUP_FILE)
+        except Exception as error:
+            # the cache is only an optimization, the bot works without it
+            logger.error("Can't prepare the prediction cache: %s", error)
+
+
+def get_prediction_cache_stats() -> Optional[dict]:
+    return None if PREDICTION_CACHE is None else PREDICTION_CACHE.get_stats()
+
+
+def predict_batch(messages: list[str]) -> list[TopicPrediction]:
+    if PREDICTION_CACHE is None:
+        return predict_uncached(messages)
+    prepare_prediction_cache()
+
+    keys = [normalize_message(m) for m in messages]
+    predictions = [PREDICTION_CACHE.get(key) for key in keys]
+    # every missed text is predicted once, in one call
+    missed_keys = list(dict.fromkeys(key for key, p in zip(keys, predictions) if p is None))
+    missed_predictions = dict(zip(missed_keys, predict_uncached(missed_keys)))
+    for key, prediction in missed_predictions.items():
+        PREDICTION_CACHE.put(key, prediction)
+    return [p if p is not None else missed_predictions[key] for key, p in zip(keys, predictions)]
 
 
 def get_topic_for_message(message: str) -> str:
-    test_vec = VECTORIZER.transform([message])
-    category = KMEANS.predict(test_vec)
-
-    if category == 0:
-        return 'swedish'
-    elif category == 1:
-        return 'bank'
-    elif category == 2:
-        return 'pn'
-    elif category == 3:
-        return 'apartment'
-    elif category == 4:
-        return 'culture'
-
-    raise Exception(f'Undefined category "{category}" for message "{message}"')
+    return predict_batch([message])[0].topic
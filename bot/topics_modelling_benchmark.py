@@ -0,0 +1,44 @@
+import csv
+import json
+import os
+import time
+
+import topics_modelling as model
+
+POSTS_FILE = os.getenv('POSTS_FILE', '../data/all_posts_TillSverige.json')
+QUESTIONS_FILE = os.getenv('QUESTIONS_FILE', '../data/generated_questions.csv')
+BATCH_SIZES = [int(s) for s in os.getenv('BENCHMARK_BATCH_SIZES', '1,16,64,256').split(',')]
+
+
+def predict_one_by_one(messages: list[str]):
+    topic_model = model.load_model()
+    return [model.get_topic(int(topic_model.get_distances([m]).argmin())) for m in messages]
+
+
+def predict_in_batches(messages: list[str], batch_size: int):
+    topics = []
+    for i in range(0, len(messages), batch_size):
+        topics.extend(p.topic for p in model.predict_batch(messages[i:i + batch_size]))
+    return topics
+
+
+def run_benchmark(name: str, messages: list[str]):
+    start = time.perf_counter()
+    expected = predict_one_by_one(messages)
+    elapsed = time.perf_counter() - start
+    print(f'{name}: {len(messages)} messages')
+    print(f'{"loop":>12}: {len(messages) / elapsed:10.1f} messages/s')
+    for batch_size in BATCH_SIZES:
+        start = time.perf_counter()
+        topics = predict_in_batches(messages, batch_size)
+        elapsed = time.perf_counter() - start
+        assert topics == expected
+        print(f'{"batch " + str(batch_size):>12}: {len(messages) / elapsed:10.1f} messages/s')
+
+
+if __name__ == '__main__':
+    model.load_model()
+    with open(POSTS_FILE, 'r') as f:
+        run_benchmark('posts', json.load(f))
+    with open(QUESTIONS_FILE, 'r') as f:
+        run_benchmark('questions', [row['question'] for row in csv.DictReader(f)])
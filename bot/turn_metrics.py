@@ -0,0 +1,114 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# one line per update with the time of every stage, in CloudWatch embedded metric format,
+# so p50/p99 per stage and per node id come from CloudWatch metrics without log queries
+TURN_METRICS_ENABLED = os.getenv('TURN_METRICS_ENABLED', 'true').lower() == 'true'
+TURN_METRICS_NAMESPACE = os.getenv('TURN_METRICS_NAMESPACE', 'SeMigrantHelpBot')
+
+SESSION_READ = 'session_read'
+NEXT_STATE = 'next_state'
+PREDICTION = 'prediction'
+RENDER = 'render'
+SEND_MESSAGE = 'send_message'
+LOCK_MESSAGE = 'lock_message'
+SESSION_WRITE = 'session_write'
+TOTAL = 'total'
+
+
+class Turn:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stage_ms: dict[str, float] = dict()
+        self.properties: dict[str, str] = dict()
+        # stages of the background calls are added from the io threads
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, elapsed_ms: float):
+        with self.lock:
+            self.stage_ms[stage] = self.stage_ms.get(stage, 0.0) + elapsed_ms
+
+    def set(self, name: str, value: str):
+        with self.lock:
+            self.properties[name] = value
+
+    def to_emf(self) -> dict:
+        with self.lock:
+            stage_ms = dict(self.stage_ms)
+            properties = dict(self.properties)
+        stage_ms[TOTAL] = (time.perf_counter() - self.start) * 1000
+        node_id = properties.pop('node_id', 'none')
+        metric_names = [f'{stage}_ms' for stage in stage_ms]
+        line = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': TURN_METRICS_NAMESPACE,
+                    # the empty dimension set has the metrics of all nodes together
+                    'Dimensions': [['node_id'], []],
+                    'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in metric_names],
+                }],
+            },
+            'node_id': node_id,
+        }
+        line.update(properties)
+        line.update({name: round(stage_ms[stage], 3) for name, stage in zip(metric_names, stage_ms)})
+        return line
+
+
+CURRENT_TURN: contextvars.ContextVar[Optional[Turn]] = contextvars.ContextVar('current_turn', default=None)
+
+
+@contextlib.contextmanager
+def turn():
+    if not TURN_METRICS_ENABLED:
+        yield None
+        return
+    current = Turn()
+    token = CURRENT_TURN.set(current)
+    try:
+        yield current
+    except Exception:
+        current.set('status', 'error')
+        raise
+    finally:
+        CURRENT_TURN.reset(token)
+        emit(current)
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    current = CURRENT_TURN.get()
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.add(stage, (time.perf_counter() - start) * 1000)
+
+
+def set_property(name: str, value: str):
+    current = CURRENT_TURN.get()
+    if current is not None:
+        current.set(name, value)
+
+
+def emit(current: Turn):
+    try:
+        line = json.dumps(current.to_emf(), separators=(',', ':'))
+    except (TypeError, ValueError) as error:
+        logger.error("Couldn't serialize turn metrics %s. Error: %s", current.properties, error, exc_info=True)
+        return
+    # EMF needs a log line that is json only, the lambda log handler adds a prefix to logger lines
+    sys.stdout.write(line + '\n')
@@ -0,0 +1,60 @@
+import contextlib
+import contextvars
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import turn_metrics
+
+executor = ThreadPoolExecutor(max_workers=2)
+
+
+def write_session():
+    with turn_metrics.span(turn_metrics.SESSION_WRITE):
+        pass
+
+
+def lock_message():
+    with turn_metrics.span(turn_metrics.LOCK_MESSAGE):
+        pass
+
+
+# spans of executor threads are added to the turn only with a copied context
+output = io.StringIO()
+with contextlib.redirect_stdout(output):
+    with turn_metrics.turn():
+        turn_metrics.set_property('node_id', 'select_topic')
+        for _ in range(2):
+            with turn_metrics.span(turn_metrics.RENDER):
+                pass
+        executor.submit(contextvars.copy_context().run, write_session).result()
+        executor.submit(lock_message).result()
+
+lines = output.getvalue().splitlines()
+assert len(lines) == 1
+line = json.loads(lines[0])
+assert line['node_id'] == 'select_topic'
+assert set(k for k in line if k.endswith('_ms')) == {'render_ms', 'session_write_ms', 'total_ms'}
+metrics = line['_aws']['CloudWatchMetrics'][0]
+assert metrics['Dimensions'] == [['node_id'], []]
+assert sorted(m['Name'] for m in metrics['Metrics']) == ['render_ms', 'session_write_ms', 'total_ms']
+assert line['total_ms'] >= line['render_ms']
+
+# a failed turn is emitted too
+output = io.StringIO()
+with contextlib.redirect_stdout(output):
+    try:
+        with turn_metrics.turn():
+            raise Exception('Telegram is down')
+    except Exception:
+        pass
+line = json.loads(output.getvalue())
+assert line['status'] == 'error'
+assert line['node_id'] == 'none'
+
+# spans outside of a turn are ignored
+with turn_metrics.span(turn_metrics.RENDER):
+    pass
+assert turn_metrics.CURRENT_TURN.get() is None
+
+executor.shutdown()
@@ -0,0 +1,87 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# incoming updates are appended to UPDATE_CAPTURE_FILE as json lines for update_replay.py, empty disables it.
+# Only the fields the bot reads are kept, chat ids are replaced by HMACs with the secret UPDATE_CAPTURE_SALT
+# and names by one name. Nothing is captured without the salt: chat ids are too few to hide them in a plain hash.
+# Texts are PII (users type their postnummers), they are masked unless UPDATE_CAPTURE_TEXTS is true
+UPDATE_CAPTURE_FILE = os.getenv('UPDATE_CAPTURE_FILE', '')
+UPDATE_CAPTURE_SALT = os.getenv('UPDATE_CAPTURE_SALT', '')
+UPDATE_CAPTURE_TEXTS = os.getenv('UPDATE_CAPTURE_TEXTS', 'false').lower() == 'true'
+ANONYMOUS_NAME = 'User'
+DIGIT_PATTERN = re.compile(r'\d')
+LETTER_PATTERN = re.compile(r'[^\W\d_]')
+
+capture_lock = threading.Lock()
+missing_salt_logged = False
+
+
+def anonymize_chat_id(chat_id: int, salt: str) -> int:
+    digest = hmac.new(salt.encode('utf8'), str(chat_id).encode('utf8'), hashlib.sha256).hexdigest()
+    # a positive id that fits into a signed 64-bit int like a real chat id
+    return int(digest[:15], 16)
+
+
+def mask_text(text: Optional[str]) -> Optional[str]:
+    # the shape is kept, so a masked postnummer is still accepted as a postnummer on replay
+    if text is None:
+        return None
+    return LETTER_PATTERN.sub('x', DIGIT_PATTERN.sub('0', text))
+
+
+def anonymize_chat(chat: dict, salt: str) -> dict:
+    return {'id': anonymize_chat_id(chat['id'], salt), 'first_name': ANONYMOUS_NAME}
+
+
+def anonymize_update(update: dict, salt: str, keep_texts: bool = UPDATE_CAPTURE_TEXTS) -> Optional[dict]:
+    anonymous = {'update_id': update.get('update_id')}
+    if 'message' in update:
+        message = update['message']
+        anonymous['message'] = {
+            'message_id': message.get('message_id'),
+            'text': message.get('text') if keep_texts else mask_text(message.get('text')),
+            'chat': anonymize_chat(message['chat'], salt),
+        }
+    elif 'callback_query' in update:
+        callback_query = update['callback_query']
+        anonymous['callback_query'] = {
+            'data': callback_query.get('data'),
+            'message': {
+                'message_id': callback_query['message'].get('message_id'),
+                'chat': anonymize_chat(callback_query['message']['chat'], salt),
+            },
+        }
+    else:
+        return None
+    return anonymous
+
+
+def capture_update(update: dict, capture_file: str = UPDATE_CAPTURE_FILE, salt: str = UPDATE_CAPTURE_SALT):
+    global missing_salt_logged
+
+    if not capture_file:
+        return
+    if not salt:
+        if not missing_salt_logged:
+            missing_salt_logged = True
+            logger.error('UPDATE_CAPTURE_SALT is not set, updates are not captured to %s', capture_file)
+        return
+    try:
+        anonymous = anonymize_update(update, salt)
+        if anonymous is None:
+            return
+        line = json.dumps(anonymous, ensure_ascii=False) + '\n'
+        # updates of different chats are processed concurrently, lines are written one by one
+        with capture_lock:
+            with open(capture_file, 'a', encoding='utf8') as f:
+                f.write(line)
+    except (OSError, KeyError, TypeError) as error:
+        logger.error("Couldn't capture update. Error: %s", error, exc_info=True)
@@ -0,0 +1,125 @@
+import json
+import os
+import sys
+import time
+from typing import Iterable, Iterator, Optional
+
+from fake_telegram import FAKE_TOKEN, FakeTelegramServer
+
+# replays updates captured with UPDATE_CAPTURE_FILE one by one through lambda_handler,
+# with the fake telegram server and the in-memory storage backend, so every run starts from the same state
+REPLAY_MAX_MISMATCHES = int(os.getenv('REPLAY_MAX_MISMATCHES', '10'))
+COMPARED_METHODS = {'sendMessage', 'editMessageText'}
+
+fake_telegram = FakeTelegramServer().start()
+os.environ['TELEGRAM_API_URL'] = fake_telegram.url
+os.environ['TELEGRAM_BOT_TOKEN'] = FAKE_TOKEN
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ['UPDATE_CAPTURE_FILE'] = ''
+os.environ.setdefault('TURN_METRICS_ENABLED', 'false')
+
+import lambda_function
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def read_lines(file_name: str) -> Iterator[dict]:
+    with open(file_name, 'r', encoding='utf8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def replay_updates(updates: Iterable[dict]) -> Iterator[dict]:
+    for update in updates:
+        request_count = fake_telegram.get_request_count()
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(update, None)
+        latency_ms = (time.perf_counter() - start) * 1000
+        yield {
+            'update_id': update.get('update_id'),
+            'status_code': response['statusCode'],
+            'latency_ms': round(latency_ms, 3),
+            'requests': [
+                {'method': method, 'data': data}
+                for method, data in fake_telegram.get_requests(start=request_count) if method in COMPARED_METHODS
+            ],
+        }
+
+
+def get_mismatch(result: dict, expected: Optional[dict]) -> Optional[str]:
+    if expected is None:
+        return f'Update {result["update_id"]} is not in the expected results'
+    if result['update_id'] != expected['update_id']:
+        return f'Update {result["update_id"]} is replayed instead of {expected["update_id"]}'
+    if result['status_code'] != expected['status_code']:
+        return f'Update {result["update_id"]}: status {result["status_code"]} instead of {expected["status_code"]}'
+    if result['requests'] != expected['requests']:
+        return (
+            f'Update {result["update_id"]}: requests differ\n'
+            f'  expected: {json.dumps(expected["requests"], ensure_ascii=False)}\n'
+            f'  actual:   {json.dumps(result["requests"], ensure_ascii=False)}'
+        )
+    return None
+
+
+def print_latency(name: str, latencies_ms: list[float]):
+    print(
+        f'{name:>9}: {len(latencies_ms)} updates, '
+        f'p50 {percentile(latencies_ms, 0.5):8.2f} ms, '
+        f'p90 {percentile(latencies_ms, 0.9):8.2f} ms, '
+        f'p99 {percentile(latencies_ms, 0.99):8.2f} ms, '
+        f'total {sum(latencies_ms):10.1f} ms'
+    )
+
+
+def run_replay(updates_file: str, output_file: str, expected_file: Optional[str] = None) -> int:
+    fake_telegram.reset()
+    expected_results = read_lines(expected_file) if expected_file is not None else None
+    mismatch_count = 0
+    latencies_ms = []
+    expected_latencies_ms = []
+    with open(output_file, 'w', encoding='utf8') as output:
+        for result in replay_updates(read_lines(updates_file)):
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            latencies_ms.append(result['latency_ms'])
+            if expected_results is None:
+                continue
+            expected = next(expected_results, None)
+            if expected is not None:
+                expected_latencies_ms.append(expected['latency_ms'])
+            mismatch = get_mismatch(result, expected)
+            if mismatch is not None:
+                mismatch_count += 1
+                if mismatch_count <= REPLAY_MAX_MISMATCHES:
+                    print(mismatch)
+    if expected_results is not None:
+        missing_count = sum(1 for _ in expected_results)
+        if missing_count > 0:
+            print(f'{missing_count} expected updates are not replayed')
+            mismatch_count += missing_count
+
+    if len(latencies_ms) == 0:
+        print(f'No updates in {updates_file}')
+        return mismatch_count
+    if len(expected_latencies_ms) > 0:
+        print_latency('expected', expected_latencies_ms)
+    print_latency('replayed', latencies_ms)
+    if len(expected_latencies_ms) > 0:
+        print(f'Replay takes {sum(latencies_ms) / sum(expected_latencies_ms) * 100:.1f}% of the expected time')
+        print(f'{mismatch_count} of {len(latencies_ms)} updates differ from {expected_file}')
+    return mismatch_count
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: python3 update_replay.py <captured updates> <output results> [<expected results>]')
+        sys.exit(1)
+    try:
+        mismatches = run_replay(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    finally:
+        fake_telegram.stop()
+    sys.exit(1 if mismatches > 0 else 0)
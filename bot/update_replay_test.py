@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+
+import update_capture
+import update_replay
+
+temp_dir = tempfile.TemporaryDirectory()
+
+# only the fields the bot reads are captured, with a salted chat id
+message = {
+    'update_id': 10,
+    'message': {
+        'message_id': 5, 'text': 'hi', 'date': 1700000000,
+        'from': {'id': 42, 'first_name': 'Anna', 'username': 'anna'},
+        'chat': {'id': 42, 'first_name': 'Anna', 'last_name': 'Svensson', 'type': 'private'},
+    }
+}
+anonymous = update_capture.anonymize_update(message, salt='salt', keep_texts=True)
+assert anonymous == {
+    'update_id': 10,
+    'message': {'message_id': 5, 'text': 'hi', 'chat': {'id': update_capture.anonymize_chat_id(42, 'salt'), 'first_name': 'User'}},
+}
+assert update_capture.anonymize_chat_id(42, 'salt') != 42
+assert update_capture.anonymize_chat_id(42, 'salt') != update_capture.anonymize_chat_id(42, 'other salt')
+assert update_capture.anonymize_update({'update_id': 11, 'edited_message': {}}, salt='salt') is None
+# texts are masked unless they are kept explicitly
+masked = update_capture.anonymize_update(dict(message, message={**message['message'], 'text': 'Bor i 123 45'}), salt='salt')
+assert masked['message']['text'] == 'xxx x 000 00'
+
+# nothing is captured without a salt
+no_salt_file = os.path.join(temp_dir.name, 'no_salt.ndjson')
+update_capture.capture_update(message, no_salt_file, salt='')
+assert not os.path.exists(no_salt_file)
+
+updates_file = os.path.join(temp_dir.name, 'updates.ndjson')
+for update in [
+    message,
+    {'update_id': 11, 'callback_query': {'data': 'swedish', 'message': {'message_id': 6, 'chat': {'id': 42, 'first_name': 'Anna'}}}},
+    {'update_id': 12, 'message': {'message_id': 7, 'text': 'what?', 'chat': {'id': 42, 'first_name': 'Anna'}}},
+    {'update_id': 13, 'callback_query': {'data': 'feedback', 'message': {'message_id': 8, 'chat': {'id': 42, 'first_name': 'Anna'}}}},
+    {'update_id': 14, 'callback_query': {'data': 'good_conversation', 'message': {'message_id': 9, 'chat': {'id': 42, 'first_name': 'Anna'}}}},
+]:
+    update_capture.capture_update(update, updates_file, salt='salt')
+
+# a replay of the same build gives the same payloads
+base_file = os.path.join(temp_dir.name, 'base.ndjson')
+assert update_replay.run_replay(updates_file, base_file) == 0
+base_results = list(update_replay.read_lines(base_file))
+assert [r['update_id'] for r in base_results] == [10, 11, 12, 13, 14]
+assert [[request['method'] for request in r['requests']] for r in base_results] == [
+    ['sendMessage'],
+    ['sendMessage', 'editMessageText'],
+    ['sendMessage', 'editMessageText'],
+    ['sendMessage', 'editMessageText'],
+    ['editMessageText'],
+]
+assert base_results[0]['requests'][0]['data']['chat_id'] == update_capture.anonymize_chat_id(42, 'salt')
+
+# the conversation has ended with a feedback, so the next replay starts from the same state
+assert update_replay.run_replay(updates_file, os.path.join(temp_dir.name, 'same.ndjson'), base_file) == 0
+
+# a changed reply is reported
+changed_file = os.path.join(temp_dir.name, 'changed.ndjson')
+with open(changed_file, 'w') as f:
+    for result in base_results:
+        if result['update_id'] == 11:
+            result['requests'][0]['data']['text'] = 'Another text'
+        f.write(json.dumps(result) + '\n')
+assert update_replay.run_replay(updates_file, os.path.join(temp_dir.name, 'new.ndjson'), changed_file) == 1
+
+update_replay.fake_telegram.stop()
+temp_dir.cleanup()
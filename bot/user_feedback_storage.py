@@ -1,8 +1,8 @@
 import logging
+from typing import Optional
 
-from botocore.exceptions import ClientError
-
-from dynamo_db_provider import DynamoDb
+from analytics_buffer import ANALYTICS_BUFFER, AnalyticsBuffer
+from storage_backends import StorageBackend, StorageError, get_storage_backend
 
 logger = logging.getLogger(__name__)
 
@@ -10,58 +10,40 @@ USER_FEEDBACKS_TABLE = 'user_feedbacks'
 
 
 class UserFeedbackStorage:
-    def __init__(self):
-        self.dynamo_db = DynamoDb()
+    def __init__(self, backend: Optional[StorageBackend] = None, buffer: Optional[AnalyticsBuffer] = None):
+        self.backend = backend if backend is not None else get_storage_backend()
+        if buffer is None:
+            buffer = ANALYTICS_BUFFER if backend is None else AnalyticsBuffer(backend)
+        # items are written by the buffer in batches, see analytics_buffer.py
+        self.buffer = buffer
+
+    def get_table_schema(self) -> tuple[str, str, Optional[str]]:
+        # table name, partition key, sort key
+        return USER_FEEDBACKS_TABLE, 'session_id', 'chat_id'
 
     def create_table_if_not_exists(self):
         try:
-            dynamodb_client = self.dynamo_db.get_client()
-            existing_tables = dynamodb_client.list_tables()['TableNames']
-            if USER_FEEDBACKS_TABLE not in existing_tables:
-                dynamodb_client.create_table(
-                    TableName=USER_FEEDBACKS_TABLE,
-                    KeySchema=[
-                        {'AttributeName': 'session_id', 'KeyType': 'HASH'}, # Partition key
-                        {'AttributeName': 'chat_id', 'KeyType': 'RANGE'}, # Sort key
-                    ],
-                    AttributeDefinitions=[
-                        {'AttributeName': 'session_id', 'AttributeType': 'S'},
-                        {'AttributeName': 'chat_id', 'AttributeType': 'S'},
-                    ],
-                    ProvisionedThroughput={'ReadCapacityUnits': 10, 'WriteCapacityUnits': 10})
-                table = dynamodb_client.describe_table(TableName=USER_FEEDBACKS_TABLE)
-                table.wait_until_exists()
-        except ClientError as err:
+            self.backend.create_table_if_not_exists(*self.get_table_schema())
+        except StorageError as err:
             logger.error(
                 "Couldn't create table %s. Here's why: %s: %s", USER_FEEDBACKS_TABLE,
-                err.response['Error']['Code'], err.response['Error']['Message'],
+                err.code, err.message,
                 exc_info=True
             )
             raise err
 
     def save_feedback(self, chat_id: str, session_id: str, topic_id: str, vote: str):
-        try:
-            self.dynamo_db.get_client().put_item(
-                TableName=USER_FEEDBACKS_TABLE,
-                Item={
-                    "session_id": {'S': session_id},
-                    "chat_id": {'S': str(chat_id)},
-                    "topic_id": {'S': topic_id},
-                    "vote": {'S': vote}
-                }
-            )
-        except ClientError as err:
-            logger.error(
-                "Couldn't add new feedback to table %s. "
-                "chat_id: %s, session_id: %s, topic_id: %s, "
-                "vote: %s "
-                "Here's why: %s: %s",
-                USER_FEEDBACKS_TABLE,
-                chat_id, session_id, topic_id, vote,
-                err.response['Error']['Code'], err.response['Error']['Message'],
-                exc_info=True
-            )
-            raise err
+        self.buffer.add(
+            USER_FEEDBACKS_TABLE,
+            key={
+                "session_id": session_id,
+                "chat_id": str(chat_id),
+            },
+            attributes={
+                "topic_id": topic_id,
+                "vote": vote
+            }
+        )
 
 
 USER_FEEDBACK_STORAGE = UserFeedbackStorage()
@@ -1,8 +1,8 @@
 import logging
+from typing import Optional
 
-from botocore.exceptions import ClientError
-
-from dynamo_db_provider import DynamoDb
+from analytics_buffer import ANALYTICS_BUFFER, AnalyticsBuffer
+from storage_backends import StorageBackend, StorageError, get_storage_backend
 
 logger = logging.getLogger(__name__)
 
@@ -10,79 +10,49 @@ USER_REQUESTS_TABLE = 'user_requests'
 
 
 class UserRequestsStorage:
-    def __init__(self):
-        self.dynamo_db = DynamoDb()
+    def __init__(self, backend: Optional[StorageBackend] = None, buffer: Optional[AnalyticsBuffer] = None):
+        self.backend = backend if backend is not None else get_storage_backend()
+        if buffer is None:
+            buffer = ANALYTICS_BUFFER if backend is None else AnalyticsBuffer(backend)
+        # items are written by the buffer in batches, see analytics_buffer.py
+        self.buffer = buffer
+
+    def get_table_schema(self) -> tuple[str, str, Optional[str]]:
+        # table name, partition key, sort key
+        return USER_REQUESTS_TABLE, 'chat_id', 'response_message_id'
 
     def create_table_if_not_exists(self):
         try:
-            dynamodb_client = self.dynamo_db.get_client()
-            existing_tables = dynamodb_client.list_tables()['TableNames']
-            if USER_REQUESTS_TABLE not in existing_tables:
-                dynamodb_client.create_table(
-                    TableName=USER_REQUESTS_TABLE,
-                    KeySchema=[
-                        {'AttributeName': 'chat_id', 'KeyType': 'HASH'},  # Partition key
-                        {'AttributeName': 'response_message_id', 'KeyType': 'RANGE'}  # Sort key
-                    ],
-                    AttributeDefinitions=[
-                        {'AttributeName': 'chat_id', 'AttributeType': 'S'},
-                        {'AttributeName': 'response_message_id', 'AttributeType': 'S'}
-                    ],
-                    ProvisionedThroughput={'ReadCapacityUnits': 10, 'WriteCapacityUnits': 10})
-                table = dynamodb_client.describe_table(TableName=USER_REQUESTS_TABLE)
-                table.wait_until_exists()
-        except ClientError as err:
+            self.backend.create_table_if_not_exists(*self.get_table_schema())
+        except StorageError as err:
             logger.error(
                 "Couldn't create table %s. Here's why: %s: %s", USER_REQUESTS_TABLE,
-                err.response['Error']['Code'], err.response['Error']['Message'],
+                err.code, err.message,
                 exc_info=True
             )
             raise err
 
     def save_question(self, chat_id, question_message_id, question, response_message_id, answer):
-        try:
-            self.dynamo_db.get_client().put_item(
-                TableName=USER_REQUESTS_TABLE,
-                Item={
-                    "chat_id": {'S': str(chat_id)},
-                    "question_message_id": {'S': str(question_message_id)},
-                    "question": {'S': question},
-                    "response_message_id": {'S': str(response_message_id)},
-                    "answer": {'S': answer}
-                }
-            )
-        except ClientError as err:
-            logger.error(
-                "Couldn't add new request to table %s. "
-                "chat_id: %s, question_message_id: %s, question: %s, "
-                "response_message_id: %s, answer: %s "
-                "Here's why: %s: %s",
-                USER_REQUESTS_TABLE,
-                chat_id, question_message_id, question, response_message_id, answer,
-                err.response['Error']['Code'], err.response['Error']['Message'],
-                exc_info=True
-            )
-            raise err
+        self.buffer.add(
+            USER_REQUESTS_TABLE,
+            key={
+                "chat_id": str(chat_id),
+                "response_message_id": str(response_message_id),
+            },
+            attributes={
+                "question_message_id": str(question_message_id),
+                "question": question,
+                "answer": answer
+            }
+        )
 
     def save_vote(self, chat_id, response_message_id, vote):
-        try:
-            self.dynamo_db.get_client().update_item(
-                TableName=USER_REQUESTS_TABLE,
-                Key={'chat_id': {'S': str(chat_id)}, 'response_message_id': {'S': str(response_message_id)}},
-                UpdateExpression="SET vote = :val",
-                ExpressionAttributeValues={':val': {'S': vote}},
-                ReturnValues="UPDATED_NEW"
-            )
-        except ClientError as err:
-            logger.error(
-                "Couldn't add vote %s in table %s. chat_id: %s, response_message_id: %s "
-                "Here's why: %s: %s",
-                vote, USER_REQUESTS_TABLE,
-                str(chat_id), str(response_message_id),
-                err.response['Error']['Code'], err.response['Error']['Message'],
-                exc_info=True
-            )
-            raise err
+        # an update, the question and the answer of the item are kept
+        self.buffer.add_update(
+            USER_REQUESTS_TABLE,
+            key={'chat_id': str(chat_id), 'response_message_id': str(response_message_id)},
+            values={'vote': vote}
+        )
 
 
 USER_REQUESTS_STORAGE = UserRequestsStorage()
@@ -1,14 +1,23 @@
 import logging
+import os
+import threading
 import uuid
+from contextlib import contextmanager
 from typing import Optional
 
-from botocore.exceptions import ClientError
-
-from dynamo_db_provider import DynamoDb
+from lru_cache import LruCache
+from storage_backends import ConditionFailedError, StorageBackend, StorageError, get_storage_backend
 
 logger = logging.getLogger(__name__)
 
 USER_SESSION_TABLE = 'user_sessions'
+# 0 disables the cache
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '0'))
+SESSION_CACHE_TTL_SECONDS = float(os.getenv('SESSION_CACHE_TTL_SECONDS', '300'))
+
+
+class StaleSessionError(Exception):
+    pass
 
 
 class UserSession:
@@ -20,6 +29,7 @@ class UserSession:
             current_text: str,
             session_id: str = None,
             session_attributes: dict = None,
+            version: int = 0,
     ):
         if session_id is None:
             session_id = str(uuid.uuid4())
@@ -32,97 +42,113 @@ class UserSession:
         self.current_message_id = current_message_id
         self.current_text = current_text
         self.session_attributes = session_attributes
+        # increased by every write, a write with an outdated version is rejected
+        self.version = version
 
-    def get_update_attribute_values(self):
+    def copy(self) -> 'UserSession':
+        return UserSession(
+            chat_id=self.chat_id,
+            state_id=self.state_id,
+            current_message_id=self.current_message_id,
+            current_text=self.current_text,
+            session_id=self.session_id,
+            session_attributes=dict(self.session_attributes),
+            version=self.version,
+        )
+
+    def get_update_values(self):
         return {
-            ':session_id': {'S': self.session_id},
-            ':state_id': {'S': self.state_id},
-            ':current_message_id': {'N': str(self.current_message_id)},
-            ':current_text': {'S': self.current_text},
-            ':session_attributes': {'M': self.__attributes_to_ddb_map()},
+            'session_id': self.session_id,
+            'state_id': self.state_id,
+            'current_message_id': self.current_message_id,
+            'current_text': self.current_text,
+            'session_attributes': dict(self.session_attributes),
+            'version': self.version + 1,
         }
 
-    def to_item(self):
+    def get_attributes(self):
         return {
-            'chat_id': {'S': self.chat_id},
-            'session_id': {'S': self.session_id},
-            'state_id': {'S': self.state_id},
-            'current_message_id': {'N': str(self.current_message_id)},
-            'current_text': {'S': self.current_text},
-            'session_attributes': {'M': self.__attributes_to_ddb_map()},
+            'session_id': self.session_id,
+            'state_id': self.state_id,
+            'current_message_id': self.current_message_id,
+            'current_text': self.current_text,
+            'session_attributes': dict(self.session_attributes),
+            'version': self.version,
         }
 
-    def __attributes_to_ddb_map(self):
-        attributes = dict()
-        for k, v in self.session_attributes.items():
-            attributes[k] = {'S': v}
-        return attributes
-
-    def get_key_item(self):
-        return {'chat_id': {'S': self.chat_id}}
+    def get_key(self):
+        return {'chat_id': self.chat_id}
 
-    def get_session_attribute_values(self):
-        return {':session_id': {'S': self.session_id}}
+    @staticmethod
+    def from_item(item: dict):
+        return UserSession(
+            chat_id=item['chat_id'],
+            session_id=item['session_id'],
+            state_id=item['state_id'],
+            current_message_id=int(item['current_message_id']),
+            current_text=item['current_text'],
+            session_attributes=dict(item['session_attributes']),
+            version=int(item.get('version', 0)),
+        )
 
 
 class UserSessionStorage:
-    def __init__(self):
-        self.dynamo_db = DynamoDb()
+    def __init__(
+            self,
+            backend: Optional[StorageBackend] = None,
+            cache_size: int = SESSION_CACHE_SIZE,
+            cache_ttl_seconds: float = SESSION_CACHE_TTL_SECONDS
+    ):
+        self.backend = backend if backend is not None else get_storage_backend()
+        self.cache = LruCache(cache_size, cache_ttl_seconds) if cache_size > 0 else None
+        # chat_id -> session waiting for the end of coalesced_writes, None if nothing changed
+        self.deferred_sessions: dict[str, Optional[UserSession]] = dict()
+        self.lock = threading.Lock()
+
+    def get_table_schema(self) -> tuple[str, str, Optional[str]]:
+        # table name, partition key, sort key
+        return USER_SESSION_TABLE, 'chat_id', None
 
     def create_table_if_not_exists(self):
         try:
-            dynamodb_client = self.dynamo_db.get_client()
-            existing_tables = dynamodb_client.list_tables()['TableNames']
-            if USER_SESSION_TABLE not in existing_tables:
-                dynamodb_client.create_table(
-                    TableName=USER_SESSION_TABLE,
-                    KeySchema=[
-                        {'AttributeName': 'chat_id', 'KeyType': 'HASH'},  # Partition key
-                    ],
-                    AttributeDefinitions=[
-                        {'AttributeName': 'chat_id', 'AttributeType': 'S'},
-                    ],
-                    ProvisionedThroughput={'ReadCapacityUnits': 10, 'WriteCapacityUnits': 10})
-                table = dynamodb_client.describe_table(TableName=USER_SESSION_TABLE)
-                table.wait_until_exists()
-        except ClientError as err:
+            self.backend.create_table_if_not_exists(*self.get_table_schema())
+        except StorageError as err:
             logger.error(
                 "Couldn't create table %s. Here's why: %s: %s", USER_SESSION_TABLE,
-                err.response['Error']['Code'], err.response['Error']['Message'],
+                err.code, err.message,
                 exc_info=True
             )
             raise err
 
     def get_session(self, chat_id: str) -> Optional[UserSession]:
+        with self.lock:
+            deferred_session = self.deferred_sessions.get(chat_id)
+        if deferred_session is not None:
+            return deferred_session.copy()
+
+        if self.cache is not None:
+            cached_session = self.cache.get(chat_id)
+            if cached_session is not None:
+                return cached_session.copy()
+
+        user_session = self.__read_session(chat_id)
+        self.__cache_session(user_session)
+        return user_session
+
+    def __read_session(self, chat_id: str) -> Optional[UserSession]:
         try:
-            response = self.dynamo_db.get_client().get_item(
-                TableName=USER_SESSION_TABLE,
-                Key={
-                    'chat_id': {'S': chat_id}
-                }
-            )
-            data = response.get('Item')
-            if data is None:
+            item = self.backend.get_item(USER_SESSION_TABLE, {'chat_id': chat_id})
+            if item is None:
                 return None
-            session_attributes = dict()
-            for k, v in data.get('session_attributes')['M'].items():
-                session_attributes[k] = v['S']
-            return UserSession(
-                chat_id=chat_id,
-                session_id=data.get('session_id')['S'],
-                state_id=data.get('state_id')['S'],
-                current_message_id=int(data.get('current_message_id')['N']),
-                current_text=data.get('current_text')['S'],
-                session_attributes=session_attributes,
-            )
-        except ClientError as err:
+            return UserSession.from_item(item)
+        except StorageError as err:
             logger.error(
                 "Couldn't get user session to table %s. "
                 "chat_id: %s. "
                 "Here's why: %s: %s",
                 USER_SESSION_TABLE,
                 chat_id,
-                err.response['Error']['Code'], err.response['Error']['Message'],
+                err.code, err.message,
                 exc_info=True
             )
             raise err
@@ -146,65 +172,103 @@ class UserSessionStorage:
             raise Exception('Message id is None for new session')
         if new_session.current_text == '':
             raise Exception('Message text is empty for new session')
+        new_session.version = 1
         try:
-            self.dynamo_db.get_client().put_item(
-                TableName=USER_SESSION_TABLE,
-                Item=new_session.to_item()
-            )
-        except ClientError as err:
+            self.backend.put_item(USER_SESSION_TABLE, new_session.get_key(), new_session.get_attributes())
+            self.__cache_session(new_session)
+        except StorageError as err:
             logger.error(
                 "Couldn't add new user session to table %s. "
                 "chat_id: %s. "
                 "Here's why: %s: %s",
                 USER_SESSION_TABLE,
                 new_session.chat_id,
-                err.response['Error']['Code'], err.response['Error']['Message'],
+                err.code, err.message,
                 exc_info=True
             )
             raise err
 
     def update_user_session(self, user_session: UserSession):
+        with self.lock:
+            if user_session.chat_id in self.deferred_sessions:
+                self.deferred_sessions[user_session.chat_id] = user_session.copy()
+                return
+        self.__write_session(user_session)
+
+    def __write_session(self, user_session: UserSession):
         try:
-            self.dynamo_db.get_client().update_item(
-                TableName=USER_SESSION_TABLE,
-                Key=user_session.get_key_item(),
-                UpdateExpression="SET session_id = :session_id"
-                                 ", state_id = :state_id"
-                                 ", current_message_id = :current_message_id"
-                                 ", current_text = :current_text"
-                                 ", session_attributes = :session_attributes",
-                ExpressionAttributeValues=user_session.get_update_attribute_values(),
-                ReturnValues="UPDATED_NEW"
+            self.backend.update_item(
+                USER_SESSION_TABLE,
+                user_session.get_key(),
+                user_session.get_update_values(),
+                expected={'version': user_session.version}
             )
-        except ClientError as err:
+            user_session.version += 1
+            self.__cache_session(user_session)
+        except ConditionFailedError as err:
+            self.__forget_session(user_session.chat_id)
+            raise StaleSessionError(
+                f'Session {user_session.session_id} for chat {user_session.chat_id} '
+                f'was changed after version {user_session.version}'
+            ) from err
+        except StorageError as err:
             logger.error(
                 "Couldn't update user session %s in table %s. chat_id: %s. "
                 "Here's why: %s: %s",
                 user_session.session_id, USER_SESSION_TABLE,
                 str(user_session.chat_id),
-                err.response['Error']['Code'], err.response['Error']['Message'],
+                err.code, err.message,
                 exc_info=True
             )
             raise err
 
     def delete_session(self, user_session: UserSession):
+        with self.lock:
+            if user_session.chat_id in self.deferred_sessions:
+                self.deferred_sessions[user_session.chat_id] = None
+        self.__forget_session(user_session.chat_id)
         try:
-            self.dynamo_db.get_client().delete_item(
-                TableName=USER_SESSION_TABLE,
-                Key=user_session.get_key_item(),
-                ConditionExpression='session_id = :session_id',
-                ExpressionAttributeValues=user_session.get_session_attribute_values(),
+            self.backend.delete_item(
+                USER_SESSION_TABLE,
+                user_session.get_key(),
+                expected={'session_id': user_session.session_id}
             )
-        except ClientError as err:
+        except ConditionFailedError as err:
+            raise StaleSessionError(
+                f'Session {user_session.session_id} for chat {user_session.chat_id} '
+                f'was replaced or deleted before the delete'
+            ) from err
+        except StorageError as err:
             logger.error(
                 "Couldn't delete user session %s in table %s. chat_id: %s. "
                 "Here's why: %s: %s",
                 user_session.session_id, USER_SESSION_TABLE,
                 str(user_session.chat_id),
-                err.response['Error']['Code'], err.response['Error']['Message'],
+                err.code, err.message,
                 exc_info=True
             )
             raise err
 
+    @contextmanager
+    def coalesced_writes(self, chat_id: str):
+        # session updates of the chat are kept in memory and written once at the end
+        with self.lock:
+            self.deferred_sessions[chat_id] = None
+        try:
+            yield
+        finally:
+            with self.lock:
+                deferred_session = self.deferred_sessions.pop(chat_id, None)
+            if deferred_session is not None:
+                self.__write_session(deferred_session)
+
+    def __cache_session(self, user_session: Optional[UserSession]):
+        if self.cache is not None and user_session is not None:
+            self.cache.put(user_session.chat_id, user_session.copy())
+
+    def __forget_session(self, chat_id: str):
+        if self.cache is not None:
+            self.cache.pop(chat_id)
+
 
 USER_SESSION_STORAGE = UserSessionStorage()
@@ -1,9 +1,12 @@
+import hashlib
 import json
 import os
 import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from html.parser import HTMLParser
-from random import randint
-from time import sleep
 from typing import Optional
 
 import requests
@@ -11,6 +14,14 @@ import requests
 POSTNUMMER_KOMMUNE_FILE = 'postnummer_kommune.json'
 KOMMUNER_LINKS_FILE = 'kommunerlista.json'
 KOMMUNER_VUXENUTBILDNINGAR_FILE = 'lankar-till-vuxenutbildningar-i-sveriges-kommuner.json'
+KOMMUNES_FILE = 'kommunes.json'
+KOMMUNES_DIFF_FILE = 'kommunes_diff.json'
+# fetched pages with their ETag/Last-Modified and parsed pairs, one set of files per län
+PAGES_CACHE_DIR = os.getenv('PAGES_CACHE_DIR', 'pages_cache')
+FETCH_MAX_WORKERS = int(os.getenv('FETCH_MAX_WORKERS', '4'))
+# politeness limit: requests to the site start at least this often apart
+FETCH_INTERVAL_SECONDS = float(os.getenv('FETCH_INTERVAL_SECONDS', '1'))
+FETCH_TIMEOUT_SECONDS = float(os.getenv('FETCH_TIMEOUT_SECONDS', '30'))
 
 ALL_LAN_WORLDPOSTALCODES_LINKS = [
     "https://www.worldpostalcodes.org/l1/se/se/sverige/lista/r1/lista-over-postnummer-i-blekinge-lan",
@@ -178,79 +189,245 @@ def to_json_kommun_list(kommune_infos: list[KommuneInfo]):
     return json_list
 
 
-def read_and_save_from_worldpostalcodes():
+class RateLimiter:
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start_time = max(now, self.next_time)
+            self.next_time = start_time + self.interval_seconds
+        if start_time > now:
+            time.sleep(start_time - now)
+
+
+class LanPage:
+    def __init__(self, link: str, html: str, changed: bool):
+        self.link = link
+        self.html = html
+        self.changed = changed
+
+
+def get_lan_name(link: str) -> str:
+    return link.rstrip('/').split('/')[-1]
+
+
+def get_cache_file(cache_dir: str, link: str, suffix: str) -> str:
+    return os.path.join(cache_dir, get_lan_name(link) + suffix)
+
+
+def read_json_file(file_name: str):
+    if not os.path.isfile(file_name):
+        return None
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+
+def fetch_page(session, link: str, cache_dir: str, rate_limiter: RateLimiter) -> LanPage:
+    # a conditional request, the page counts as changed only when its content is different
+    html_file = get_cache_file(cache_dir, link, '.html')
+    meta_file = get_cache_file(cache_dir, link, '.meta.json')
+    meta = read_json_file(meta_file) if os.path.isfile(html_file) else None
+
+    headers = dict()
+    if meta is not None:
+        if meta.get('etag') is not None:
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified') is not None:
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    rate_limiter.wait()
+    response = session.get(link, headers=headers, timeout=FETCH_TIMEOUT_SECONDS)
+    if response.status_code == 304 and meta is not None:
+        with open(html_file, 'r') as f:
+            return LanPage(link, f.read(), changed=False)
+    if response.status_code != 200:
+        raise Exception(f'Can\'t fetch {link}: status {response.status_code}')
+
+    html = response.text
+    content_hash = hashlib.sha256(html.encode('utf8')).hexdigest()
+    save_to_file(html_file, html)
+    save_to_file(meta_file, json.dumps({
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'sha256': content_hash,
+    }))
+    return LanPage(link, html, changed=meta is None or meta.get('sha256') != content_hash)
+
+
+def fetch_pages(
+        session,
+        links: list[str],
+        cache_dir: str = PAGES_CACHE_DIR,
+        max_workers: int = FETCH_MAX_WORKERS,
+        interval_seconds: float = FETCH_INTERVAL_SECONDS
+) -> list[LanPage]:
+    os.makedirs(cache_dir, exist_ok=True)
+    rate_limiter = RateLimiter(interval_seconds)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda link: fetch_page(session, link, cache_dir, rate_limiter), links))
+
+
+def parse_lan_page(html: str) -> list[PostnummerKommunePair]:
     parser = PostnummerCommuneParser()
+    parser.feed(html)
+    parser.close()
+    return parser.postnummer_kommunes
+
+
+def collect_postnummer_kommunes(
+        pages: list[LanPage],
+        cache_dir: str = PAGES_CACHE_DIR
+) -> tuple[list[PostnummerKommunePair], list[str]]:
+    # only changed pages are parsed, pairs of other pages come from the cache
+    postnummer_kommunes = list()
+    parsed_lans = list()
+    for page in pages:
+        pairs_file = get_cache_file(cache_dir, page.link, '.pairs.json')
+        pairs_json = None if page.changed else read_json_file(pairs_file)
+        if pairs_json is None:
+            pairs = parse_lan_page(page.html)
+            save_to_file(pairs_file, json.dumps(to_json_list(pairs)))
+            parsed_lans.append(get_lan_name(page.link))
+        else:
+            pairs = [PostnummerKommunePair.from_json(p) for p in pairs_json]
+        postnummer_kommunes.extend(pairs)
+    return postnummer_kommunes, parsed_lans
+
 
-    for link in ALL_LAN_WORLDPOSTALCODES_LINKS:
-        response = requests.get(link)
-        parser.feed(response.text)
-        sleep(randint(1, 3))
+def read_and_save_from_worldpostalcodes(session=None, cache_dir: str = PAGES_CACHE_DIR) -> list[str]:
+    pages = fetch_pages(session or requests.Session(), ALL_LAN_WORLDPOSTALCODES_LINKS, cache_dir)
+    postnummer_kommunes, parsed_lans = collect_postnummer_kommunes(pages, cache_dir)
 
-    json_str = json.dumps(json_list, sort_keys=True, default=str)
+    json_str = json.dumps(to_json_list(postnummer_kommunes), sort_keys=True, default=str)
     save_to_file(POSTNUMMER_KOMMUNE_FILE, json_str)
+    return parsed_lans
 
 
-def load_from_file() -> list[PostnummerKommunePair]:
-    with open(POSTNUMMER_KOMMUNE_FILE, 'r') as f:
+def load_from_file(file_name: str = POSTNUMMER_KOMMUNE_FILE) -> list[PostnummerKommunePair]:
+    with open(file_name, 'r') as f:
         postnummer_kommunes_json = json.load(f)
         return list(map(lambda t: PostnummerKommunePair.from_json(t), postnummer_kommunes_json))
 
 
 def save_to_file(file_name: str, data: str):
-    f = open(file_name, "w")
-    f.write(data)
-    f.close()
-
-
-if not os.path.isfile(POSTNUMMER_KOMMUNE_FILE):
-    read_and_save_from_worldpostalcodes()
-
-postnummer_kommunes: list[PostnummerKommunePair] = load_from_file()
-
-kommuner_links = dict()
-with open(KOMMUNER_LINKS_FILE, 'r') as f:
-    kommuner_links: dict[str, str] = json.load(f)
-
-kommunes_vuxenutbildningar = dict()
-with open(KOMMUNER_VUXENUTBILDNINGAR_FILE, 'r') as f:
-    kommunes_vuxenutbildningar: dict[str, str] = json.load(f)
-
-# check kommunes_vuxenutbildningar
-undefined_kommun = set()
-for k in kommunes_vuxenutbildningar.keys():
-    if k not in kommuner_links.keys():
-        undefined_kommun.add(k)
-
-if len(undefined_kommun) > 0:
-    raise Exception(f'Undefined kommun in kommunes_vuxenutbildningar: {undefined_kommun}')
-
-# check postnummer_kommunes
-undefined_kommun = set()
-for pk in postnummer_kommunes:
-    k = pk.get_formatted_kommun()
-    if k not in kommuner_links.keys():
-        undefined_kommun.add(k)
-
-if len(undefined_kommun) > 0:
-    raise Exception(f'Undefined kommun in postnummer_kommunes: {undefined_kommun}')
-
-json_list = to_json_list(postnummer_kommunes)
-save_to_file(
-    'postnummer_kommune_pretty.json',
-    json.dumps(json_list, indent=2, sort_keys=True, default=str)
-)
-
-kommune_infos = collect_kommune_infos(
-    postnummer_kommunes=postnummer_kommunes,
-    kommuner_links=kommuner_links,
-    kommunes_vuxenutbildningar=kommunes_vuxenutbildningar
-)
-json_list = to_json_kommun_list(kommune_infos)
-save_to_file(
-    'kommunes.json',
-    json.dumps(json_list, sort_keys=True, default=str)
-)
-save_to_file(
-    'kommunes_pretty.json',
-    json.dumps(json_list, indent=2, sort_keys=True, default=str)
-)
+    with open(file_name, 'w') as f:
+        f.write(data)
+
+
+def check_kommunes(
+        postnummer_kommunes: list[PostnummerKommunePair],
+        kommuner_links: dict[str, str],
+        kommunes_vuxenutbildningar: dict[str, str]
+):
+    undefined_kommun = set()
+    for k in kommunes_vuxenutbildningar.keys():
+        if k not in kommuner_links.keys():
+            undefined_kommun.add(k)
+
+    if len(undefined_kommun) > 0:
+        raise Exception(f'Undefined kommun in kommunes_vuxenutbildningar: {undefined_kommun}')
+
+    undefined_kommun = set()
+    for pk in postnummer_kommunes:
+        k = pk.get_formatted_kommun()
+        if k not in kommuner_links.keys():
+            undefined_kommun.add(k)
+
+    if len(undefined_kommun) > 0:
+        raise Exception(f'Undefined kommun in postnummer_kommunes: {undefined_kommun}')
+
+
+def diff_kommunes(old_kommunes: list[dict], new_kommunes: list[dict]) -> dict:
+    old_by_name = {k['name']: k for k in old_kommunes}
+    new_by_name = {k['name']: k for k in new_kommunes}
+    changed = dict()
+    for name in sorted(old_by_name.keys() & new_by_name.keys()):
+        old, new = old_by_name[name], new_by_name[name]
+        kommun_diff = dict()
+        for field in ['kommun_link', 'vuxenutbildningar_link']:
+            if old.get(field) != new.get(field):
+                kommun_diff[field] = {'old': old.get(field), 'new': new.get(field)}
+        added_postnummers = sorted(set(new['postnummers']) - set(old['postnummers']))
+        removed_postnummers = sorted(set(old['postnummers']) - set(new['postnummers']))
+        if len(added_postnummers) > 0:
+            kommun_diff['added_postnummers'] = added_postnummers
+        if len(removed_postnummers) > 0:
+            kommun_diff['removed_postnummers'] = removed_postnummers
+        if len(kommun_diff) > 0:
+            changed[name] = kommun_diff
+    return {
+        'added': sorted(new_by_name.keys() - old_by_name.keys()),
+        'removed': sorted(old_by_name.keys() - new_by_name.keys()),
+        'changed': changed,
+    }
+
+
+def format_diff(diff: dict) -> list[str]:
+    lines = [f'+ {name}' for name in diff['added']] + [f'- {name}' for name in diff['removed']]
+    for name, kommun_diff in diff['changed'].items():
+        details = []
+        for field, value in kommun_diff.items():
+            if field.endswith('_postnummers'):
+                details.append(f'{field.split("_")[0]} {len(value)} postnummers')
+            else:
+                details.append(f'{field} {value["old"]} -> {value["new"]}')
+        lines.append(f'~ {name}: ' + ', '.join(details))
+    return lines
+
+
+def build_kommunes(
+        postnummer_kommunes_file: str = POSTNUMMER_KOMMUNE_FILE,
+        kommunes_file: str = KOMMUNES_FILE,
+        kommunes_diff_file: str = KOMMUNES_DIFF_FILE
+) -> dict:
+    postnummer_kommunes: list[PostnummerKommunePair] = load_from_file(postnummer_kommunes_file)
+
+    with open(KOMMUNER_LINKS_FILE, 'r') as f:
+        kommuner_links: dict[str, str] = json.load(f)
+
+    with open(KOMMUNER_VUXENUTBILDNINGAR_FILE, 'r') as f:
+        kommunes_vuxenutbildningar: dict[str, str] = json.load(f)
+
+    check_kommunes(postnummer_kommunes, kommuner_links, kommunes_vuxenutbildningar)
+
+    json_list = to_json_list(postnummer_kommunes)
+    save_to_file(
+        'postnummer_kommune_pretty.json',
+        json.dumps(json_list, indent=2, sort_keys=True, default=str)
+    )
+
+    kommune_infos = collect_kommune_infos(
+        postnummer_kommunes=postnummer_kommunes,
+        kommuner_links=kommuner_links,
+        kommunes_vuxenutbildningar=kommunes_vuxenutbildningar
+    )
+    json_list = to_json_kommun_list(kommune_infos)
+
+    old_json_list = read_json_file(kommunes_file) or list()
+    diff = diff_kommunes(old_json_list, json_list)
+    save_to_file(kommunes_diff_file, json.dumps(diff, indent=2, sort_keys=True, ensure_ascii=False))
+
+    save_to_file(
+        kommunes_file,
+        json.dumps(json_list, sort_keys=True, default=str)
+    )
+    save_to_file(
+        'kommunes_pretty.json',
+        json.dumps(json_list, indent=2, sort_keys=True, default=str)
+    )
+    return diff
+
+
+if __name__ == '__main__':
+    if '--refresh' in sys.argv or not os.path.isfile(POSTNUMMER_KOMMUNE_FILE):
+        changed_lans = read_and_save_from_worldpostalcodes()
+        print(f'Parsed {len(changed_lans)} changed län: {changed_lans}')
+
+    kommunes_diff = build_kommunes()
+    for diff_line in format_diff(kommunes_diff):
+        print(diff_line)
+    print(f'{KOMMUNES_FILE} is saved, the diff is in {KOMMUNES_DIFF_FILE}')
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import index_commune_parser as parser
+
+FIXTURES_DIR = 'fixtures'
+BLEKINGE_LINK = 'https://www.worldpostalcodes.org/l1/se/se/sverige/lista/r1/lista-over-postnummer-i-blekinge-lan'
+GOTLAND_LINK = 'https://www.worldpostalcodes.org/l1/se/se/sverige/lista/r1/lista-over-postnummer-i-gotlands-lan'
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, text: str = '', headers: dict = None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or dict()
+
+
+class FakeSession:
+    # serves fixtures instead of worldpostalcodes.org, with ETags like a real server
+    def __init__(self):
+        self.pages = dict()
+        self.requests = list()
+
+    def set_page(self, link: str, fixture_file: str):
+        with open(os.path.join(FIXTURES_DIR, fixture_file), 'r') as f:
+            self.pages[link] = f.read()
+
+    def get(self, link: str, headers: dict = None, timeout: float = None):
+        self.requests.append((link, headers))
+        html = self.pages[link]
+        etag = '"' + hashlib.sha256(html.encode('utf8')).hexdigest()[:16] + '"'
+        if (headers or dict()).get('If-None-Match') == etag:
+            return FakeResponse(304)
+        return FakeResponse(200, html, {'ETag': etag})
+
+
+def build_kommunes(pairs: list[parser.PostnummerKommunePair]) -> list[dict]:
+    kommuner_links = {p.get_formatted_kommun(): 'https://kommun.se' for p in pairs}
+    return parser.to_json_kommun_list(parser.collect_kommune_infos(pairs, kommuner_links, dict()))
+
+
+with open(os.path.join(FIXTURES_DIR, 'lista-over-postnummer-i-blekinge-lan.html'), 'r') as fixture:
+    blekinge_pairs = parser.parse_lan_page(fixture.read())
+assert [(p.postnummer, p.get_formatted_kommun()) for p in blekinge_pairs] == [
+    ('29331', 'Olofström'), ('29332', 'Olofström'), ('37130', 'Karlskrona')
+]
+
+session = FakeSession()
+session.set_page(BLEKINGE_LINK, 'lista-over-postnummer-i-blekinge-lan.html')
+session.set_page(GOTLAND_LINK, 'lista-over-postnummer-i-gotlands-lan.html')
+links = [BLEKINGE_LINK, GOTLAND_LINK]
+
+with tempfile.TemporaryDirectory() as cache_dir:
+    # the first run fetches and parses everything
+    pages = parser.fetch_pages(session, links, cache_dir, interval_seconds=0)
+    assert [p.changed for p in pages] == [True, True]
+    first_pairs, parsed_lans = parser.collect_postnummer_kommunes(pages, cache_dir)
+    assert parsed_lans == ['lista-over-postnummer-i-blekinge-lan', 'lista-over-postnummer-i-gotlands-lan']
+    assert len(first_pairs) == 4
+
+    # unchanged pages are answered with 304 and not parsed again
+    pages = parser.fetch_pages(session, links, cache_dir, interval_seconds=0)
+    assert all(headers.get('If-None-Match') is not None for _, headers in session.requests[-2:])
+    assert [p.changed for p in pages] == [False, False]
+    pairs, parsed_lans = parser.collect_postnummer_kommunes(pages, cache_dir)
+    assert parsed_lans == []
+    assert parser.to_json_list(pairs) == parser.to_json_list(first_pairs)
+
+    # only the changed län is parsed, the diff shows the new postnummer
+    session.set_page(GOTLAND_LINK, 'lista-over-postnummer-i-gotlands-lan-updated.html')
+    pages = parser.fetch_pages(session, links, cache_dir, interval_seconds=0)
+    assert [p.changed for p in pages] == [False, True]
+    pairs, parsed_lans = parser.collect_postnummer_kommunes(pages, cache_dir)
+    assert parsed_lans == ['lista-over-postnummer-i-gotlands-lan']
+
+    diff = parser.diff_kommunes(build_kommunes(first_pairs), build_kommunes(pairs))
+    assert diff == {'added': [], 'removed': [], 'changed': {'Gotland': {'added_postnummers': ['62142']}}}, diff
+    assert parser.format_diff(diff) == ['~ Gotland: added 1 postnummers']
+    assert json.loads(json.dumps(diff)) == diff
+
+# requests start at least an interval apart, whatever the number of workers
+rate_limiter = parser.RateLimiter(0.05)
+start = time.monotonic()
+for _ in range(3):
+    rate_limiter.wait()
+assert time.monotonic() - start >= 0.1